@@ -0,0 +1,285 @@
+"""API routes for administrative monitoring of the application."""
+
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+from sqlalchemy.orm import Session
+
+from ..core.rate_limit import admission_controller
+from ..core.request_profiler import profile_store
+from ..core.single_flight import single_flight
+from ..database.audit import AuditEvent, audit_log, get_audit_db
+from ..database.backup import BackupInProgressError, backup_worker, list_snapshots
+from ..database.config import get_db
+from ..database.counters import TOTAL, read_counts
+from ..database.db_models import User
+from ..database.transactions import transaction_stats
+from ..schemas.admin_schemas import AdminSummary, BackupResponse, RequestProfileResponse
+from ..schemas.audit_schemas import AuditEventResponse
+from .users import get_current_user
+
+router = APIRouter()
+
+
+@router.get('/admin/rate-limits')
+def admin_rate_limit_stats(current_user: User = Depends(get_current_user)):
+    """
+    Retrieve the admission control counters. Admin access only.
+
+    Attributes:
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        dict: Admitted and shed request counts and the current in-flight value.
+
+    Raises:
+        HTTPException: HTTP 403 if user does not have access.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Not enough privileges to access this resource',
+        )
+    return admission_controller.stats()
+
+
+@router.get('/admin/transactions')
+def admin_transaction_stats(current_user: User = Depends(get_current_user)):
+    """
+    Retrieve the write transaction counters. Admin access only.
+
+    Attributes:
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        dict: Committed write transactions, attempts retried because the database was
+        locked, and transactions that gave up after their last attempt.
+
+    Raises:
+        HTTPException: HTTP 403 if user does not have access.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Not enough privileges to access this resource',
+        )
+    return transaction_stats.snapshot()
+
+
+@router.get('/admin/coalescing')
+def admin_coalescing_stats(current_user: User = Depends(get_current_user)):
+    """
+    Retrieve the counters of the coalesced reads. Admin access only.
+
+    Attributes:
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        dict: Queries run, requests that shared the result of an identical one in flight,
+        requests that timed out waiting for it, and the queries in flight in this worker.
+
+    Raises:
+        HTTPException: HTTP 403 if user does not have access.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Not enough privileges to access this resource',
+        )
+    return single_flight.stats()
+
+
+@router.get('/admin/profiles', response_model=List[RequestProfileResponse])
+def admin_list_profiles(
+    route: Optional[str] = None, current_user: User = Depends(get_current_user)
+):
+    """
+    Retrieve the stored request profiles, slowest first. Admin access only.
+
+    Profiles are taken for the requests of admins sending ``X-Profile: 1`` or
+    ``?profile=1``, and for the slowest requests of each route when the rolling
+    sampler is on.
+
+    Attributes:
+        route (Optional[str]): Only profiles of this route template, e.g. '/trainings/{training_id}'.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        List of the profile descriptions.
+
+    Raises:
+        HTTPException: HTTP 403 if user does not have access.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Not enough privileges to access this resource',
+        )
+    return profile_store.list(route)
+
+
+@router.get('/admin/profiles/{profile_id}', response_class=PlainTextResponse)
+def admin_get_profile(profile_id: str, current_user: User = Depends(get_current_user)):
+    """
+    Download the stacks of a request profile in the folded format. Admin access only.
+
+    The file can be rendered with flamegraph.pl or opened in speedscope.
+
+    Attributes:
+        profile_id (str): The ID of the profile.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        PlainTextResponse: One line per distinct stack with its number of samples.
+
+    Raises:
+        HTTPException: HTTP 403 if user does not have access.
+        HTTPException: HTTP 404 if profile not found.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Not enough privileges to access this resource',
+        )
+    folded = profile_store.folded(profile_id)
+    if folded is None:
+        raise HTTPException(status_code=404, detail='Profile not found')
+    return PlainTextResponse(
+        folded, headers={'Content-Disposition': f'attachment; filename="{profile_id}.folded"'}
+    )
+
+
+@router.get('/admin/summary', response_model=AdminSummary)
+def admin_summary(
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Retrieve the numbers of users, datasets, models and trainings. Admin access only.
+
+    The numbers are read from counts maintained on every create and delete, so the
+    cost does not grow with the size of the tables.
+
+    Attributes:
+        limit (int): Maximum number of users whose counts are returned.
+        offset (int): Number of users skipped, in ID order.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        AdminSummary: The totals and the per-user counts of the requested page.
+
+    Raises:
+        HTTPException: HTTP 403 if user does not have access.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Not enough privileges to access this resource',
+        )
+    users = db.query(User.id, User.email).order_by(User.id).offset(offset).limit(limit).all()
+    counts = read_counts(db, [TOTAL] + [user.id for user in users])
+    return {
+        'totals': counts[TOTAL],
+        'users': [{'user_id': user.id, 'email': user.email, **counts[user.id]} for user in users],
+    }
+
+
+@router.get('/admin/audit', response_model=List[AuditEventResponse])
+def admin_list_audit_events(
+    entity: Optional[str] = None,
+    action: Optional[str] = None,
+    actor_id: Optional[int] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    audit_db: Session = Depends(get_audit_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Retrieve the audit trail of created and deleted records, newest first. Admin access only.
+
+    Attributes:
+        entity (Optional[str]): Only events about this kind of record, e.g. 'dataset'.
+        action (Optional[str]): Only 'create' or 'delete' events.
+        actor_id (Optional[int]): Only events caused by this user.
+        limit (int): Maximum number of events returned.
+        offset (int): Number of matching events skipped.
+        audit_db (Session): SQLAlchemy session to access the audit database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        List of audit events.
+
+    Raises:
+        HTTPException: HTTP 403 if user does not have access.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Not enough privileges to access this resource',
+        )
+    # Include the events still waiting in memory
+    audit_log.flush()
+    events = audit_db.query(AuditEvent)
+    if entity:
+        events = events.filter(AuditEvent.entity == entity)
+    if action:
+        events = events.filter(AuditEvent.action == action)
+    if actor_id is not None:
+        events = events.filter(AuditEvent.actor_id == actor_id)
+    return events.order_by(AuditEvent.id.desc()).offset(offset).limit(limit).all()
+
+
+@router.post('/admin/backups', status_code=status.HTTP_202_ACCEPTED)
+def admin_create_backup(current_user: User = Depends(get_current_user)):
+    """
+    Start backing up the databases into a new snapshot. Admin access only.
+
+    The backup runs in the background while the routes keep serving, the snapshot is
+    listed by ``/admin/backups`` once complete.
+
+    Attributes:
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        dict: The name of the snapshot being taken.
+
+    Raises:
+        HTTPException: HTTP 403 if user does not have access.
+        HTTPException: HTTP 409 if a backup is already running.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Not enough privileges to access this resource',
+        )
+    try:
+        name = backup_worker.trigger()
+    except BackupInProgressError as exc:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(exc))
+    return {'name': name}
+
+
+@router.get('/admin/backups', response_model=List[BackupResponse])
+def admin_list_backups(current_user: User = Depends(get_current_user)):
+    """
+    Retrieve the complete snapshots, newest first. Admin access only.
+
+    Attributes:
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        List of snapshots with the size and checksum of each database copy.
+
+    Raises:
+        HTTPException: HTTP 403 if user does not have access.
+    """
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail='Not enough privileges to access this resource',
+        )
+    return list_snapshots()
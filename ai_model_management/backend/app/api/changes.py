@@ -0,0 +1,168 @@
+"""API route for following the changes to datasets, models and trainings."""
+
+from fastapi import APIRouter, Depends, Query
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session
+
+from ..database.config import SHARD_ID_BITS, engine, get_db, shard_router
+from ..database.db_models import Change, Dataset, Model, Training, User
+from ..schemas.change_schemas import ChangeFeed
+from ..schemas.dataset_schemas import DatasetResponse
+from ..schemas.model_schemas import ModelResponse
+from ..schemas.training_schemas import TrainingResponse
+from .users import get_current_user
+
+router = APIRouter()
+
+# Table and response schema of the rows of each entity of the feed
+ENTITIES = {
+    'dataset': (Dataset, DatasetResponse),
+    'model': (Model, ModelResponse),
+    'training': (Training, TrainingResponse),
+}
+
+
+def read_page(db: Session, since: int, limit: int, visible, bind=None) -> tuple:
+    """
+    Read a page of the changefeed of one database.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        since (int): The sequence number after which the changes are read.
+        limit (int): Maximum number of changes read.
+        visible: The condition on the changes the user can see.
+        bind (Engine | None): The engine of the database, the one the session is set
+            to if not given.
+
+    Returns:
+        tuple: The changes in sequence order, the cursor of the next page, whether more
+        changes follow and whether changes after ``since`` were pruned.
+    """
+    bind_arguments = None if bind is None else {'bind': bind}
+    # Bound the page first: changes committed meanwhile have higher sequence numbers
+    latest, oldest = db.execute(
+        select(func.max(Change.seq), func.min(Change.seq)), bind_arguments=bind_arguments
+    ).one()
+    if latest is None:
+        return [], since, False, False
+    # Columns rather than entities: the sequence numbers of two databases overlap, and
+    # the session would return the change of one for the same number of the other
+    rows = db.execute(
+        select(Change.seq, Change.entity, Change.entity_id, Change.action)
+        .where(Change.seq > since, Change.seq <= latest, visible)
+        .order_by(Change.seq)
+        .limit(limit + 1),
+        bind_arguments=bind_arguments,
+    ).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    cursor = rows[-1].seq if has_more else max(since, latest)
+    # Sequence numbers have no gaps, so a missing one after the cursor was pruned
+    return rows, cursor, has_more, since + 1 < oldest
+
+
+def read_current(db: Session, rows: list, bind=None) -> tuple:
+    """
+    Keep the latest change of each row of a page and read the current data of the rows.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        rows (list): The changes of the page, in sequence order.
+        bind (Engine | None): The engine of the database, the one the session is set
+            to if not given.
+
+    Returns:
+        tuple: The latest change by (entity, ID), and the current data by (entity, ID).
+    """
+    latest_changes = {}
+    for row in rows:
+        latest_changes.pop((row.entity, row.entity_id), None)
+        latest_changes[row.entity, row.entity_id] = row
+    current = {}
+    for entity, (table, schema) in ENTITIES.items():
+        ids = [
+            entity_id
+            for (changed, entity_id), row in latest_changes.items()
+            if changed == entity and row.action != 'delete'
+        ]
+        if ids:
+            records = db.scalars(
+                select(table).where(table.id.in_(ids)),
+                bind_arguments=None if bind is None else {'bind': bind},
+            )
+            for record in records:
+                current[entity, record.id] = schema.model_validate(record).model_dump()
+    return latest_changes, current
+
+
+@router.get('/changes', response_model=ChangeFeed)
+def list_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(500, ge=1, le=5000),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Get the datasets, models and trainings created, updated or deleted since a cursor.
+
+    The feed shows the rows the list routes show: the user's own rows and the
+    datasets and models of admins. Each changed row appears once per page with its
+    latest change and its current data, deletes and moves to the archive appear as
+    tombstones. Starting with ``since=0`` and passing back the returned cursor keeps
+    a local mirror up to date.
+
+    With sharded storage, the feed of a user who is not an admin merges the feed of
+    their shard with the changes of the admins' rows in the main database. The cursor
+    then holds both positions, the one in the main database in its upper bits.
+
+    Attributes:
+        since (int): The cursor returned by the previous call, 0 for the whole feed.
+        limit (int): Maximum number of changes read for the page.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        ChangeFeed: The changes and the cursor of the next call.
+    """
+    admins = select(User.id).where(User.is_admin)
+    shared = and_(Change.entity != 'training', Change.user_id.in_(admins))
+    if not shard_router.enabled or current_user.is_admin:
+        rows, cursor, has_more, reset = read_page(
+            db, since, limit, or_(Change.user_id == current_user.id, shared)
+        )
+        latest_changes, current = read_current(db, rows)
+    else:
+        main_since, shard_since = since >> SHARD_ID_BITS, since & ((1 << SHARD_ID_BITS) - 1)
+        rows, shard_cursor, has_more, reset = read_page(
+            db, shard_since, limit, Change.user_id == current_user.id
+        )
+        latest_changes, current = read_current(db, rows)
+        main_cursor = main_since
+        if len(rows) < limit:
+            main_rows, main_cursor, main_more, main_reset = read_page(
+                db, main_since, limit - len(rows), shared, engine
+            )
+            main_changes, main_current = read_current(db, main_rows, engine)
+            latest_changes.update(main_changes)
+            current.update(main_current)
+            has_more, reset = has_more or main_more, reset or main_reset
+        else:
+            # The page is full before the main database was read
+            has_more = True
+        cursor = (main_cursor << SHARD_ID_BITS) | shard_cursor
+
+    return {
+        'cursor': cursor,
+        'has_more': has_more,
+        'reset': reset,
+        'changes': [
+            {
+                'seq': row.seq,
+                'entity': row.entity,
+                'entity_id': row.entity_id,
+                'action': row.action,
+                'data': current.get(key),
+            }
+            for key, row in latest_changes.items()
+        ],
+    }
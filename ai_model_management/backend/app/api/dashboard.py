@@ -0,0 +1,92 @@
+"""API route returning everything the user dashboard shows in one request."""
+
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.orm import Session
+
+from ..database.config import get_db
+from ..database.counters import read_counts
+from ..database.db_models import Dataset, Model, Training, User
+from ..schemas.dashboard_schemas import DashboardResponse
+from .users import get_current_user, list_visible
+
+router = APIRouter()
+
+# Default number of datasets, models and trainings in each list of the dashboard
+DASHBOARD_LIMIT = int(os.environ.get('DASHBOARD_LIMIT', 5))
+
+# Seconds each section may be reused by the client, the lists change more slowly
+# than the counts and the scores, and the user hardly ever
+SECTION_MAX_AGE = {
+    'user': 300,
+    'counts': 10,
+    'datasets': 30,
+    'models': 30,
+    'trainings': 10,
+    'top_trainings': 30,
+}
+
+
+@router.get('/dashboard', response_model=DashboardResponse, response_model_exclude_unset=True)
+def get_dashboard(
+    response: Response,
+    sections: Optional[str] = None,
+    limit: int = Query(DASHBOARD_LIMIT, ge=1, le=50),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Get the data of the user dashboard.
+
+    Replaces calling ``/users/me``, ``/datasets``, ``/models`` and ``/trainings`` after
+    login: the token is checked once and the bounded queries share one session. Each
+    section comes with the seconds it may be reused in ``max_age``, so that the client
+    can ask again for the stale ``sections`` only; the ``Cache-Control`` header carries
+    the shortest of them.
+
+    Attributes:
+        response (Response): The response, to set the caching headers.
+        sections (Optional[str]): Comma-separated sections to return, all by default: 'user',
+            'counts', 'datasets', 'models', 'trainings', 'top_trainings'.
+        limit (int): Maximum number of records in each list.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        DashboardResponse: The requested sections and their maximum ages.
+
+    Raises:
+        HTTPException: HTTP 400 if a requested section is unknown.
+    """
+    requested = {name.strip() for name in sections.split(',')} if sections else set(SECTION_MAX_AGE)
+    if not requested <= SECTION_MAX_AGE.keys():
+        raise HTTPException(
+            status_code=400, detail=f'sections must be among {", ".join(SECTION_MAX_AGE)}'
+        )
+
+    dashboard = {
+        'max_age': {name: age for name, age in SECTION_MAX_AGE.items() if name in requested}
+    }
+    if 'user' in requested:
+        dashboard['user'] = current_user
+    if 'counts' in requested:
+        dashboard['counts'] = read_counts(db, [current_user.id])[current_user.id]
+    # Newest first by primary key, the lists are the first ones of /datasets and /models
+    for name, table in (('datasets', Dataset), ('models', Model)):
+        if name in requested:
+            dashboard[name] = list_visible(db, table, current_user, newest=limit)
+    trainings = db.query(Training).filter(Training.user_id == current_user.id)
+    if 'trainings' in requested:
+        dashboard['trainings'] = trainings.order_by(Training.id.desc()).limit(limit).all()
+    if 'top_trainings' in requested:
+        dashboard['top_trainings'] = (
+            trainings.filter(Training.precision.is_not(None))
+            .order_by(Training.precision.desc(), Training.id.desc())
+            .limit(limit)
+            .all()
+        )
+
+    response.headers['Cache-Control'] = f'private, max-age={min(dashboard["max_age"].values())}'
+    return dashboard
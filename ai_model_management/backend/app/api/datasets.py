@@ -1,14 +1,30 @@
 """API routes for creating, listing, and fetching specific datasets."""
 
-from typing import List
+import json
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
-from ..database.config import get_db
-from ..database.db_models import Dataset, User
-from ..schemas.dataset_schemas import DatasetCreate, DatasetResponse
-from .users import get_current_user
+from ..core.blob_store import blob_store
+from ..core.prefix_index import dataset_index
+from ..core.profiling import profile_worker
+from ..core.single_flight import coalesced_json
+from ..database.audit import audit_log
+from ..database.config import get_db, use_record_shard
+from ..database.db_models import Dataset, DatasetProfile, User
+from ..database.transactions import commit
+from ..database.write_batcher import write_batcher
+from ..schemas.dataset_schemas import (
+    DatasetCreate,
+    DatasetProfileResponse,
+    DatasetResponse,
+    DatasetSuggestion,
+)
+from ..schemas.upload_schemas import UploadStatus
+from .uploads import finish_upload, get_upload, receive_chunk, release_file
+from .users import get_current_user, get_visible, home_shard, list_visible, visible_to
 
 router = APIRouter()
 
@@ -35,9 +51,9 @@ def create_dataset(
         name=dataset.name,
         user_id=current_user.id,
     )
-    db.add(new_dataset)
-    db.commit()
-    db.refresh(new_dataset)
+    new_dataset = write_batcher.insert(new_dataset, home_shard(current_user))
+    dataset_index.add(current_user.id, new_dataset.id, new_dataset.name, current_user.is_admin)
+    audit_log.record('create', 'dataset', new_dataset.id, current_user, name=new_dataset.name)
     return new_dataset
 
 
@@ -54,16 +70,35 @@ def list_datasets(db: Session = Depends(get_db), current_user: User = Depends(ge
         List of all datasets in the database.
     """
 
-    datasets = (
-        db.query(Dataset)
-        .filter((Dataset.user_id == current_user.id) | User.is_admin)
-        .join(User)
-        .all()
-    )
+    datasets = list_visible(db, Dataset, current_user)
 
     return datasets
 
 
+@router.get('/datasets/autocomplete', response_model=List[DatasetSuggestion])
+def autocomplete_datasets(
+    q: str,
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Suggest datasets whose name starts with the typed prefix.
+
+    Suggestions are served from an in-memory prefix index instead of the database.
+
+    Attributes:
+        q (str): The typed prefix, matched case-insensitively.
+        limit (int): Maximum number of suggestions.
+        db (Session): SQLAlchemy session used to load the index on first use.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        List of datasets visible to the user whose name starts with the prefix.
+    """
+    return dataset_index.search(db, current_user.id, q, limit)
+
+
 @router.get('/datasets/{dataset_id}', response_model=DatasetResponse)
 def get_dataset(
     dataset_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)
@@ -83,17 +118,234 @@ def get_dataset(
          HTTPException: HTTP 404 if dataset not found.
     """
 
-    dataset = (
-        db.query(Dataset)
-        .join(User)
-        .filter((Dataset.id == dataset_id) & ((Dataset.user_id == current_user.id) | User.is_admin))
-        .first()
-    )
+    dataset = get_visible(db, Dataset, dataset_id, current_user)
     if not dataset:
         raise HTTPException(status_code=404, detail='Dataset not found')
     return dataset
 
 
+def get_owned_dataset(dataset_id: int, db: Session, current_user: User) -> Dataset:
+    """
+    Retrieve a dataset the current user may modify: their own, or any for an admin.
+
+    Attributes:
+        dataset_id (int): The ID of the dataset.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        Dataset: The dataset.
+
+    Raises:
+        HTTPException: HTTP 404 if dataset not found.
+    """
+    dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+    if not dataset or (dataset.user_id != current_user.id and not current_user.is_admin):
+        raise HTTPException(status_code=404, detail='Dataset not found')
+    return dataset
+
+
+@router.get('/datasets/{dataset_id}/profile', response_model=DatasetProfileResponse)
+def get_dataset_profile(
+    dataset_id: int,
+    response: Response,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Retrieve the row count, column types, null rates and histograms of a dataset file.
+
+    The profile is computed in the background the first time it is requested, and
+    the request is answered with HTTP 202 until it is ready. It is cached against the
+    content hash of the file, so identical files are profiled only once.
+
+    Attributes:
+        dataset_id (int): The ID of the dataset.
+        response (Response): The response, whose status is set to 202 while profiling.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        DatasetProfileResponse: The profile, or its status while it is computed.
+
+    Raises:
+        HTTPException: HTTP 404 if dataset or its data file not found.
+    """
+    dataset = get_dataset(dataset_id=dataset_id, db=db, current_user=current_user)
+    if not dataset.file_hash:
+        raise HTTPException(status_code=404, detail='Dataset has no uploaded file')
+
+    cached = db.get(DatasetProfile, dataset.file_hash)
+    if cached is None:
+        profile_worker.submit(dataset.file_hash, blob_store.blob_path(dataset.file_hash))
+        response.status_code = status.HTTP_202_ACCEPTED
+        return {'status': 'running', 'file_hash': dataset.file_hash}
+    if cached.error:
+        return {'status': 'failed', 'file_hash': dataset.file_hash, 'error': cached.error}
+    return {
+        'status': 'ready',
+        'file_hash': dataset.file_hash,
+        'profile': json.loads(cached.profile),
+    }
+
+
+@router.post('/datasets/{dataset_id}/uploads', response_model=UploadStatus)
+def start_dataset_upload(
+    dataset_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)
+):
+    """
+    Start a resumable upload of the data file of a dataset.
+
+    The file is then sent in chunks with ``PUT /datasets/{dataset_id}/uploads/{upload_id}``
+    and attached to the dataset with ``POST .../complete``.
+
+    Attributes:
+        dataset_id (int): The ID of the dataset.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        UploadStatus: The identifier of the new upload.
+
+    Raises:
+        HTTPException: HTTP 404 if dataset not found.
+    """
+    get_owned_dataset(dataset_id, db, current_user)
+    upload = blob_store.start_upload(f'dataset-{dataset_id}')
+    return {'upload_id': upload.upload_id, 'offset': upload.offset}
+
+
+@router.get('/datasets/{dataset_id}/uploads/{upload_id}', response_model=UploadStatus)
+def get_dataset_upload_status(
+    dataset_id: int,
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Retrieve the offset an interrupted upload must be resumed from.
+
+    Attributes:
+        dataset_id (int): The ID of the dataset.
+        upload_id (str): The identifier of the upload.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        UploadStatus: The number of bytes received so far.
+
+    Raises:
+        HTTPException: HTTP 404 if dataset or upload not found.
+    """
+    get_owned_dataset(dataset_id, db, current_user)
+    upload = get_upload(f'dataset-{dataset_id}', upload_id)
+    return {'upload_id': upload.upload_id, 'offset': upload.offset}
+
+
+@router.put('/datasets/{dataset_id}/uploads/{upload_id}', response_model=UploadStatus)
+async def upload_dataset_chunk(
+    dataset_id: int,
+    upload_id: str,
+    offset: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Append a chunk, sent as the raw request body, to an upload.
+
+    The body is streamed to disk and hashed as it arrives, so memory use does not
+    depend on the chunk size.
+
+    Attributes:
+        dataset_id (int): The ID of the dataset.
+        upload_id (str): The identifier of the upload.
+        offset (int): The position of the chunk in the file, must equal the bytes received so far.
+        request (Request): The request whose body is the chunk.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        UploadStatus: The number of bytes received so far.
+
+    Raises:
+        HTTPException: HTTP 404 if dataset or upload not found.
+        HTTPException: HTTP 409 if the offset does not match or another chunk is being written.
+    """
+    # The lookups query the database and may read the partial file, off the event loop
+    await run_in_threadpool(get_owned_dataset, dataset_id, db, current_user)
+    upload = await run_in_threadpool(get_upload, f'dataset-{dataset_id}', upload_id)
+    await receive_chunk(upload, offset, request)
+    return {'upload_id': upload.upload_id, 'offset': upload.offset}
+
+
+@router.post('/datasets/{dataset_id}/uploads/{upload_id}/complete', response_model=DatasetResponse)
+def complete_dataset_upload(
+    dataset_id: int,
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Attach a finished upload to its dataset.
+
+    The file is stored under its content hash, so a file identical to one already
+    uploaded, by any user, is stored only once.
+
+    Attributes:
+        dataset_id (int): The ID of the dataset.
+        upload_id (str): The identifier of the upload.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        DatasetResponse: The dataset with its file size, hash and row count.
+
+    Raises:
+        HTTPException: HTTP 404 if dataset or upload not found.
+        HTTPException: HTTP 409 if a chunk is still being uploaded.
+    """
+    dataset = get_owned_dataset(dataset_id, db, current_user)
+    upload = get_upload(f'dataset-{dataset_id}', upload_id)
+    with finish_upload(upload) as file_hash:
+        previous_hash = dataset.file_hash
+        dataset.file_hash = file_hash
+        dataset.file_size = upload.offset
+        dataset.row_count = upload.row_count
+        commit(db)
+    if previous_hash and previous_hash != file_hash:
+        release_file(previous_hash, db)
+    db.refresh(dataset)
+    return dataset
+
+
+@router.delete('/datasets/{dataset_id}/uploads/{upload_id}', status_code=status.HTTP_200_OK)
+def abort_dataset_upload(
+    dataset_id: int,
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Discard an upload in progress.
+
+    Attributes:
+        dataset_id (int): The ID of the dataset.
+        upload_id (str): The identifier of the upload.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        dict: A message indicating the upload was discarded.
+
+    Raises:
+        HTTPException: HTTP 404 if dataset or upload not found.
+    """
+    get_owned_dataset(dataset_id, db, current_user)
+    blob_store.abort_upload(get_upload(f'dataset-{dataset_id}', upload_id))
+    return {'message': f"Upload {upload_id} discarded"}
+
+
 # Admin functionality: Endpoints related to administrative tasks
 
 
@@ -127,17 +379,24 @@ def admin_create_dataset(
 
 @router.get('/admin/datasets', response_model=List[DatasetResponse])
 def admin_list_datasets(
-    db: Session = Depends(get_db), current_user: User = Depends(get_current_user)
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
 ):
     """
     Get all datasets. Admin access only.
 
+    The datasets created by admins are listed, in the main database with sharded storage.
+
     Attributes:
+        limit (Optional[int]): Maximum number of datasets returned, all if not given.
+        offset (int): Number of datasets skipped, in ID order.
         db (Session): SQLAlchemy session to access the database.
         current_user (User): The currently authenticated user.
 
     Returns:
-        List of all datasets in the database.
+        List of all datasets in the database, as JSON shared by the identical requests in flight.
 
     Raises:
         HTTPException: HTTP 403 if user does not have access.
@@ -147,7 +406,15 @@ def admin_list_datasets(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Not enough privileges to access this resource',
         )
-    return list_datasets(db=db, current_user=current_user)
+
+    def query():
+        datasets = visible_to(db.query(Dataset), Dataset, current_user)
+        return datasets.order_by(Dataset.id).offset(offset).limit(limit).all()
+
+    # Every admin sees the same datasets, identical concurrent requests share one query
+    return coalesced_json(
+        ('admin_list_datasets', 'admin', limit, offset), List[DatasetResponse], query
+    )
 
 
 @router.delete('/admin/datasets/{dataset_id}', status_code=status.HTTP_200_OK)
@@ -174,12 +441,18 @@ def admin_delete_dataset(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Not enough privileges to access this resource',
         )
-    dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
+    dataset = None
+    if use_record_shard(db, dataset_id):
+        dataset = db.query(Dataset).filter(Dataset.id == dataset_id).first()
     if not dataset:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Dataset not found')
 
     db.delete(dataset)
-    db.commit()
+    commit(db)
+    audit_log.record('delete', 'dataset', dataset.id, current_user, name=dataset.name)
+    if dataset.file_hash:
+        release_file(dataset.file_hash, db)
+    dataset_index.remove(dataset.user_id, dataset.id, dataset.name)
     return {'message': f"Dataset with {dataset_id} ID deleted successfully"}
 
 
@@ -206,4 +479,6 @@ def admin_get_dataset(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Not enough privileges to access this resource',
         )
+    if not use_record_shard(db, dataset_id):
+        raise HTTPException(status_code=404, detail='Dataset not found')
     return get_dataset(dataset_id=dataset_id, db=db, current_user=current_user)
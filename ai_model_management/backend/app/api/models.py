@@ -1,14 +1,24 @@
 """API routes for creating, listing, and fetching specific models."""
 
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
-from ..database.config import get_db
+from ..core.blob_store import blob_store
+from ..core.file_response import ZeroCopyFileResponse
+from ..core.prefix_index import model_index
+from ..core.single_flight import coalesced_json
+from ..database.audit import audit_log
+from ..database.config import get_db, use_record_shard
 from ..database.db_models import Model, User
-from ..schemas.model_schemas import ModelCreate, ModelResponse
-from .users import get_current_user
+from ..database.transactions import commit
+from ..database.write_batcher import write_batcher
+from ..schemas.model_schemas import ModelCreate, ModelResponse, ModelSuggestion
+from ..schemas.upload_schemas import UploadStatus
+from .uploads import finish_upload, get_upload, receive_chunk, release_file
+from .users import get_current_user, get_visible, home_shard, list_visible, visible_to
 
 router = APIRouter()
 
@@ -35,9 +45,9 @@ def create_model(
         name=model.name,
         user_id=current_user.id,
     )
-    db.add(new_model)
-    db.commit()
-    db.refresh(new_model)
+    new_model = write_batcher.insert(new_model, home_shard(current_user))
+    audit_log.record('create', 'model', new_model.id, current_user, name=new_model.name)
+    model_index.add(current_user.id, new_model.id, new_model.name, current_user.is_admin)
     return new_model
 
 
@@ -54,13 +64,35 @@ def list_models(db: Session = Depends(get_db), current_user: User = Depends(get_
         List of all models in the database.
     """
 
-    models = (
-        db.query(Model).filter((Model.user_id == current_user.id) | User.is_admin).join(User).all()
-    )
+    models = list_visible(db, Model, current_user)
 
     return models
 
 
+@router.get('/models/autocomplete', response_model=List[ModelSuggestion])
+def autocomplete_models(
+    q: str,
+    limit: int = Query(10, ge=1, le=50),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Suggest models whose name starts with the typed prefix.
+
+    Suggestions are served from an in-memory prefix index instead of the database.
+
+    Attributes:
+        q (str): The typed prefix, matched case-insensitively.
+        limit (int): Maximum number of suggestions.
+        db (Session): SQLAlchemy session used to load the index on first use.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        List of models visible to the user whose name starts with the prefix.
+    """
+    return model_index.search(db, current_user.id, q, limit)
+
+
 @router.get('/models/{model_id}', response_model=ModelResponse)
 def get_model(
     model_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)
@@ -80,18 +112,221 @@ def get_model(
         HTTPException: HTTP 404 if model not found.
     """
 
-    model = (
-        db.query(Model)
-        .join(User)
-        .filter((Model.id == model_id) & ((Model.user_id == current_user.id) | User.is_admin))
-        .first()
-    )
+    model = get_visible(db, Model, model_id, current_user)
 
     if not model:
         raise HTTPException(status_code=404, detail='Model not found')
     return model
 
 
+def get_owned_model(model_id: int, db: Session, current_user: User) -> Model:
+    """
+    Retrieve a model the current user may modify: their own, or any for an admin.
+
+    Attributes:
+        model_id (int): The ID of the model.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        Model: The model.
+
+    Raises:
+        HTTPException: HTTP 404 if model not found.
+    """
+    model = db.query(Model).filter(Model.id == model_id).first()
+    if not model or (model.user_id != current_user.id and not current_user.is_admin):
+        raise HTTPException(status_code=404, detail='Model not found')
+    return model
+
+
+@router.post('/models/{model_id}/artifact/uploads', response_model=UploadStatus)
+def start_model_artifact_upload(
+    model_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)
+):
+    """
+    Start a resumable upload of the artifact (weights) of a model.
+
+    The file is then sent in chunks with ``PUT /models/{model_id}/artifact/uploads/{upload_id}``
+    and attached to the model with ``POST .../complete``.
+
+    Attributes:
+        model_id (int): The ID of the model.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        UploadStatus: The identifier of the new upload.
+
+    Raises:
+        HTTPException: HTTP 404 if model not found.
+    """
+    get_owned_model(model_id, db, current_user)
+    upload = blob_store.start_upload(f'model-{model_id}')
+    return {'upload_id': upload.upload_id, 'offset': upload.offset}
+
+
+@router.get('/models/{model_id}/artifact/uploads/{upload_id}', response_model=UploadStatus)
+def get_model_artifact_upload_status(
+    model_id: int,
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Retrieve the offset an interrupted artifact upload must be resumed from.
+
+    Attributes:
+        model_id (int): The ID of the model.
+        upload_id (str): The identifier of the upload.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        UploadStatus: The number of bytes received so far.
+
+    Raises:
+        HTTPException: HTTP 404 if model or upload not found.
+    """
+    get_owned_model(model_id, db, current_user)
+    upload = get_upload(f'model-{model_id}', upload_id)
+    return {'upload_id': upload.upload_id, 'offset': upload.offset}
+
+
+@router.put('/models/{model_id}/artifact/uploads/{upload_id}', response_model=UploadStatus)
+async def upload_model_artifact_chunk(
+    model_id: int,
+    upload_id: str,
+    offset: int,
+    request: Request,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Append a chunk, sent as the raw request body, to an artifact upload.
+
+    Attributes:
+        model_id (int): The ID of the model.
+        upload_id (str): The identifier of the upload.
+        offset (int): The position of the chunk in the file, must equal the bytes received so far.
+        request (Request): The request whose body is the chunk.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        UploadStatus: The number of bytes received so far.
+
+    Raises:
+        HTTPException: HTTP 404 if model or upload not found.
+        HTTPException: HTTP 409 if the offset does not match or another chunk is being written.
+    """
+    # The lookups query the database and may read the partial file, off the event loop
+    await run_in_threadpool(get_owned_model, model_id, db, current_user)
+    upload = await run_in_threadpool(get_upload, f'model-{model_id}', upload_id)
+    await receive_chunk(upload, offset, request)
+    return {'upload_id': upload.upload_id, 'offset': upload.offset}
+
+
+@router.post(
+    '/models/{model_id}/artifact/uploads/{upload_id}/complete', response_model=ModelResponse
+)
+def complete_model_artifact_upload(
+    model_id: int,
+    upload_id: str,
+    filename: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Attach a finished upload to its model as the model artifact.
+
+    Attributes:
+        model_id (int): The ID of the model.
+        upload_id (str): The identifier of the upload.
+        filename (Optional[str]): The file name suggested to clients downloading the artifact.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        ModelResponse: The model with its artifact size and SHA-256 checksum.
+
+    Raises:
+        HTTPException: HTTP 404 if model or upload not found.
+        HTTPException: HTTP 409 if a chunk is still being uploaded.
+    """
+    model = get_owned_model(model_id, db, current_user)
+    upload = get_upload(f'model-{model_id}', upload_id)
+    with finish_upload(upload) as artifact_hash:
+        previous_hash = model.artifact_hash
+        model.artifact_hash = artifact_hash
+        model.artifact_size = upload.offset
+        model.artifact_name = filename
+        commit(db)
+    if previous_hash and previous_hash != artifact_hash:
+        release_file(previous_hash, db)
+    db.refresh(model)
+    return model
+
+
+@router.delete('/models/{model_id}/artifact/uploads/{upload_id}', status_code=status.HTTP_200_OK)
+def abort_model_artifact_upload(
+    model_id: int,
+    upload_id: str,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Discard an artifact upload in progress.
+
+    Attributes:
+        model_id (int): The ID of the model.
+        upload_id (str): The identifier of the upload.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        dict: A message indicating the upload was discarded.
+
+    Raises:
+        HTTPException: HTTP 404 if model or upload not found.
+    """
+    get_owned_model(model_id, db, current_user)
+    blob_store.abort_upload(get_upload(f'model-{model_id}', upload_id))
+    return {'message': f"Upload {upload_id} discarded"}
+
+
+@router.api_route('/models/{model_id}/artifact', methods=['GET', 'HEAD'])
+def download_model_artifact(
+    model_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)
+):
+    """
+    Download the artifact of a model.
+
+    ``Range`` requests are answered with the requested bytes, so downloads can be
+    resumed or split into parallel fetches; ``If-Range`` takes the SHA-256 ETag.
+    The file is sent by the kernel or from a memory map, never read whole into memory.
+
+    Attributes:
+        model_id (int): The ID of the model.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        ZeroCopyFileResponse: The artifact file.
+
+    Raises:
+        HTTPException: HTTP 404 if model or artifact not found.
+    """
+    model = get_model(model_id=model_id, db=db, current_user=current_user)
+    if not model.artifact_hash:
+        raise HTTPException(status_code=404, detail='Model artifact not found')
+    return ZeroCopyFileResponse(
+        blob_store.blob_path(model.artifact_hash),
+        etag=model.artifact_hash,
+        filename=model.artifact_name or f'{model.name}.bin',
+    )
+
+
 # Admin functionality: Endpoints related to administrative tasks
 
 
@@ -125,17 +360,24 @@ def admin_create_model(
 
 @router.get('/admin/models', response_model=List[ModelResponse])
 def admin_list_models(
-    db: Session = Depends(get_db), current_user: User = Depends(get_current_user)
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
 ):
     """
     Get all models. Admin access only.
 
+    The models created by admins are listed, in the main database with sharded storage.
+
     Attributes:
+        limit (Optional[int]): Maximum number of models returned, all if not given.
+        offset (int): Number of models skipped, in ID order.
         db (Session): SQLAlchemy session to access the database.
         current_user (User): The currently authenticated user.
 
     Returns:
-        List of all models in the database.
+        List of all models in the database, as JSON shared by the identical requests in flight.
 
     Raises:
         HTTPException: HTTP 403 if user does not have access.
@@ -145,7 +387,13 @@ def admin_list_models(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Not enough privileges to access this resource',
         )
-    return list_models(db=db, current_user=current_user)
+
+    def query():
+        models = visible_to(db.query(Model), Model, current_user)
+        return models.order_by(Model.id).offset(offset).limit(limit).all()
+
+    # Every admin sees the same models, identical concurrent requests share one query
+    return coalesced_json(('admin_list_models', 'admin', limit, offset), List[ModelResponse], query)
 
 
 @router.delete('/admin/models/{model_id}', status_code=status.HTTP_200_OK)
@@ -172,11 +420,17 @@ def admin_delete_model(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Not enough privileges to access this resource',
         )
-    model = db.query(Model).filter(Model.id == model_id).first()
+    model = None
+    if use_record_shard(db, model_id):
+        model = db.query(Model).filter(Model.id == model_id).first()
     if not model:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Model not found')
     db.delete(model)
-    db.commit()
+    commit(db)
+    audit_log.record('delete', 'model', model.id, current_user, name=model.name)
+    if model.artifact_hash:
+        release_file(model.artifact_hash, db)
+    model_index.remove(model.user_id, model.id, model.name)
     return {'message': f"Model with {model_id} ID deleted successfully"}
 
 
@@ -204,4 +458,6 @@ def admin_get_model(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Not enough privileges to access this resource',
         )
+    if not use_record_shard(db, model_id):
+        raise HTTPException(status_code=404, detail='Model not found')
     return get_model(model_id=model_id, db=db, current_user=current_user)
@@ -0,0 +1,214 @@
+"""API routes for launching hyperparameter sweeps and following their progress."""
+
+import json
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.orm import Session
+
+from ..core.result_cache import get_result, training_fingerprint
+from ..core.sweeps import (
+    SweepError,
+    expand_grid,
+    sample_random,
+    sweep_runner,
+    update_best,
+)
+from ..database.audit import audit_log
+from ..database.config import get_db
+from ..database.db_models import Sweep, Training, TrainingResult, User
+from ..database.transactions import begin_write, commit
+from ..schemas.sweep_schemas import SweepCreate, SweepResponse
+from ..schemas.training_schemas import TrainingResponse
+from .trainings import get_trainable_dataset, get_trainable_model
+from .users import get_current_user
+
+router = APIRouter()
+
+
+@router.post('/sweeps', response_model=SweepResponse)
+def create_sweep(
+    sweep: SweepCreate,
+    force_fresh: bool = False,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Launch a hyperparameter sweep.
+
+    The grid or random-search specification is expanded into one training per
+    parameter combination. The trainings are inserted in a single transaction and
+    run in parallel on the sweep worker processes, except those identical to an
+    earlier run, which complete immediately with the cached results.
+
+    Attributes:
+        sweep (SweepCreate): An object containing the details of the sweep to be launched.
+        force_fresh (bool): Run every training even if identical results are cached.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        SweepResponse: The launched sweep.
+
+    Raises:
+        HTTPException: HTTP 404 if model or dataset not found.
+        HTTPException: HTTP 400 if the grid or random-search specification is invalid.
+    """
+    model = get_trainable_model(sweep.model_id, db, current_user)
+    dataset = get_trainable_dataset(sweep.dataset_id, db, current_user)
+
+    if (sweep.grid is None) == (sweep.random is None):
+        raise HTTPException(status_code=400, detail='Give either a grid or a random search')
+    try:
+        if sweep.grid is not None:
+            strategy, space = 'grid', sweep.grid
+            combinations = expand_grid(sweep.grid)
+        else:
+            strategy, space = 'random', sweep.random.model_dump()
+            combinations = sample_random(
+                space['parameters'], sweep.random.trials, sweep.random.seed
+            )
+    except SweepError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+
+    new_sweep = Sweep(
+        sweep_name=sweep.sweep_name,
+        model_id=model.id,
+        model_name=model.name,
+        dataset_id=dataset.id,
+        dataset_name=dataset.name,
+        strategy=strategy,
+        space=json.dumps(space),
+        metric=sweep.metric,
+        total=len(combinations),
+        completed=0,
+        failed=0,
+        user_id=current_user.id,
+    )
+    begin_write(db, TrainingResult, Sweep)
+    db.add(new_sweep)
+    db.flush()
+    trainings, queued = [], []
+    for number, params in enumerate(combinations, start=1):
+        training = Training(
+            training_name=f'{sweep.sweep_name}-{number}',
+            model_id=model.id,
+            model_name=model.name,
+            dataset_id=dataset.id,
+            dataset_name=dataset.name,
+            sweep_id=new_sweep.id,
+            params=json.dumps(params),
+            status='queued',
+            reused=False,
+            user_id=current_user.id,
+        )
+        cached = None
+        if not force_fresh:
+            cached = get_result(db, training_fingerprint(model, dataset, params))
+        if cached is not None:
+            training.precision, training.recall = cached.precision, cached.recall
+            training.status, training.reused = 'completed', True
+        trainings.append(training)
+    db.add_all(trainings)
+    db.flush()
+    for training, params in zip(trainings, combinations):
+        if training.reused:
+            new_sweep.completed += 1
+            update_best(
+                new_sweep, training.id, {'precision': training.precision, 'recall': training.recall}
+            )
+        else:
+            queued.append((training.id, model.id, dataset.id, params))
+    commit(db)
+
+    audit_log.record(
+        'create',
+        'sweep',
+        new_sweep.id,
+        current_user,
+        name=new_sweep.sweep_name,
+        trainings=len(trainings),
+    )
+    sweep_runner.submit(new_sweep.id, queued)
+    # Trainings that could not be queued were recorded as failed meanwhile
+    db.refresh(new_sweep)
+    return new_sweep
+
+
+@router.get('/sweeps', response_model=List[SweepResponse])
+def list_sweeps(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+    """
+    Get all sweeps of the current user.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        List of the sweeps with their progress.
+    """
+    return db.query(Sweep).filter(Sweep.user_id == current_user.id).all()
+
+
+def get_owned_sweep(sweep_id: int, db: Session, current_user: User) -> Sweep:
+    """
+    Retrieve a sweep launched by the current user.
+
+    Attributes:
+        sweep_id (int): The ID of the sweep.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        Sweep: The sweep.
+
+    Raises:
+        HTTPException: HTTP 404 if sweep not found.
+    """
+    sweep = db.query(Sweep).filter(Sweep.id == sweep_id, Sweep.user_id == current_user.id).first()
+    if not sweep:
+        raise HTTPException(status_code=404, detail='Sweep not found')
+    return sweep
+
+
+@router.get('/sweeps/{sweep_id}', response_model=SweepResponse)
+def get_sweep(
+    sweep_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)
+):
+    """
+    Get the progress and best result so far of a sweep.
+
+    Attributes:
+        sweep_id (int): The ID of the sweep.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        SweepResponse: The sweep.
+
+    Raises:
+        HTTPException: HTTP 404 if sweep not found.
+    """
+    return get_owned_sweep(sweep_id, db, current_user)
+
+
+@router.get('/sweeps/{sweep_id}/trainings', response_model=List[TrainingResponse])
+def list_sweep_trainings(
+    sweep_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)
+):
+    """
+    Get the child trainings of a sweep with their parameters and scores.
+
+    Attributes:
+        sweep_id (int): The ID of the sweep.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        List of the trainings of the sweep.
+
+    Raises:
+        HTTPException: HTTP 404 if sweep not found.
+    """
+    sweep = get_owned_sweep(sweep_id, db, current_user)
+    return db.query(Training).filter(Training.sweep_id == sweep.id).order_by(Training.id).all()
@@ -1,30 +1,104 @@
 """API routes for creating, listing, and fetching specific trainings."""
 
-import random
-from typing import List
+import json
+import os
+import tempfile
+from typing import List, Literal, Optional
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
 from sqlalchemy.orm import Session
 
-from ..database.config import get_db
+from ..core.blob_store import blob_store
+from ..core.evaluation import EvaluationError, evaluate
+from ..core.metric_series import (
+    DOWNSAMPLING,
+    MetricError,
+    append_points,
+    list_metrics,
+    read_series,
+)
+from ..core.result_cache import get_result, put_result, training_fingerprint
+from ..core.single_flight import coalesced_json
+from ..core.training_runner import run_training
+from ..database.audit import audit_log
+from ..database.config import get_db, get_record
 from ..database.db_models import Dataset, Model, Training, User
-from ..schemas.training_schemas import TrainingCreate, TrainingResponse
-from .users import get_current_user
+from ..database.retention import TrainingChunk, get_archive_db
+from ..database.transactions import DatabaseBusyError, commit
+from ..database.write_batcher import write_batcher
+from ..schemas.training_schemas import (
+    MetricAppend,
+    MetricAppendResponse,
+    MetricSeriesResponse,
+    MetricSummary,
+    TrainingCreate,
+    TrainingEvaluationResponse,
+    TrainingResponse,
+)
+from .users import get_current_user, get_visible, home_shard
 
 router = APIRouter()
 
 
+def get_trainable_model(model_id: int, db: Session, current_user: User) -> Model:
+    """
+    Retrieve a model the current user can train: their own or one created by an admin.
+
+    Attributes:
+        model_id (int): The ID of the model.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        Model: The model.
+
+    Raises:
+        HTTPException: HTTP 404 if model not found.
+    """
+    model = get_visible(db, Model, model_id, current_user)
+    if not model:
+        raise HTTPException(status_code=404, detail=f"The Model with ID {model_id} not found")
+    return model
+
+
+def get_trainable_dataset(dataset_id: int, db: Session, current_user: User) -> Dataset:
+    """
+    Retrieve a dataset the current user can train on: their own or one created by an admin.
+
+    Attributes:
+        dataset_id (int): The ID of the dataset.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        Dataset: The dataset.
+
+    Raises:
+        HTTPException: HTTP 404 if dataset not found.
+    """
+    dataset = get_visible(db, Dataset, dataset_id, current_user)
+    if not dataset:
+        raise HTTPException(status_code=404, detail=f"The Dataset with ID {dataset_id} not found")
+    return dataset
+
+
 @router.post('/trainings', response_model=TrainingResponse)
 def create_training(
     training: TrainingCreate,
+    force_fresh: bool = False,
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
 ):
     """
     Create a new training.
 
+    A run identical to an earlier one, i.e. same model version, dataset content and
+    parameters, completes immediately with the cached results and is flagged as reused.
+
     Attributes:
         training (TrainingCreate): An object containing the details of training to be created.
+        force_fresh (bool): Run the training even if identical results are cached.
         current_user (User): The currently authenticated user.
 
     Returns:
@@ -33,69 +107,207 @@ def create_training(
     Raises:
         HTTPException: HTTP 404 if model or dataset not found.
     """
+    model = get_trainable_model(training.model_id, db, current_user)
+    dataset = get_trainable_dataset(training.dataset_id, db, current_user)
 
-    # Check if the model created by the current user or admin exists
-    model = (
-        db.query(Model)
-        .join(User)
-        .filter(
-            (Model.id == training.model_id) & ((Model.user_id == current_user.id) | User.is_admin)
-        )
-        .first()
+    fingerprint = training_fingerprint(model, dataset, training.params)
+    cached = None if force_fresh else get_result(db, fingerprint)
+    if cached is not None:
+        result = {'precision': cached.precision, 'recall': cached.recall}
+        commit(db)
+    else:
+        result = run_training(model.id, dataset.id, training.params)
+
+    new_training = write_batcher.insert(
+        Training(
+            training_name=training.training_name,
+            model_id=training.model_id,
+            model_name=model.name,
+            dataset_id=training.dataset_id,
+            dataset_name=dataset.name,
+            precision=result['precision'],
+            recall=result['recall'],
+            params=json.dumps(training.params),
+            reused=cached is not None,
+            user_id=current_user.id,
+        ),
+        home_shard(current_user),
     )
-    if not model:
+    if cached is None:
+        try:
+            put_result(db, fingerprint, result['precision'], result['recall'], new_training.id)
+        except DatabaseBusyError:
+            # The training is committed, failing would make the client create it again;
+            # only the reuse of its results by identical runs is lost
+            db.rollback()
+    audit_log.record(
+        'create', 'training', new_training.id, current_user, name=new_training.training_name
+    )
+    return new_training
+
+
+TRAINING_SORT_KEYS = ('id', 'creation_date', 'precision', 'recall')
+
+
+@router.get('/trainings', response_model=List[TrainingResponse])
+def list_trainings(
+    model_id: Optional[int] = None,
+    dataset_id: Optional[int] = None,
+    min_precision: Optional[float] = None,
+    max_precision: Optional[float] = None,
+    min_recall: Optional[float] = None,
+    max_recall: Optional[float] = None,
+    sort: str = 'id',
+    order: Literal['asc', 'desc'] = 'asc',
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Get the trainings of the current user, optionally filtered, sorted and paginated.
+
+    Sorting by a metric, alone or with a model or dataset filter, reads the
+    (user_id, [model_id | dataset_id,] metric) indexes in order, so that e.g. the 20
+    best trainings by recall on a dataset are found without sorting all of them.
+    Trainings not run yet have no metrics, they come first in ascending order and
+    last in descending order, and are excluded by the metric ranges.
+
+    Attributes:
+        model_id (Optional[int]): Only the trainings of this model.
+        dataset_id (Optional[int]): Only the trainings on this dataset.
+        min_precision (Optional[float]): Only the trainings with at least this precision.
+        max_precision (Optional[float]): Only the trainings with at most this precision.
+        min_recall (Optional[float]): Only the trainings with at least this recall.
+        max_recall (Optional[float]): Only the trainings with at most this recall.
+        sort (str): The field to sort by: 'id', 'creation_date', 'precision' or 'recall'.
+        order (str): 'asc' or 'desc'.
+        limit (Optional[int]): Maximum number of trainings returned, all if not given.
+        offset (int): Number of trainings skipped.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        List of the matching trainings, as JSON shared by the identical requests in flight.
+
+    Raises:
+        HTTPException: HTTP 400 if the sort field is unknown.
+    """
+    if sort not in TRAINING_SORT_KEYS:
         raise HTTPException(
-            status_code=404, detail=f"The Model with ID {training.model_id} not found"
+            status_code=400, detail=f'sort must be one of {", ".join(TRAINING_SORT_KEYS)}'
         )
 
-    # Check if the dataset created by the current user or admin exists
-    dataset = (
-        db.query(Dataset)
-        .join(User)
-        .filter(
-            (Dataset.id == training.dataset_id)
-            & ((Dataset.user_id == current_user.id) | User.is_admin)
-        )
-        .first()
-    )
-    if not dataset:
-        raise HTTPException(
-            status_code=404, detail=f"The Dataset with ID {training.dataset_id} not found"
+    def query():
+        trainings = db.query(Training).filter(Training.user_id == current_user.id)
+        if model_id is not None:
+            trainings = trainings.filter(Training.model_id == model_id)
+        if dataset_id is not None:
+            trainings = trainings.filter(Training.dataset_id == dataset_id)
+        for column, low, high in (
+            (Training.precision, min_precision, max_precision),
+            (Training.recall, min_recall, max_recall),
+        ):
+            if low is not None:
+                trainings = trainings.filter(column >= low)
+            if high is not None:
+                trainings = trainings.filter(column <= high)
+        # Ties are broken by ID in the same direction, the order of the index entries
+        columns = [getattr(Training, sort), Training.id] if sort != 'id' else [Training.id]
+        trainings = trainings.order_by(
+            *(column.desc() if order == 'desc' else column.asc() for column in columns)
         )
+        return trainings.offset(offset).limit(limit).all()
 
-    new_training = Training(
-        training_name=training.training_name,
-        model_id=training.model_id,
-        model_name=model.name,
-        dataset_id=training.dataset_id,
-        dataset_name=dataset.name,
-        precision=random.uniform(0, 1),  # random precision value between 0 and 1
-        recall=random.uniform(0, 1),  # random recall value between 0 and 1
-        user_id=current_user.id,
+    filters = (model_id, dataset_id, min_precision, max_precision, min_recall, max_recall)
+    return coalesced_json(
+        ('list_trainings', current_user.id, *filters, sort, order, limit, offset),
+        List[TrainingResponse],
+        query,
     )
-    db.add(new_training)
-    db.commit()
-    db.refresh(new_training)
-    return new_training
 
 
-@router.get('/trainings', response_model=List[TrainingResponse])
-def list_trainings(db: Session = Depends(get_db), current_user: User = Depends(get_current_user)):
+@router.get('/trainings/archive', response_model=List[TrainingResponse])
+def list_archived_trainings(
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    archive_db: Session = Depends(get_archive_db),
+    current_user: User = Depends(get_current_user),
+):
     """
-    Get all trainings.
+    Get archived trainings, newest first.
+
+    Trainings older than the retention age are moved out of the trainings table into
+    compressed chunks of the archive database. Only the chunks overlapping the
+    requested date range are decompressed.
 
     Attributes:
-        db (Session): SQLAlchemy session to access the database.
+        after (Optional[str]): Only trainings created at or after this 'YYYY/MM/DD HH:MM:SS' date.
+        before (Optional[str]): Only trainings created before this 'YYYY/MM/DD HH:MM:SS' date.
+        limit (int): Maximum number of trainings returned.
+        offset (int): Number of matching trainings skipped.
+        archive_db (Session): SQLAlchemy session to access the archive database.
         current_user (User): The currently authenticated user.
 
     Returns:
-        List of all trainings in the database.
+        List of archived trainings of the user.
     """
+    chunks = archive_db.query(TrainingChunk).filter(TrainingChunk.user_id == current_user.id)
+    if after:
+        chunks = chunks.filter(TrainingChunk.last_date >= after)
+    if before:
+        chunks = chunks.filter(TrainingChunk.first_date < before)
 
-    trainings = db.query(Training).filter(Training.user_id == current_user.id).all()
+    trainings = []
+    for chunk in chunks.order_by(TrainingChunk.max_id.desc()).yield_per(16):
+        for row in reversed(chunk.rows()):
+            if (after and row['creation_date'] < after) or (
+                before and row['creation_date'] >= before
+            ):
+                continue
+            if offset:
+                offset -= 1
+                continue
+            trainings.append(row)
+            if len(trainings) == limit:
+                return trainings
     return trainings
 
 
+@router.get('/trainings/archive/{training_id}', response_model=TrainingResponse)
+def get_archived_training(
+    training_id: int,
+    archive_db: Session = Depends(get_archive_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Retrieve a specific archived training by ID.
+
+    Attributes:
+        training_id (int): The ID of the training to retrieve.
+        archive_db (Session): SQLAlchemy session to access the archive database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        TrainingResponse: The archived training if found.
+
+    Raises:
+        HTTPException: HTTP 404 if training not found in the archive.
+    """
+    chunks = archive_db.query(TrainingChunk).filter(
+        (TrainingChunk.user_id == current_user.id)
+        & (TrainingChunk.min_id <= training_id)
+        & (TrainingChunk.max_id >= training_id)
+    )
+    for chunk in chunks:
+        for row in chunk.rows():
+            if row['id'] == training_id:
+                return row
+    raise HTTPException(status_code=404, detail='Archived training not found')
+
+
 @router.get('/trainings/{training_id}', response_model=TrainingResponse)
 def get_training(
     training_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)
@@ -123,3 +335,272 @@ def get_training(
     if not training:
         raise HTTPException(status_code=404, detail='Training not found')
     return training
+
+
+def get_evaluated_training(training_id: int, db: Session, current_user: User) -> tuple:
+    """
+    Retrieve a training of the current user and its dataset, which must have a file.
+
+    Attributes:
+        training_id (int): The ID of the training.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        tuple: The training and its dataset.
+
+    Raises:
+        HTTPException: HTTP 404 if training not found.
+        HTTPException: HTTP 400 if the dataset has no file.
+    """
+    training = get_training(training_id=training_id, db=db, current_user=current_user)
+    # An admin's dataset is in the main database with sharded storage
+    dataset = get_record(db, Dataset, training.dataset_id)
+    if not dataset or not dataset.file_hash:
+        raise HTTPException(status_code=400, detail='The dataset of this training has no file')
+    return training, dataset
+
+
+def store_evaluation(training: Training, result: dict, db: Session):
+    """
+    Store the scores of an evaluation on a training.
+
+    Attributes:
+        training (Training): The evaluated training.
+        result (dict): The precision, recall and confusion matrix.
+        db (Session): SQLAlchemy session to access the database.
+    """
+    training.precision = result['precision']
+    training.recall = result['recall']
+    training.evaluation = json.dumps(result)
+    commit(db)
+
+
+@router.put('/trainings/{training_id}/predictions', response_model=TrainingEvaluationResponse)
+async def evaluate_training_predictions(
+    training_id: int,
+    request: Request,
+    label_column: str = 'label',
+    prediction_column: str = 'prediction',
+    average: Optional[str] = None,
+    positive_label: Optional[str] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Evaluate predictions, sent as the raw request body, and store the scores on the training.
+
+    The predictions are a delimited text file with a header, or a one-dimensional
+    NumPy ``.npy`` array, with one prediction per row of the dataset file in the same
+    order. The body is streamed to disk and both files are evaluated in chunks, so
+    files larger than memory can be evaluated.
+
+    Attributes:
+        training_id (int): The ID of the training.
+        request (Request): The request whose body is the predictions file.
+        label_column (str): The column of the dataset file holding the true classes.
+        prediction_column (str): The column of the predictions file holding the predictions.
+        average (Optional[str]): 'binary', 'micro' or 'macro', defaults to 'binary' for two
+            classes and 'macro' otherwise.
+        positive_label (Optional[str]): The positive class for binary averaging.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        TrainingEvaluationResponse: The precision, recall and confusion matrix.
+
+    Raises:
+        HTTPException: HTTP 404 if training not found.
+        HTTPException: HTTP 400 if the dataset has no file or the predictions do not match it.
+    """
+    # Only the body is streamed on the event loop, the queries and the commit, which may
+    # wait for the write lock, run in the thread pool like the routes of plain functions
+    training, dataset = await run_in_threadpool(
+        get_evaluated_training, training_id, db, current_user
+    )
+
+    os.makedirs(blob_store.tmp_dir, exist_ok=True)
+    predictions = tempfile.NamedTemporaryFile(dir=blob_store.tmp_dir, delete=False)
+    try:
+        try:
+            async for block in request.stream():
+                await run_in_threadpool(predictions.write, block)
+        finally:
+            predictions.close()
+        result = await run_in_threadpool(
+            evaluate,
+            blob_store.blob_path(dataset.file_hash),
+            label_column,
+            predictions.name,
+            prediction_column,
+            average,
+            positive_label,
+        )
+    except EvaluationError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    finally:
+        os.remove(predictions.name)
+
+    await run_in_threadpool(store_evaluation, training, result, db)
+    return result
+
+
+@router.get('/trainings/{training_id}/evaluation', response_model=TrainingEvaluationResponse)
+def get_training_evaluation(
+    training_id: int, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)
+):
+    """
+    Retrieve the confusion matrix and per-class scores of an evaluated training.
+
+    Attributes:
+        training_id (int): The ID of the training.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        TrainingEvaluationResponse: The precision, recall and confusion matrix.
+
+    Raises:
+        HTTPException: HTTP 404 if training not found or not evaluated.
+    """
+    training = get_training(training_id=training_id, db=db, current_user=current_user)
+    if not training.evaluation:
+        raise HTTPException(status_code=404, detail='Training has not been evaluated')
+    return json.loads(training.evaluation)
+
+
+def get_recorded_training(
+    training_id: int, db: Session, archive_db: Session, current_user: User
+) -> Training | dict:
+    """
+    Retrieve a training of the current user, whether archived or not.
+
+    Attributes:
+        training_id (int): The ID of the training.
+        db (Session): SQLAlchemy session to access the database.
+        archive_db (Session): SQLAlchemy session to access the archive database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        Training | dict: The training, or the row of the archived training.
+
+    Raises:
+        HTTPException: HTTP 404 if training not found.
+    """
+    try:
+        return get_training(training_id=training_id, db=db, current_user=current_user)
+    except HTTPException:
+        return get_archived_training(
+            training_id=training_id, archive_db=archive_db, current_user=current_user
+        )
+
+
+@router.post('/trainings/{training_id}/metrics', response_model=MetricAppendResponse)
+def append_training_metrics(
+    training_id: int,
+    points: MetricAppend,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Append per-step metric points, e.g. the loss of each step, to a training.
+
+    Meant to be called by the training process every few hundred steps: the points of
+    every metric are appended in one transaction, packed into chunks.
+
+    Attributes:
+        training_id (int): The ID of the training.
+        points (MetricAppend): The steps and the values of each metric.
+        db (Session): SQLAlchemy session to access the database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        MetricAppendResponse: The number of points appended.
+
+    Raises:
+        HTTPException: HTTP 404 if training not found.
+        HTTPException: HTTP 400 if the steps are not increasing or do not follow the
+            stored ones, or the values do not match the steps.
+    """
+    get_training(training_id=training_id, db=db, current_user=current_user)
+    try:
+        appended = append_points(db, training_id, points.steps, points.values)
+    except MetricError as exc:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(exc))
+    commit(db)
+    return {'appended': appended}
+
+
+@router.get('/trainings/{training_id}/metrics', response_model=List[MetricSummary])
+def list_training_metrics(
+    training_id: int,
+    db: Session = Depends(get_db),
+    archive_db: Session = Depends(get_archive_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    List the per-step metrics recorded for a training.
+
+    Attributes:
+        training_id (int): The ID of the training.
+        db (Session): SQLAlchemy session to access the database.
+        archive_db (Session): SQLAlchemy session to access the archive database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        List of the metrics with their number of points and step range.
+
+    Raises:
+        HTTPException: HTTP 404 if training not found.
+    """
+    get_recorded_training(training_id, db, archive_db, current_user)
+    return list_metrics(db, training_id)
+
+
+@router.get('/trainings/{training_id}/metrics/{metric}', response_model=MetricSeriesResponse)
+def get_training_metric(
+    training_id: int,
+    metric: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    points: int = Query(1000, ge=3, le=10000),
+    downsampling: str = 'lttb',
+    db: Session = Depends(get_db),
+    archive_db: Session = Depends(get_archive_db),
+    current_user: User = Depends(get_current_user),
+):
+    """
+    Retrieve a per-step metric of a training at a given resolution.
+
+    Ranges holding more than ``points`` points are downsampled with 'lttb', which
+    keeps the shape of the curve, or 'minmax', which keeps every spike. Only the
+    chunks of the step range are read.
+
+    Attributes:
+        training_id (int): The ID of the training.
+        metric (str): The name of the metric.
+        start (Optional[int]): The first step returned.
+        end (Optional[int]): The last step returned.
+        points (int): The maximum number of points returned.
+        downsampling (str): 'lttb' or 'minmax'.
+        db (Session): SQLAlchemy session to access the database.
+        archive_db (Session): SQLAlchemy session to access the archive database.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        MetricSeriesResponse: The steps and values, and the number of points in the range.
+
+    Raises:
+        HTTPException: HTTP 400 if the downsampling is unknown.
+        HTTPException: HTTP 404 if training not found or the metric was never recorded.
+    """
+    if downsampling not in DOWNSAMPLING:
+        raise HTTPException(
+            status_code=400, detail=f'downsampling must be among {", ".join(DOWNSAMPLING)}'
+        )
+    get_recorded_training(training_id, db, archive_db, current_user)
+    series = read_series(db, training_id, metric, start, end, points, downsampling)
+    if series is None:
+        raise HTTPException(status_code=404, detail=f"Metric '{metric}' not recorded")
+    return series
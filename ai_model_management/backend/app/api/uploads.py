@@ -0,0 +1,123 @@
+"""Helpers shared by the routes receiving resumable file uploads."""
+
+from contextlib import contextmanager
+
+from fastapi import HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+
+from ..core.blob_store import Upload, blob_store
+from ..database.config import shard_sessions
+from ..database.db_models import Dataset, Model
+
+
+def get_upload(owner_key: str, upload_id: str) -> Upload:
+    """
+    Retrieve an upload in progress for a record.
+
+    Attributes:
+        owner_key (str): The record the file is uploaded for, e.g. 'dataset-1'.
+        upload_id (str): The identifier of the upload.
+
+    Returns:
+        Upload: The upload.
+
+    Raises:
+        HTTPException: HTTP 404 if upload not found.
+    """
+    upload = blob_store.get_upload(owner_key, upload_id)
+    if upload is None:
+        raise HTTPException(status_code=404, detail='Upload not found')
+    return upload
+
+
+def _lock_upload(upload: Upload):
+    """
+    Take the lock of an upload without waiting for it.
+
+    Raises:
+        HTTPException: HTTP 404 if the upload was completed or aborted meanwhile.
+        HTTPException: HTTP 409 if another chunk is being written.
+    """
+    try:
+        locked = upload.acquire()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail='Upload not found')
+    if not locked:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail='Another chunk is being uploaded'
+        )
+
+
+async def receive_chunk(upload: Upload, offset: int, request: Request):
+    """
+    Stream the request body to the end of an upload.
+
+    The body is written and hashed block by block as it arrives, so memory use does
+    not depend on the chunk size.
+
+    Attributes:
+        upload (Upload): The upload to append to.
+        offset (int): The position of the chunk in the file, must equal the bytes received so far.
+        request (Request): The request whose body is the chunk.
+
+    Raises:
+        HTTPException: HTTP 404 if the upload was completed or aborted meanwhile.
+        HTTPException: HTTP 409 if the offset does not match or another chunk is being written.
+    """
+    # Taking the lock may re-read the partial file appended by another server worker
+    await run_in_threadpool(_lock_upload, upload)
+    try:
+        if offset != upload.offset:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Expected a chunk at offset {upload.offset}",
+            )
+        async for block in request.stream():
+            await run_in_threadpool(upload.write, block)
+    finally:
+        await run_in_threadpool(upload.release)
+
+
+@contextmanager
+def finish_upload(upload: Upload):
+    """
+    Move a finished upload to the content-addressed store.
+
+    The file is locked until the block exits, so that it cannot be deleted before
+    the record referencing it is committed within the block.
+
+    Attributes:
+        upload (Upload): The finished upload.
+
+    Yields:
+        str: The SHA-256 of the uploaded file.
+
+    Raises:
+        HTTPException: HTTP 404 if the upload was completed or aborted meanwhile.
+        HTTPException: HTTP 409 if a chunk is still being written.
+    """
+    _lock_upload(upload)
+    try:
+        with blob_store.lock(upload.digest):
+            yield blob_store.complete_upload(upload)
+    finally:
+        upload.release()
+
+
+def release_file(file_hash: str, db: Session):
+    """
+    Delete a stored file if no dataset or model references it anymore.
+
+    Attributes:
+        file_hash (str): The SHA-256 of the file.
+        db (Session): SQLAlchemy session to access the database.
+    """
+    with blob_store.lock(file_hash):
+        # With sharded storage, files are shared by the datasets and models of every shard
+        for shard_db in shard_sessions(db):
+            if shard_db.query(Dataset.id).filter(Dataset.file_hash == file_hash).first():
+                return
+            if shard_db.query(Model.id).filter(Model.artifact_hash == file_hash).first():
+                return
+        blob_store.delete(file_hash)
@@ -1,18 +1,43 @@
 """User management module with JWT authentication."""
 
 import os
+import secrets
+import time
 from datetime import datetime, timedelta
-from typing import Annotated, List, Optional
+from typing import Annotated, List, Literal, Optional
 
 import jwt
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
-from passlib.context import CryptContext
-from sqlalchemy.orm import Session
-
-from ..database.config import get_db
-from ..database.db_models import User
-from ..schemas.user_schemas import Token, TokenData, UserCreate, UserLogin, UserResponse
+from sqlalchemy import and_, func, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, aliased
+
+from ..core.passwords import load_context
+from ..core.prefix_index import dataset_index, model_index
+from ..database.audit import audit_log
+from ..database.config import (
+    engine,
+    get_db,
+    get_record,
+    open_shard,
+    shard_router,
+    use_shard,
+)
+from ..database.counters import read_counts
+from ..database.db_models import Dataset, EntityCount, Model, Training, User
+from ..database.token_revocations import is_revoked, revoke
+from ..database.transactions import begin_write, commit
+from ..database.write_batcher import write_batcher
+from ..schemas.user_schemas import (
+    RefreshRequest,
+    Token,
+    TokenData,
+    UserCreate,
+    UserLogin,
+    UserResponse,
+    UserUsageResponse,
+)
 
 # Create a router for user-related routes
 router = APIRouter()
@@ -20,13 +45,15 @@ router = APIRouter()
 # Use OAuth2PasswordBearer for token authentication
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token')
 
-# Initialize password hashing context
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+# Initialize password hashing context with the scheme and work factor calibrated for this machine
+pwd_context = load_context()
 
 # JWT configuration
 SECRET_KEY = os.environ.get("SECRET_KEY")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+# Lifetime of a refresh token, each refresh issues a new one
+REFRESH_TOKEN_EXPIRE_DAYS = float(os.environ.get('REFRESH_TOKEN_EXPIRE_DAYS', 14))
 
 
 async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
@@ -51,7 +78,8 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
-        if email is None:
+        # Refresh tokens are only accepted by /token/refresh
+        if email is None or payload.get('type') == 'refresh':
             raise credentials_exception
         token_data = TokenData(email=email)
     except jwt.PyJWTError:
@@ -59,9 +87,98 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     user = get_user(token_data.email, db)
     if user is None:
         raise credentials_exception
+    # With sharded storage, the records of the request are read from the user's shard
+    use_shard(db, home_shard(user))
     return user
 
 
+def home_shard(user: User) -> int | None:
+    """
+    Return the shard storing the records of a user, with sharded storage.
+
+    The records of admins are stored in the main database, where they can be read
+    along with the shard of any user.
+
+    Attributes:
+        user (User): The user.
+
+    Returns:
+        int | None: The ID of the shard, None for the main database.
+    """
+    return None if user.is_admin else user.id
+
+
+def visible_to(query, table, current_user: User):
+    """
+    Filter a query on datasets or models to the rows a user can see: their own and
+    those created by admins.
+
+    With sharded storage, the session of a user reaches their shard, which only holds
+    their rows; the rows of admins are in the main database, read by ``list_visible``
+    and ``get_visible``.
+
+    Attributes:
+        query (Query | Select): The query on the table.
+        table: The ORM model class, Dataset or Model.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        Query | Select: The filtered query.
+    """
+    if shard_router.enabled and not current_user.is_admin:
+        return query.filter(table.user_id == current_user.id)
+    return query.join(User).filter((table.user_id == current_user.id) | User.is_admin)
+
+
+def list_visible(db: Session, table, current_user: User, newest: int | None = None) -> list:
+    """
+    List the datasets or models a user can see: their own and those created by admins.
+
+    With sharded storage, the rows of admins are read from the main database besides
+    the rows of the user's shard. The IDs of the main database are lower than those
+    of the shards, so the rows of admins come first in ID order.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        table: The ORM model class, Dataset or Model.
+        current_user (User): The currently authenticated user.
+        newest (int | None): Only list this many rows, the latest first, instead of
+            every row in ID order.
+
+    Returns:
+        list: The rows.
+    """
+    order = table.id.desc() if newest else table.id
+    rows = db.scalars(
+        visible_to(select(table), table, current_user).order_by(order).limit(newest)
+    ).all()
+    if shard_router.enabled and not current_user.is_admin:
+        shared = select(table).join(User).filter(User.is_admin).order_by(order).limit(newest)
+        shared_rows = db.scalars(shared, bind_arguments={'bind': engine}).all()
+        rows = [*rows, *shared_rows][:newest] if newest else [*shared_rows, *rows]
+    return rows
+
+
+def get_visible(db: Session, table, record_id: int, current_user: User):
+    """
+    Retrieve a dataset or model a user can see: their own or one created by an admin.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        table: The ORM model class, Dataset or Model.
+        record_id (int): The ID of the row.
+        current_user (User): The currently authenticated user.
+
+    Returns:
+        Dataset | Model | None: The row, or None if it does not exist or is not visible.
+    """
+    record = get_record(db, table, record_id)
+    owner = None if record is None or record.user_id is None else db.get(User, record.user_id)
+    if owner is None or (owner.id != current_user.id and not owner.is_admin):
+        return None
+    return record
+
+
 def verify_password(plain_password, hashed_password):
     """
     Verify that a plain password matches its hashed equivalent.
@@ -110,6 +227,60 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
+def create_refresh_token(user: User, family: Optional[str] = None) -> str:
+    """
+    Create a JWT refresh token.
+
+    Each refresh token has its own ID, revoked once the token is exchanged, and the ID
+    of its family, shared by the tokens rotated from the same login and revoked at
+    logout or when a token is used twice.
+
+    Attributes:
+        user (User): The user the token is issued to.
+        family (Optional[str]): The family of the exchanged token, a new one if not provided.
+
+    Returns:
+        str: The encoded JWT token.
+    """
+    payload = {
+        'sub': user.email,
+        # A user deleted then registered again may get the same ID
+        'uid': [user.id, user.registration_date],
+        'type': 'refresh',
+        'jti': secrets.token_hex(16),
+        'fam': family or secrets.token_hex(16),
+        'exp': datetime.utcnow() + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+    }
+    return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
+
+
+def decode_refresh_token(token: str) -> dict:
+    """
+    Check the signature and the expiry of a refresh token.
+
+    Attributes:
+        token (str): The refresh token.
+
+    Returns:
+        dict: The payload of the token.
+
+    Raises:
+        HTTPException: HTTP 401 if the token is invalid, expired or not a refresh token.
+    """
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail='Invalid or expired refresh token',
+        headers={'WWW-Authenticate': 'Bearer'},
+    )
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        raise credentials_exception
+    if payload.get('type') != 'refresh':
+        raise credentials_exception
+    return payload
+
+
 def get_user(email: str, db: Session = Depends(get_db)):
     """
     Retrieve a user from the database by email.
@@ -128,6 +299,9 @@ def authenticate_user(email: str, password: str, db: Session = Depends(get_db)):
     """
     Authenticate a user by verifying their email and password.
 
+    A password hashed with another scheme or a lower work factor than the calibrated
+    ones is hashed again, now that it is known.
+
     Attributes:
         email (str): The user's email.
         password (str): The user's plain text password.
@@ -139,8 +313,12 @@ def authenticate_user(email: str, password: str, db: Session = Depends(get_db)):
     user = get_user(email, db)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = pwd_context.verify_and_update(password, user.hashed_password)
+    if not verified:
         return False
+    if new_hash is not None:
+        user.hashed_password = new_hash
+        commit(db)
     return user
 
 
@@ -172,11 +350,20 @@ def register_user(user: UserCreate, db: Session = Depends(get_db)):
         email=user.email,
         hashed_password=hashed_password,
     )
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    try:
+        db_user = write_batcher.insert(db_user)
+    except IntegrityError:
+        # Another registration with the same email was committed concurrently
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail='Email already registered'
+        )
+    audit_log.record('create', 'user', db_user.id, db_user, email=db_user.email)
     access_token = create_access_token(data={'sub': db_user.email})
-    return {'access_token': access_token, 'token_type': 'bearer'}
+    return {
+        'access_token': access_token,
+        'refresh_token': create_refresh_token(db_user),
+        'token_type': 'bearer',
+    }
 
 
 @router.post('/token', response_model=Token)
@@ -203,11 +390,92 @@ async def login_for_access_token(user_login: UserLogin, db: Session = Depends(ge
         )
 
     access_token = create_access_token(data={"sub": user.email})
+    refresh_token = create_refresh_token(user)
 
     if user.is_admin:
-        return {'access_token': access_token, 'token_type': 'bearer', 'redirect_url': '/admin'}
+        return {
+            'access_token': access_token,
+            'refresh_token': refresh_token,
+            'token_type': 'bearer',
+            'redirect_url': '/admin',
+        }
+
+    return {
+        'access_token': access_token,
+        'refresh_token': refresh_token,
+        'token_type': 'bearer',
+        'redirect_url': '/dashboard',
+    }
+
+
+@router.post('/token/refresh', response_model=Token)
+def refresh_access_token(request: RefreshRequest, db: Session = Depends(get_db)):
+    """
+    Exchange a refresh token for a new access token and a new refresh token.
+
+    Only the signature is checked and the revocations looked up, the password is not
+    hashed again. The exchanged token is revoked; if a revoked token is presented
+    again, it was stolen or the new one was, so its whole family is revoked and the
+    user has to log in again.
+
+    Attributes:
+        request (RefreshRequest): The refresh token.
+        db (Session): SQLAlchemy session object for database access.
+
+    Returns:
+        dict: A dictionary containing the new access and refresh tokens and the token type.
 
-    return {'access_token': access_token, 'token_type': 'bearer', 'redirect_url': '/dashboard'}
+    Raises:
+        HTTPException: HTTP 401 if the token is invalid, expired, revoked or its user deleted.
+    """
+    payload = decode_refresh_token(request.refresh_token)
+    revoked_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail='Refresh token revoked',
+        headers={'WWW-Authenticate': 'Bearer'},
+    )
+    # Checked and revoked in one write transaction, so that a token is exchanged only once
+    begin_write(db)
+    if is_revoked(db, payload['fam']):
+        db.rollback()
+        raise revoked_exception
+    if is_revoked(db, payload['jti']):
+        revoke(db, payload['fam'], int(time.time() + REFRESH_TOKEN_EXPIRE_DAYS * 86400))
+        commit(db)
+        raise revoked_exception
+    user = get_user(payload['sub'], db)
+    if user is None or [user.id, user.registration_date] != payload.get('uid'):
+        db.rollback()
+        raise revoked_exception
+    revoke(db, payload['jti'], payload['exp'])
+    commit(db)
+    return {
+        'access_token': create_access_token(data={'sub': user.email}),
+        'refresh_token': create_refresh_token(user, payload['fam']),
+        'token_type': 'bearer',
+    }
+
+
+@router.post('/token/revoke')
+def revoke_refresh_token(request: RefreshRequest, db: Session = Depends(get_db)):
+    """
+    Revoke a refresh token and every token rotated from the same login, e.g. at logout.
+
+    Attributes:
+        request (RefreshRequest): The refresh token.
+        db (Session): SQLAlchemy session object for database access.
+
+    Returns:
+        dict: A message confirming the revocation.
+
+    Raises:
+        HTTPException: HTTP 401 if the token is invalid or expired.
+    """
+    payload = decode_refresh_token(request.refresh_token)
+    # The family lives as long as the last token rotated from it
+    revoke(db, payload['fam'], int(time.time() + REFRESH_TOKEN_EXPIRE_DAYS * 86400))
+    commit(db)
+    return {'message': 'Refresh token revoked'}
 
 
 @router.get('/users/me', response_model=UserCreate)
@@ -258,8 +526,9 @@ def register_admin(db: Session = Depends(get_db)):
         is_admin=True,
     )
     db.add(db_admin)
-    db.commit()
+    commit(db)
     db.refresh(db_admin)
+    audit_log.record('create', 'user', db_admin.id, email=db_admin.email, is_admin=True)
     access_token = create_access_token(data={'sub': db_admin.email})
     return {'access_token': access_token, 'token_type': 'bearer'}
 
@@ -267,14 +536,41 @@ def register_admin(db: Session = Depends(get_db)):
 # Admin functionality: Endpoints related to administrative tasks
 
 
-@router.get('/admin/users', response_model=List[UserResponse])
+USER_USAGE = {'counts', 'last_activity'}
+COUNTED_ENTITIES = ('datasets', 'models', 'trainings')
+USER_SORT_KEYS = {'id', 'email', 'registration_date', *COUNTED_ENTITIES, 'last_activity'}
+
+
+@router.get(
+    '/admin/users', response_model=List[UserUsageResponse], response_model_exclude_unset=True
+)
 def admin_get_all_users(
-    db: Session = Depends(get_db), current_user: User = Depends(get_current_user)
+    include: Optional[str] = None,
+    sort: str = 'id',
+    order: Literal['asc', 'desc'] = 'asc',
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user),
 ):
     """
     Retrieve a list of all users in the database. Admin access only.
 
+    With ``include=counts`` each user comes with the numbers of datasets, models and
+    trainings they own, read from the maintained counts, and with
+    ``include=last_activity`` with the date they last created one of them, read from
+    the (user_id, creation_date) indexes. Both are fetched in the same query as the
+    users, so sorting by usage and paginating happen in the database. With sharded
+    storage, the figures are read from the shard of each user of the page instead,
+    and users cannot be sorted by them.
+
     Attributes:
+        include (Optional[str]): Comma-separated usage figures to add: 'counts', 'last_activity'.
+        sort (str): The field to sort by: 'id', 'email', 'registration_date', 'datasets',
+            'models', 'trainings' or 'last_activity'.
+        order (str): 'asc' or 'desc'.
+        limit (Optional[int]): Maximum number of users returned, all if not given.
+        offset (int): Number of users skipped.
         db (Session): SQLAlchemy session to access the database.
         current_user (User): The currently authenticated user.
 
@@ -283,16 +579,116 @@ def admin_get_all_users(
 
     Raises:
         HTTPException: HTTP 403 if user does not have access.
+        HTTPException: HTTP 400 if the included figures or the sort field are unknown, or
+            if sorting by usage with sharded storage.
     """
     if not current_user.is_admin:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail='Not enough privileges to access this resource',
         )
-    users = db.query(User).all()
+    included = {name.strip() for name in include.split(',')} if include else set()
+    if not included <= USER_USAGE:
+        raise HTTPException(
+            status_code=400, detail=f'include must be among {", ".join(sorted(USER_USAGE))}'
+        )
+    if sort not in USER_SORT_KEYS:
+        raise HTTPException(
+            status_code=400, detail=f'sort must be one of {", ".join(sorted(USER_SORT_KEYS))}'
+        )
+    sharded = shard_router.enabled
+    if sharded and sort in {*COUNTED_ENTITIES, 'last_activity'}:
+        raise HTTPException(
+            status_code=400, detail='Sorting by usage is not available with sharded storage'
+        )
+
+    figures = {}
+    query = db.query(User)
+    if not sharded and ('counts' in included or sort in COUNTED_ENTITIES):
+        for entity in COUNTED_ENTITIES:
+            count = aliased(EntityCount)
+            query = query.outerjoin(count, and_(count.user_id == User.id, count.entity == entity))
+            figures[entity] = func.coalesce(count.count, 0)
+    if not sharded and ('last_activity' in included or sort == 'last_activity'):
+        # SQLite's max() of several values is NULL as soon as one is, hence the ''
+        latest = [
+            func.coalesce(
+                select(func.max(table.creation_date))
+                .where(table.user_id == User.id)
+                .scalar_subquery(),
+                '',
+            )
+            for table in (Dataset, Model, Training)
+        ]
+        figures['last_activity'] = func.nullif(func.max(*latest), '')
+
+    sort_column = figures[sort] if sort in figures else getattr(User, sort)
+    sort_column = sort_column.desc() if order == 'desc' else sort_column.asc()
+    query = query.add_columns(*(column.label(name) for name, column in figures.items()))
+    if sort != 'id':
+        # Ties are broken by ID so that pages do not overlap
+        query = query.order_by(sort_column, User.id)
+    else:
+        query = query.order_by(sort_column)
+    query = query.offset(offset).limit(limit)
+
+    rows = query.all()
+    if sharded and included:
+        # The usage of each user of the page is read from their shard
+        shard_usage = read_shard_usage(db, [row.id for row in rows], included)
+    users = []
+    for row in rows:
+        user, usage = (row[0], row._mapping) if figures else (row, {})
+        if sharded and included:
+            usage = shard_usage[user.id]
+        response = UserResponse.model_validate(user).model_dump()
+        if 'counts' in included:
+            response.update({entity: usage[entity] for entity in COUNTED_ENTITIES})
+        if 'last_activity' in included:
+            response['last_activity'] = usage['last_activity']
+        users.append(response)
     return users
 
 
+def read_shard_usage(db: Session, user_ids: list, included: set) -> dict:
+    """
+    Read the usage figures of users from their shards, with sharded storage.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        user_ids (list): The IDs of the users.
+        included (set): The figures to read: 'counts', 'last_activity'.
+
+    Returns:
+        dict: The figures of each user, by user ID.
+    """
+    usage = {user_id: {} for user_id in user_ids}
+    if 'counts' in included:
+        counts = read_counts(db, user_ids)
+        for user_id in user_ids:
+            usage[user_id].update({entity: counts[user_id][entity] for entity in COUNTED_ENTITIES})
+    if 'last_activity' in included:
+        for user_id in user_ids:
+            # The records of admins are in the main database
+            dates = [
+                db.scalar(
+                    select(func.max(table.creation_date)).where(table.user_id == user_id),
+                    bind_arguments={'bind': engine},
+                )
+                for table in (Dataset, Model, Training)
+            ]
+            if shard_router.exists(user_id):
+                with open_shard(user_id) as shard_db:
+                    dates += [
+                        shard_db.query(func.max(table.creation_date))
+                        .filter(table.user_id == user_id)
+                        .scalar()
+                        for table in (Dataset, Model, Training)
+                    ]
+            usage[user_id]['last_activity'] = max(filter(None, dates), default=None)
+    return usage
+
+
 @router.post('/admin/users/delete/{email}')
 def admin_delete_user(
     email: str, db: Session = Depends(get_db), current_user: User = Depends(get_current_user)
@@ -320,6 +716,21 @@ def admin_delete_user(
     db_user = db.query(User).filter(User.email == email).first()
     if not db_user:
         raise HTTPException(status_code=404, detail='User not found')
+    # The records of the user, kept without an owner, are in their shard
+    shard_id = home_shard(db_user)
+    in_shard = shard_router.enabled and bool(shard_id) and shard_router.exists(shard_id)
+    use_shard(db, shard_id if in_shard else None)
+    if in_shard:
+        # The shard and the main database commit separately: the records are disowned
+        # first, so that a failure in between cannot leave them owned by a deleted user
+        begin_write(db, Dataset)
+        for record in [*db_user.datasets, *db_user.models, *db_user.trainings]:
+            record.user_id = None
+        commit(db)
+    begin_write(db, User, Dataset)
     db.delete(db_user)
-    db.commit()
+    commit(db)
+    audit_log.record('delete', 'user', db_user.id, current_user, email=db_user.email)
+    dataset_index.remove_owner(db_user.id)
+    model_index.remove_owner(db_user.id)
     return {'message': f"User {email} has been deleted"}
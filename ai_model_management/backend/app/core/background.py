@@ -0,0 +1,137 @@
+"""Background jobs that must run in a single process when the server runs several workers."""
+
+import fcntl
+import logging
+import os
+import threading
+
+# File locked by the worker running the background jobs, shared by all the workers
+BACKGROUND_LOCK_PATH = os.environ.get('BACKGROUND_LOCK_PATH', './background.lock')
+# Seconds between two attempts of the other workers to take over the background jobs
+BACKGROUND_LOCK_RETRY_SECONDS = float(os.environ.get('BACKGROUND_LOCK_RETRY_SECONDS', 5))
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundJobs:
+    """
+    Run the background jobs in the one worker holding an exclusive lock on a file.
+
+    Each worker of the server tries to lock the file when it starts. The worker that
+    gets it starts the jobs; the others retry periodically, so that when the holder
+    exits, e.g. during a rolling restart, another worker takes the jobs over. The
+    operating system releases the lock of a worker that crashed.
+
+    Attributes:
+        start_jobs (callable): Function starting the jobs.
+        stop_jobs (callable): Function stopping the jobs.
+        lock_path (str): Path of the lock file.
+        retry_interval (float): Seconds between two attempts to take the lock.
+    """
+
+    def __init__(
+        self,
+        start_jobs,
+        stop_jobs,
+        lock_path: str = BACKGROUND_LOCK_PATH,
+        retry_interval: float = BACKGROUND_LOCK_RETRY_SECONDS,
+    ):
+        self.start_jobs = start_jobs
+        self.stop_jobs = stop_jobs
+        self.lock_path = lock_path
+        self.retry_interval = retry_interval
+        self._lock_file = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        """Whether the jobs run in this process."""
+        return self._lock_file is not None
+
+    def start(self):
+        """Start the jobs if no other worker runs them, otherwise wait to take them over."""
+        self._stop.clear()
+        if self._try_lock():
+            return
+        self._thread = threading.Thread(target=self._run, name='background-jobs', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the jobs if they run in this process and let another worker take them over."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._lock_file is not None:
+            self.stop_jobs()
+            # Closing the file releases the lock
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _try_lock(self) -> bool:
+        """Take the lock and start the jobs, if no other worker holds it."""
+        lock_file = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        logger.info('Running the background jobs in process %d', os.getpid())
+        self.start_jobs()
+        return True
+
+    def _run(self):
+        """Thread loop: try to take the lock until it is taken or the worker stops."""
+        while not self._stop.wait(self.retry_interval):
+            try:
+                if self._try_lock():
+                    return
+            except Exception:
+                logger.exception('Taking over the background jobs failed')
+
+
+class PeriodicJob:
+    """
+    Background thread calling a function at a fixed interval.
+
+    A failed call is logged and the function is called again on the next run.
+
+    Attributes:
+        name (str): Name of the thread, used in the logs.
+        function (callable): Function called on each run.
+        interval (float): Seconds to wait between two runs.
+    """
+
+    def __init__(self, name: str, function, interval: float):
+        self.name = name
+        self.function = function
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background thread, running the function right away."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread after its current run."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """Thread loop: call the function, then sleep until the next run."""
+        while not self._stop.is_set():
+            try:
+                self.function()
+            except Exception:
+                # Try again on the next run, e.g. when the database was locked
+                logger.exception('Background job %s failed', self.name)
+            self._stop.wait(self.interval)
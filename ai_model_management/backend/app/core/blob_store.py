@@ -0,0 +1,274 @@
+"""Content-addressed file storage with resumable, hashed-while-written uploads."""
+
+import fcntl
+import hashlib
+import os
+import re
+import threading
+import uuid
+from contextlib import contextmanager
+
+# Root directory of the stored files
+STORAGE_DIR = os.environ.get('STORAGE_DIR', './storage')
+# Size of the blocks used when a partial upload has to be re-read from disk
+READ_BLOCK_SIZE = 1 << 20
+
+UPLOAD_ID_PATTERN = re.compile(r'^[a-z]+-\d+-[0-9a-f]{32}$')
+
+
+class Upload:
+    """
+    An upload in progress, appended to a partial file and hashed as it is written.
+
+    Attributes:
+        upload_id (str): The identifier of the upload.
+        path (str): The location of the partial file.
+        offset (int): The number of bytes received so far.
+        line_count (int): The number of line breaks received so far.
+        lock (threading.Lock): Serializes the appends to the upload within the process,
+            the partial file is locked as well for the other server workers.
+    """
+
+    def __init__(self, upload_id: str, path: str):
+        self.upload_id = upload_id
+        self.path = path
+        self.lock = threading.Lock()
+        self._file = None
+        # Rebuild the running state when resuming an upload started by another process
+        self._reload()
+
+    def _reload(self):
+        """Rebuild the running hash and counters from the partial file."""
+        self.offset = 0
+        self.line_count = 0
+        self.last_byte = b''
+        self._hash = hashlib.sha256()
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as partial:
+                while block := partial.read(READ_BLOCK_SIZE):
+                    self._update(block)
+
+    def _update(self, block: bytes):
+        """Feed a received block to the running hash and counters."""
+        self._hash.update(block)
+        self.offset += len(block)
+        self.line_count += block.count(b'\n')
+        self.last_byte = block[-1:]
+
+    def acquire(self) -> bool:
+        """
+        Take the lock of the upload without waiting, across threads and server workers.
+
+        Each server worker keeps its own state of an upload, so the state is rebuilt
+        under the lock if another worker appended to the partial file meanwhile.
+
+        Returns:
+            bool: False if a chunk is being written by another thread or worker.
+
+        Raises:
+            FileNotFoundError: If the upload was completed or aborted meanwhile.
+        """
+        if not self.lock.acquire(blocking=False):
+            return False
+        try:
+            partial = open(self.path, 'rb+')
+        except BaseException:
+            self.lock.release()
+            raise
+        try:
+            fcntl.flock(partial, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            partial.close()
+            self.lock.release()
+            return False
+        self._file = partial
+        if os.fstat(partial.fileno()).st_size != self.offset:
+            self._reload()
+        partial.seek(0, os.SEEK_END)
+        return True
+
+    def write(self, block: bytes):
+        """
+        Append a block to the partial file, holding the lock of the upload.
+
+        Attributes:
+            block (bytes): The received bytes.
+        """
+        if not block:
+            return
+        self._file.write(block)
+        self._update(block)
+
+    def release(self):
+        """Flush the received blocks to the partial file and release the lock of the upload."""
+        try:
+            # Closing the file releases its lock
+            self._file.close()
+        finally:
+            self._file = None
+            self.lock.release()
+
+    def refresh(self):
+        """Catch up with the bytes other server workers appended, unless a chunk is being written."""
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            if os.path.exists(self.path) and os.path.getsize(self.path) != self.offset:
+                self._reload()
+        finally:
+            self.lock.release()
+
+    @property
+    def row_count(self) -> int:
+        """Return the number of lines, counting a last line without a line break."""
+        return self.line_count + (1 if self.last_byte not in (b'', b'\n') else 0)
+
+    @property
+    def digest(self) -> str:
+        """Return the SHA-256 of the bytes received so far."""
+        return self._hash.hexdigest()
+
+
+class BlobStore:
+    """
+    Store files under the SHA-256 of their content, so identical files are kept once.
+
+    Attributes:
+        root (str): The root directory of the store.
+    """
+
+    def __init__(self, root: str = STORAGE_DIR):
+        self.root = root
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.upload_dir = os.path.join(root, 'uploads')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        self.lock_dir = os.path.join(root, 'locks')
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def blob_path(self, digest: str) -> str:
+        """
+        Locate the file stored for a content hash.
+
+        Attributes:
+            digest (str): The SHA-256 of the content.
+
+        Returns:
+            str: The path of the stored file.
+        """
+        return os.path.join(self.blob_dir, digest[:2], digest)
+
+    @contextmanager
+    def lock(self, digest: str):
+        """
+        Hold an exclusive lock on a content hash, across threads and server workers.
+
+        Storing a file and committing the record referencing it, or checking that no
+        record references a file and deleting it, are done under the lock, so that a
+        file cannot be deleted while an identical upload is attached to a record. The
+        hashes sharing their first two characters share a lock file.
+
+        Attributes:
+            digest (str): The SHA-256 of the content.
+        """
+        os.makedirs(self.lock_dir, exist_ok=True)
+        # Each open file has its own lock, so threads of the same process exclude each other
+        with open(os.path.join(self.lock_dir, digest[:2]), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def start_upload(self, owner_key: str) -> Upload:
+        """
+        Open a new upload.
+
+        Attributes:
+            owner_key (str): The record the file is uploaded for, e.g. 'dataset-1'.
+
+        Returns:
+            Upload: The new, empty upload.
+        """
+        os.makedirs(self.upload_dir, exist_ok=True)
+        upload_id = f'{owner_key}-{uuid.uuid4().hex}'
+        upload = Upload(upload_id, os.path.join(self.upload_dir, f'{upload_id}.part'))
+        open(upload.path, 'wb').close()
+        with self._lock:
+            self._uploads[upload_id] = upload
+        return upload
+
+    def get_upload(self, owner_key: str, upload_id: str) -> Upload | None:
+        """
+        Find an upload in progress, resuming it from disk if needed.
+
+        Attributes:
+            owner_key (str): The record the file is uploaded for, e.g. 'dataset-1'.
+            upload_id (str): The identifier of the upload.
+
+        Returns:
+            Upload | None: The upload, or None if it does not exist for this record.
+        """
+        if not UPLOAD_ID_PATTERN.match(upload_id) or not upload_id.startswith(f'{owner_key}-'):
+            return None
+        path = os.path.join(self.upload_dir, f'{upload_id}.part')
+        with self._lock:
+            if not os.path.exists(path):
+                self._uploads.pop(upload_id, None)
+                return None
+            upload = self._uploads.get(upload_id)
+            if upload is None:
+                upload = self._uploads[upload_id] = Upload(upload_id, path)
+                return upload
+        # The upload may have been continued by another worker process
+        upload.refresh()
+        return upload
+
+    def complete_upload(self, upload: Upload) -> str:
+        """
+        Move a finished upload to its content-addressed location.
+
+        If a file with the same content is already stored, the upload is discarded.
+        Call it holding the lock of the upload and the lock of the content hash.
+
+        Attributes:
+            upload (Upload): The finished upload.
+
+        Returns:
+            str: The SHA-256 of the content.
+        """
+        digest = upload.digest
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            os.remove(upload.path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(upload.path, path)
+        with self._lock:
+            self._uploads.pop(upload.upload_id, None)
+        return digest
+
+    def abort_upload(self, upload: Upload):
+        """
+        Discard an upload in progress.
+
+        Attributes:
+            upload (Upload): The upload to discard.
+        """
+        with self._lock:
+            self._uploads.pop(upload.upload_id, None)
+        if os.path.exists(upload.path):
+            os.remove(upload.path)
+
+    def delete(self, digest: str):
+        """
+        Delete a stored file once nothing references it anymore.
+
+        Call it holding the lock of the content hash.
+
+        Attributes:
+            digest (str): The SHA-256 of the content.
+        """
+        path = self.blob_path(digest)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+blob_store = BlobStore()
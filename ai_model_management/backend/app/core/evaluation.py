@@ -0,0 +1,245 @@
+"""Vectorized evaluation of predictions against dataset labels, in bounded memory."""
+
+import csv
+import os
+
+import numpy as np
+
+# Number of rows evaluated at once
+EVALUATION_CHUNK_ROWS = int(os.environ.get('EVALUATION_CHUNK_ROWS', 1 << 20))
+
+NPY_MAGIC = b'\x93NUMPY'
+AVERAGES = ('binary', 'micro', 'macro')
+
+
+class EvaluationError(ValueError):
+    """Raised when the predictions cannot be evaluated against the labels."""
+
+
+def _csv_column_chunks(path: str, column: str, chunk_rows: int):
+    """Yield the values of one column of a delimited text file, chunk by chunk."""
+    with open(path, newline='', encoding='utf-8', errors='replace') as file:
+        try:
+            dialect = csv.Sniffer().sniff(file.read(64 * 1024), delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+        file.seek(0)
+        reader = csv.reader(file, dialect)
+        header = next(reader, [])
+        if column not in header:
+            raise EvaluationError(f"Column '{column}' not found in {', '.join(header)}")
+        index = header.index(column)
+        while True:
+            try:
+                values = [
+                    row[index] if index < len(row) else ''
+                    for _, row in zip(range(chunk_rows), reader)
+                ]
+            except csv.Error as exc:
+                raise EvaluationError(f'File cannot be parsed: {exc}')
+            if not values:
+                return
+            yield np.array(values, dtype=str)
+
+
+def _npy_chunks(path: str, chunk_rows: int):
+    """Yield slices of a memory-mapped one-dimensional .npy array."""
+    try:
+        array = np.load(path, mmap_mode='r', allow_pickle=False)
+    except (ValueError, OSError, EOFError) as exc:
+        raise EvaluationError(f'Predictions array cannot be read: {exc}')
+    if array.ndim != 1:
+        raise EvaluationError('Predictions array must be one-dimensional')
+    for start in range(0, array.shape[0], chunk_rows):
+        yield np.asarray(array[start : start + chunk_rows])
+
+
+def column_chunks(path: str, column: str, chunk_rows: int = EVALUATION_CHUNK_ROWS):
+    """
+    Yield the values of a column in chunks of ``chunk_rows``.
+
+    NumPy ``.npy`` files are memory-mapped and sliced, so only the current chunk is
+    paged in; delimited text files are parsed as a stream.
+
+    Attributes:
+        path (str): The location of the file.
+        column (str): The column holding the values, ignored for ``.npy`` files.
+        chunk_rows (int): Number of values per chunk.
+
+    Yields:
+        np.ndarray: The next chunk of values.
+    """
+    with open(path, 'rb') as file:
+        is_npy = file.read(len(NPY_MAGIC)) == NPY_MAGIC
+    if is_npy:
+        return _npy_chunks(path, chunk_rows)
+    return _csv_column_chunks(path, column, chunk_rows)
+
+
+def normalize_label(label: str) -> str:
+    """
+    Write a numeric class label in a single way, integers without a fractional part.
+
+    Attributes:
+        label (str): The class label, as read from a file.
+
+    Returns:
+        str: The label, e.g. '1' for '1.0' or '1', '0.5' for '0.50', others unchanged.
+    """
+    try:
+        number = float(label)
+    except ValueError:
+        return label
+    if not np.isfinite(number):
+        return label
+    return str(int(number)) if number.is_integer() else repr(number)
+
+
+class ConfusionMatrix:
+    """
+    A confusion matrix grown chunk by chunk over a vocabulary of class labels.
+
+    Labels and predictions are compared as strings, with numbers written in a single
+    way, so that predictions stored in a ``.npy`` file of integers or floats match the
+    same labels written in a CSV file, e.g. ``1.0`` matches ``1``.
+
+    Attributes:
+        classes (list): The class labels, in the order of the matrix rows and columns.
+        matrix (np.ndarray): Counts of true class (rows) against predicted class (columns).
+    """
+
+    def __init__(self):
+        self.classes = []
+        self._codes = {}
+        self.matrix = np.zeros((0, 0), dtype=np.int64)
+
+    def _encode(self, values: np.ndarray) -> np.ndarray:
+        """Map a chunk of values to class codes, registering unseen classes."""
+        distinct, inverse = np.unique(values.astype(str), return_inverse=True)
+        labels = [normalize_label(label) for label in distinct.tolist()]
+        for label in labels:
+            if label not in self._codes:
+                self._codes[label] = len(self.classes)
+                self.classes.append(label)
+        lookup = np.fromiter((self._codes[label] for label in labels), dtype=np.int64)
+        return lookup[inverse.reshape(-1)]
+
+    def update(self, labels: np.ndarray, predictions: np.ndarray):
+        """
+        Count a chunk of aligned labels and predictions.
+
+        Attributes:
+            labels (np.ndarray): The true classes.
+            predictions (np.ndarray): The predicted classes.
+        """
+        true_codes = self._encode(labels)
+        predicted_codes = self._encode(predictions)
+        size = len(self.classes)
+        if size > self.matrix.shape[0]:
+            grow = size - self.matrix.shape[0]
+            self.matrix = np.pad(self.matrix, ((0, grow), (0, grow)))
+        self.matrix += np.bincount(
+            true_codes * size + predicted_codes, minlength=size * size
+        ).reshape(size, size)
+
+    def scores(self, average: str, positive_label: str | None = None) -> dict:
+        """
+        Compute precision and recall from the matrix, with the classes in sorted order.
+
+        Attributes:
+            average (str): 'binary' for the positive class only, 'micro' to pool all
+                classes, or 'macro' for the unweighted mean of the per-class scores.
+            positive_label (str | None): The positive class for binary averaging,
+                defaults to '1' if present, otherwise the last class in sorted order.
+
+        Returns:
+            dict: The precision, recall, per-class scores, classes and confusion matrix.
+        """
+        # Report the classes in sorted order, whatever order the chunks revealed them in
+        order = sorted(range(len(self.classes)), key=self.classes.__getitem__)
+        classes = [self.classes[code] for code in order]
+        matrix = self.matrix[np.ix_(order, order)]
+        true_positives = np.diag(matrix).astype(np.float64)
+        predicted = matrix.sum(axis=0).astype(np.float64)
+        actual = matrix.sum(axis=1).astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            class_precision = np.where(predicted > 0, true_positives / predicted, 0.0)
+            class_recall = np.where(actual > 0, true_positives / actual, 0.0)
+
+        if average == 'binary':
+            if len(self.classes) > 2:
+                raise EvaluationError('Binary averaging needs at most two classes')
+            if positive_label is None:
+                positive_label = '1' if '1' in self._codes else max(self.classes)
+            positive_label = normalize_label(positive_label)
+            if positive_label not in self._codes:
+                raise EvaluationError(f"Positive label '{positive_label}' not found")
+            code = classes.index(positive_label)
+            precision, recall = class_precision[code], class_recall[code]
+        elif average == 'micro':
+            total = matrix.sum()
+            precision = recall = true_positives.sum() / total if total else 0.0
+        else:
+            precision, recall = class_precision.mean(), class_recall.mean()
+
+        return {
+            'precision': float(precision),
+            'recall': float(recall),
+            'average': average,
+            'classes': classes,
+            'class_precision': class_precision.tolist(),
+            'class_recall': class_recall.tolist(),
+            'confusion_matrix': matrix.tolist(),
+        }
+
+
+def evaluate(
+    labels_path: str,
+    label_column: str,
+    predictions_path: str,
+    prediction_column: str,
+    average: str | None = None,
+    positive_label: str | None = None,
+    chunk_rows: int = EVALUATION_CHUNK_ROWS,
+) -> dict:
+    """
+    Evaluate a predictions file against the labels of a dataset file, row by row.
+
+    Attributes:
+        labels_path (str): The dataset file holding the true classes.
+        label_column (str): The column of the dataset file holding the true classes.
+        predictions_path (str): The predictions file, delimited text or ``.npy``.
+        prediction_column (str): The column of the predictions file holding the predictions.
+        average (str | None): 'binary', 'micro' or 'macro', defaults to 'binary' for two
+            classes and 'macro' otherwise.
+        positive_label (str | None): The positive class for binary averaging.
+        chunk_rows (int): Number of rows evaluated at once.
+
+    Returns:
+        dict: The precision, recall and confusion matrix.
+
+    Raises:
+        EvaluationError: If a file cannot be read, a column is missing, the files differ
+            in length, or the averaging does not apply.
+    """
+    if average is not None and average not in AVERAGES:
+        raise EvaluationError(f"Average must be one of {', '.join(AVERAGES)}")
+
+    confusion = ConfusionMatrix()
+    labels = column_chunks(labels_path, label_column, chunk_rows)
+    predictions = column_chunks(predictions_path, prediction_column, chunk_rows)
+    rows = 0
+    for label_chunk in labels:
+        prediction_chunk = next(predictions, None)
+        if prediction_chunk is None or prediction_chunk.size != label_chunk.size:
+            raise EvaluationError('Predictions and labels have a different number of rows')
+        confusion.update(label_chunk, prediction_chunk)
+        rows += label_chunk.size
+    if next(predictions, None) is not None:
+        raise EvaluationError('Predictions and labels have a different number of rows')
+    if not rows:
+        raise EvaluationError('No rows to evaluate')
+
+    if average is None:
+        average = 'binary' if len(confusion.classes) <= 2 else 'macro'
+    return {'rows': rows, **confusion.scores(average, positive_label)}
@@ -0,0 +1,180 @@
+"""File response serving byte ranges without loading the file into Python memory."""
+
+import mmap
+import os
+import re
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+import anyio
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse, Response
+
+# Size of the slices of the memory map handed to the server
+CHUNK_SIZE = 1 << 20
+
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class ZeroCopyFileResponse(Response):
+    """
+    ASGI response for a stored file with ``Range`` and ``If-Range`` support.
+
+    When the server implements the ASGI zero-copy extension the file descriptor is
+    handed over and the kernel sends the bytes with sendfile. Otherwise the file is
+    memory-mapped and sent in slices, so only one slice is in memory at a time. The
+    file is opened once, and its size and date are read from the open descriptor, so
+    the headers match the bytes sent even if the file is deleted meanwhile; a file
+    deleted before the response starts is answered with a 404.
+
+    Attributes:
+        path (str): The location of the file.
+        etag (str): The strong entity tag of the content, e.g. its SHA-256.
+        filename (str | None): The name suggested to the client for saving the file.
+        media_type (str): The content type of the file.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        etag: str,
+        filename: str | None = None,
+        media_type: str = 'application/octet-stream',
+    ):
+        super().__init__(media_type=media_type)
+        self.path = path
+        self.etag = f'"{etag}"'
+        self.filename = filename
+
+    def _headers(self, stat_result: os.stat_result) -> dict:
+        """Build the headers shared by the full and the partial responses."""
+        headers = {
+            'accept-ranges': 'bytes',
+            'content-type': self.media_type,
+            'etag': self.etag,
+            'last-modified': formatdate(stat_result.st_mtime, usegmt=True),
+        }
+        if self.filename:
+            headers['content-disposition'] = f"attachment; filename*=utf-8''{quote(self.filename)}"
+        return headers
+
+    def _if_range_matches(self, if_range: str, stat_result: os.stat_result) -> bool:
+        """Check whether the validator sent in ``If-Range`` still matches the file."""
+        if if_range.startswith('"') or if_range.startswith('W/'):
+            # Only a strong entity tag can validate a range
+            return if_range == self.etag
+        try:
+            return int(parsedate_to_datetime(if_range).timestamp()) == int(stat_result.st_mtime)
+        except (TypeError, ValueError):
+            return False
+
+    @staticmethod
+    def _parse_range(value: str, size: int):
+        """
+        Resolve a single ``bytes=`` range against the file size.
+
+        Attributes:
+            value (str): The ``Range`` header value.
+            size (int): The size of the file.
+
+        Returns:
+            tuple | None: The (start, end) of the range with an exclusive end, None if the
+            header is not a single byte range, or (size, size) if it is not satisfiable.
+        """
+        match = RANGE_PATTERN.match(value.strip())
+        if not match or match.groups() == ('', ''):
+            return None
+        first, last = match.groups()
+        if not first:
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            end = min(int(last) + 1, size) if last else size
+        if start >= size or start >= end:
+            return size, size
+        return start, end
+
+    async def __call__(self, scope, receive, send):
+        try:
+            file = await anyio.to_thread.run_sync(open, self.path, 'rb')
+        except FileNotFoundError:
+            # The file was deleted since the route found the record referencing it
+            await JSONResponse({'detail': 'File not found'}, status_code=404)(scope, receive, send)
+            return
+        try:
+            await self._respond(scope, send, file)
+        finally:
+            file.close()
+        if self.background is not None:
+            await self.background()
+
+    async def _respond(self, scope, send, file):
+        """Send the whole file or the requested range of the open file."""
+        stat_result = os.fstat(file.fileno())
+        size = stat_result.st_size
+        headers = self._headers(stat_result)
+        request_headers = Headers(scope=scope)
+        status_code, start, end = 200, 0, size
+
+        byte_range = request_headers.get('range')
+        if_range = request_headers.get('if-range')
+        if byte_range and (if_range is None or self._if_range_matches(if_range, stat_result)):
+            # Anything but a single byte range is answered with the whole file
+            resolved = self._parse_range(byte_range, size)
+            if resolved == (size, size):
+                headers['content-range'] = f'bytes */{size}'
+                headers['content-length'] = '0'
+                await self._start(send, 416, headers)
+                await send({'type': 'http.response.body', 'body': b''})
+                return
+            if resolved is not None:
+                status_code, (start, end) = 206, resolved
+                headers['content-range'] = f'bytes {start}-{end - 1}/{size}'
+
+        headers['content-length'] = str(end - start)
+        await self._start(send, status_code, headers)
+        if scope['method'] == 'HEAD' or start == end:
+            await send({'type': 'http.response.body', 'body': b''})
+        elif 'http.response.zerocopy' in scope.get('extensions', {}):
+            await self._send_zerocopy(send, file, start, end)
+        else:
+            await self._send_mmap(send, file, start, end)
+
+    @staticmethod
+    async def _start(send, status_code: int, headers: dict):
+        """Send the status line and the headers."""
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': status_code,
+                'headers': [(name.encode(), value.encode()) for name, value in headers.items()],
+            }
+        )
+
+    @staticmethod
+    async def _send_zerocopy(send, file, start: int, end: int):
+        """Hand the file descriptor to the server, which sends the range with sendfile."""
+        await send(
+            {
+                'type': 'http.response.zerocopy',
+                'file': file.fileno(),
+                'offset': start,
+                'count': end - start,
+            }
+        )
+
+    @staticmethod
+    async def _send_mmap(send, file, start: int, end: int):
+        """Send the range in slices of a read-only memory map of the file."""
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            position = start
+            while position < end:
+                chunk_end = min(position + CHUNK_SIZE, end)
+                # Slicing may fault pages in from disk, keep that off the event loop
+                chunk = await anyio.to_thread.run_sync(
+                    mapped.__getitem__, slice(position, chunk_end)
+                )
+                position = chunk_end
+                await send(
+                    {'type': 'http.response.body', 'body': chunk, 'more_body': position < end}
+                )
@@ -0,0 +1,320 @@
+"""
+Per-step training metrics stored as chunks of packed arrays, read back downsampled.
+
+A point costs 8 bytes: a uint32 step and a float32 value. The points of a metric are
+cut into chunks of ``METRIC_CHUNK_POINTS``, each a single row, and appended steps
+must follow the last stored one, so the chunks of a step range are found through
+the index and only those are read.
+
+Series longer than the requested number of points are downsampled either by keeping
+the lowest and highest point of equal step ranges ('minmax'), where a chunk falling
+in a single range is summarised by its stored extremes without unpacking it, or by
+Largest-Triangle-Three-Buckets ('lttb') run on such a min/max preselection, which
+keeps the shape of the curve with a bounded amount of work.
+"""
+
+import os
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..database.db_models import MetricChunk
+from ..database.transactions import begin_write
+
+# Maximum number of points stored in one chunk
+METRIC_CHUNK_POINTS = int(os.environ.get('METRIC_CHUNK_POINTS', 4096))
+
+STEP_DTYPE = np.dtype('<u4')
+VALUE_DTYPE = np.dtype('<f4')
+MAX_STEP = np.iinfo(STEP_DTYPE).max
+DOWNSAMPLING = ('lttb', 'minmax')
+# Candidate points per returned point preselected for LTTB
+LTTB_PRESELECTION = 4
+
+
+class MetricError(ValueError):
+    """Raised when metric points cannot be appended."""
+
+
+def _unpack(chunk: MetricChunk) -> tuple:
+    """Return the steps and values of a chunk."""
+    return np.frombuffer(chunk.steps, STEP_DTYPE), np.frombuffer(chunk.values, VALUE_DTYPE)
+
+
+def _pack(chunk: MetricChunk, steps: np.ndarray, values: np.ndarray):
+    """Store points in a chunk, with their bounds and extremes."""
+    low, high = int(np.argmin(values)), int(np.argmax(values))
+    chunk.first_step, chunk.last_step, chunk.count = int(steps[0]), int(steps[-1]), len(steps)
+    chunk.min_step, chunk.min_value = int(steps[low]), float(values[low])
+    chunk.max_step, chunk.max_value = int(steps[high]), float(values[high])
+    chunk.steps = steps.astype(STEP_DTYPE).tobytes()
+    chunk.values = values.astype(VALUE_DTYPE).tobytes()
+
+
+def append_points(db: Session, training_id: int, steps: list, values: dict) -> int:
+    """
+    Append points to the metrics of a training, without committing.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        training_id (int): The ID of the training.
+        steps (list): The steps of the points, strictly increasing.
+        values (dict): The values of each metric, one per step, by metric name.
+
+    Returns:
+        int: The number of points appended.
+
+    Raises:
+        MetricError: If the steps are not increasing or do not follow the stored ones,
+            or if the values do not match the steps or are not finite.
+    """
+    steps = np.asarray(steps, dtype=np.int64)
+    if not len(steps):
+        return 0
+    if steps[0] < 0 or steps[-1] > MAX_STEP or np.any(np.diff(steps) <= 0):
+        raise MetricError(f'Steps must be strictly increasing integers from 0 to {MAX_STEP}')
+    arrays = {}
+    for metric, metric_values in values.items():
+        metric_values = np.asarray(metric_values, dtype=VALUE_DTYPE)
+        if len(metric_values) != len(steps):
+            raise MetricError(
+                f"Metric '{metric}' has {len(metric_values)} values for {len(steps)} steps"
+            )
+        if not np.all(np.isfinite(metric_values)):
+            raise MetricError(f"Metric '{metric}' has values that are not finite")
+        arrays[metric] = metric_values
+
+    # Appends to the same metric are serialized, the last chunk is read to be extended
+    begin_write(db, MetricChunk)
+    appended = 0
+    for metric, metric_values in arrays.items():
+        last = (
+            db.query(MetricChunk)
+            .filter((MetricChunk.training_id == training_id) & (MetricChunk.metric == metric))
+            .order_by(MetricChunk.first_step.desc())
+            .first()
+        )
+        start = 0
+        if last is not None:
+            if steps[0] <= last.last_step:
+                raise MetricError(
+                    f"Steps of metric '{metric}' must follow the last stored step {last.last_step}"
+                )
+            if last.count < METRIC_CHUNK_POINTS:
+                start = METRIC_CHUNK_POINTS - last.count
+                stored_steps, stored_values = _unpack(last)
+                _pack(
+                    last,
+                    np.concatenate([stored_steps, steps[:start]]),
+                    np.concatenate([stored_values, metric_values[:start]]),
+                )
+        for offset in range(start, len(steps), METRIC_CHUNK_POINTS):
+            chunk = MetricChunk(training_id=training_id, metric=metric)
+            end = offset + METRIC_CHUNK_POINTS
+            _pack(chunk, steps[offset:end], metric_values[offset:end])
+            db.add(chunk)
+        appended += len(steps)
+    return appended
+
+
+def list_metrics(db: Session, training_id: int) -> list:
+    """
+    Describe the metrics recorded for a training, from the chunk bounds only.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        training_id (int): The ID of the training.
+
+    Returns:
+        list: The name, number of points, first and last step of each metric.
+    """
+    rows = (
+        db.query(
+            MetricChunk.metric,
+            func.sum(MetricChunk.count),
+            func.min(MetricChunk.first_step),
+            func.max(MetricChunk.last_step),
+        )
+        .filter(MetricChunk.training_id == training_id)
+        .group_by(MetricChunk.metric)
+        .order_by(MetricChunk.metric)
+    )
+    return [
+        {'metric': metric, 'points': points, 'first_step': first, 'last_step': last}
+        for metric, points, first, last in rows
+    ]
+
+
+def _minmax(chunks: list, low: int, high: int, buckets: int) -> tuple:
+    """
+    Keep the lowest and highest point of each of equal step ranges between two steps.
+
+    A chunk lying inside a single range contributes its stored extremes, the others
+    are unpacked.
+
+    Returns:
+        tuple: The steps and values of the kept points, in step order.
+    """
+    width = (high - low + 1) / buckets
+    extremes = {}
+
+    def keep(bucket, min_step, min_value, max_step, max_value):
+        current = extremes.get(bucket)
+        if current is None:
+            extremes[bucket] = [min_step, min_value, max_step, max_value]
+            return
+        if min_value < current[1]:
+            current[0:2] = min_step, min_value
+        if max_value > current[3]:
+            current[2:4] = max_step, max_value
+
+    for chunk in chunks:
+        first_bucket = int((chunk.first_step - low) // width)
+        if (
+            low <= chunk.first_step
+            and chunk.last_step <= high
+            and first_bucket == int((chunk.last_step - low) // width)
+        ):
+            keep(first_bucket, chunk.min_step, chunk.min_value, chunk.max_step, chunk.max_value)
+            continue
+        steps, values = _unpack(chunk)
+        inside = (steps >= low) & (steps <= high)
+        steps, values = steps[inside], values[inside]
+        if not len(steps):
+            continue
+        bucket_of = ((steps - low) // width).astype(np.int64)
+        # Steps are increasing, so each bucket is a run of the sorted points
+        starts = np.flatnonzero(np.r_[True, np.diff(bucket_of) > 0])
+        lowest = np.lexsort((values, bucket_of))[starts]
+        highest = np.lexsort((-values, bucket_of))[starts]
+        for bucket, min_index, max_index in zip(bucket_of[starts], lowest, highest):
+            keep(
+                int(bucket),
+                int(steps[min_index]),
+                float(values[min_index]),
+                int(steps[max_index]),
+                float(values[max_index]),
+            )
+
+    points = sorted(
+        {
+            point
+            for min_step, min_value, max_step, max_value in extremes.values()
+            for point in ((min_step, min_value), (max_step, max_value))
+        }
+    )
+    return np.array([step for step, _ in points]), np.array([value for _, value in points])
+
+
+def lttb(steps: np.ndarray, values: np.ndarray, points: int) -> tuple:
+    """
+    Downsample a series with Largest-Triangle-Three-Buckets.
+
+    The first and last points are kept, and from each of equal-sized buckets of the
+    points in between, the one forming the largest triangle with the point kept
+    from the previous bucket and the average of the next bucket.
+
+    Attributes:
+        steps (np.ndarray): The steps of the series, in increasing order.
+        values (np.ndarray): The values of the series.
+        points (int): The number of points to keep, at least 3.
+
+    Returns:
+        tuple: The steps and values of the kept points.
+    """
+    count = len(steps)
+    if points >= count or points < 3:
+        return steps, values
+    x, y = steps.astype(np.float64), values.astype(np.float64)
+    # Bucket i of the middle points spans edges[i]:edges[i + 1], the last point is alone
+    edges = np.linspace(1, count - 1, points - 1).astype(np.int64)
+    edges = np.append(edges, count)
+    kept = [0]
+    previous = 0
+    for bucket in range(points - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_x = x[end : edges[bucket + 2]].mean()
+        next_y = y[end : edges[bucket + 2]].mean()
+        areas = np.abs(
+            (x[previous] - next_x) * (y[start:end] - y[previous])
+            - (x[previous] - x[start:end]) * (next_y - y[previous])
+        )
+        previous = start + int(np.argmax(areas))
+        kept.append(previous)
+    kept.append(count - 1)
+    return steps[kept], values[kept]
+
+
+def read_series(
+    db: Session,
+    training_id: int,
+    metric: str,
+    start: int | None = None,
+    end: int | None = None,
+    points: int = 1000,
+    downsampling: str = 'lttb',
+) -> dict | None:
+    """
+    Read a metric of a training between two steps, downsampled to a number of points.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        training_id (int): The ID of the training.
+        metric (str): The name of the metric.
+        start (int | None): The first step read, from the first stored step by default.
+        end (int | None): The last step read, up to the last stored step by default.
+        points (int): The maximum number of points returned.
+        downsampling (str): 'lttb' or 'minmax', used if the range holds more points.
+
+    Returns:
+        dict | None: The total number of points in the range, the downsampling applied
+        and the steps and values returned, None if the metric was never recorded.
+    """
+    chunks = db.query(MetricChunk).filter(
+        (MetricChunk.training_id == training_id) & (MetricChunk.metric == metric)
+    )
+    if not chunks.first():
+        return None
+    if start is not None:
+        chunks = chunks.filter(MetricChunk.last_step >= start)
+    if end is not None:
+        chunks = chunks.filter(MetricChunk.first_step <= end)
+    chunks = chunks.order_by(MetricChunk.first_step).all()
+    series = {'metric': metric, 'total': 0, 'downsampling': None, 'steps': [], 'values': []}
+    if not chunks:
+        return series
+
+    low = chunks[0].first_step if start is None else max(start, chunks[0].first_step)
+    high = chunks[-1].last_step if end is None else min(end, chunks[-1].last_step)
+    # Only the chunks crossing the range bounds need unpacking to count their points
+    total = 0
+    for chunk in chunks:
+        if chunk.first_step < low or chunk.last_step > high:
+            chunk_steps, _ = _unpack(chunk)
+            total += int(np.count_nonzero((chunk_steps >= low) & (chunk_steps <= high)))
+        else:
+            total += chunk.count
+    series['total'] = total
+
+    if total <= points:
+        steps, values = (np.concatenate(arrays) for arrays in zip(*map(_unpack, chunks)))
+        inside = (steps >= low) & (steps <= high)
+        steps, values = steps[inside], values[inside]
+    elif downsampling == 'minmax':
+        steps, values = _minmax(chunks, low, high, max(points // 2, 1))
+        series['downsampling'] = downsampling
+    else:
+        steps, values = _minmax(chunks, low, high, max(points * LTTB_PRESELECTION // 2, 1))
+        # LTTB keeps the ends of the series, so the first and last points are added back
+        head_steps, head_values = _unpack(chunks[0])
+        tail_steps, tail_values = _unpack(chunks[-1])
+        head = np.searchsorted(head_steps, low)
+        tail = np.searchsorted(tail_steps, high, side='right') - 1
+        middle = (steps > low) & (steps < high)
+        steps = np.r_[head_steps[head], steps[middle], tail_steps[tail]]
+        values = np.r_[head_values[head], values[middle], tail_values[tail]]
+        steps, values = lttb(steps, values, points)
+        series['downsampling'] = downsampling
+    series['steps'], series['values'] = steps.tolist(), values.tolist()
+    return series
@@ -0,0 +1,273 @@
+"""
+Password hashing calibrated to a latency target on the machine running the backend.
+
+Run from the backend directory:
+    python -m app.core.passwords calibrate --target-ms 50
+    python -m app.core.passwords benchmark
+
+The calibration picks the first scheme of ``PASSWORD_HASH_SCHEMES`` whose backend is
+installed and the highest work factor hashing within ``PASSWORD_HASH_TARGET_MS``,
+and stores them in ``PASSWORD_HASH_CONFIG_PATH``. The backend calibrates once when
+that file is missing and reads it otherwise, so that every worker, and every restart,
+hashes with the same parameters. Hashes made with another scheme or other parameters
+still verify, and are replaced on the next successful login.
+"""
+
+import argparse
+import fcntl
+import json
+import os
+import secrets
+import statistics
+import time
+from datetime import datetime
+
+from passlib.context import CryptContext
+from passlib.registry import get_crypt_handler
+
+# Latency in milliseconds of one password hash the calibration aims for
+PASSWORD_HASH_TARGET_MS = float(os.environ.get('PASSWORD_HASH_TARGET_MS', 50))
+# Supported schemes by order of preference, the first one with an installed backend is used
+PASSWORD_HASH_SCHEMES = os.environ.get('PASSWORD_HASH_SCHEMES', 'argon2,bcrypt').split(',')
+# Memory used by one argon2 hash in KiB, the calibration only adjusts its number of passes
+PASSWORD_HASH_ARGON2_MEMORY_KIB = int(os.environ.get('PASSWORD_HASH_ARGON2_MEMORY_KIB', 19456))
+# File holding the calibrated scheme and work factor
+PASSWORD_HASH_CONFIG_PATH = os.environ.get('PASSWORD_HASH_CONFIG_PATH', './password_hashing.json')
+
+# Schemes the stored hashes may use, the calibrated one hashes the new passwords
+KNOWN_SCHEMES = ('argon2', 'bcrypt')
+# Hashes timed for each measurement, the median is kept
+SAMPLES = 5
+
+
+def measure(context: CryptContext, samples: int = SAMPLES) -> float:
+    """
+    Measure the latency of hashing a password.
+
+    Attributes:
+        context (CryptContext): The context hashing with the measured parameters.
+        samples (int): Number of hashes timed.
+
+    Returns:
+        float: The median latency in milliseconds.
+    """
+    password = secrets.token_urlsafe(16)
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        context.hash(password)
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def _bcrypt_settings(target_ms: float) -> dict:
+    """Return the highest bcrypt cost hashing within the target."""
+    rounds = 4
+    # Each round doubles the work, so a cheap measurement predicts the others
+    cost = measure(build_context('bcrypt', {'rounds': rounds}))
+    while rounds < 31 and cost * 2 <= target_ms:
+        rounds += 1
+        cost *= 2
+    # Correct the prediction, the cheapest costs are dominated by a fixed overhead
+    while rounds > 4 and measure(build_context('bcrypt', {'rounds': rounds})) > target_ms:
+        rounds -= 1
+    while rounds < 31 and measure(build_context('bcrypt', {'rounds': rounds + 1})) <= target_ms:
+        rounds += 1
+    return {'rounds': rounds}
+
+
+def _argon2_settings(target_ms: float) -> dict:
+    """Return the highest number of argon2 passes over the configured memory within the target."""
+    settings = {'memory_cost': PASSWORD_HASH_ARGON2_MEMORY_KIB, 'parallelism': 1}
+    one = measure(build_context('argon2', {**settings, 'time_cost': 1}))
+    two = measure(build_context('argon2', {**settings, 'time_cost': 2}))
+    per_pass = max(two - one, 0.01)
+    time_cost = max(1, int((target_ms - one) / per_pass) + 1)
+    while (
+        time_cost > 1
+        and measure(build_context('argon2', {**settings, 'time_cost': time_cost})) > target_ms
+    ):
+        time_cost -= 1
+    return {**settings, 'time_cost': time_cost}
+
+
+CALIBRATIONS = {'argon2': _argon2_settings, 'bcrypt': _bcrypt_settings}
+
+
+def available_scheme(schemes: list = PASSWORD_HASH_SCHEMES) -> str:
+    """
+    Return the first scheme whose backend is installed.
+
+    Attributes:
+        schemes (list): Candidate schemes by order of preference.
+
+    Returns:
+        str: The name of the scheme.
+
+    Raises:
+        ValueError: If none of the schemes is supported and installed.
+    """
+    for scheme in schemes:
+        scheme = scheme.strip()
+        if scheme in CALIBRATIONS and get_crypt_handler(scheme).has_backend():
+            return scheme
+    raise ValueError(f'No backend installed for the password hash schemes {schemes}')
+
+
+def calibrate(
+    target_ms: float = PASSWORD_HASH_TARGET_MS, schemes: list = PASSWORD_HASH_SCHEMES
+) -> dict:
+    """
+    Pick the scheme and the work factor hashing a password within the target latency.
+
+    Attributes:
+        target_ms (float): The latency target in milliseconds.
+        schemes (list): Candidate schemes by order of preference.
+
+    Returns:
+        dict: The scheme, its settings, the target and the measured latency.
+    """
+    scheme = available_scheme(schemes)
+    settings = CALIBRATIONS[scheme](target_ms)
+    return {
+        'scheme': scheme,
+        'settings': settings,
+        'target_ms': target_ms,
+        'measured_ms': round(measure(build_context(scheme, settings)), 1),
+        'calibrated_at': datetime.now().strftime('%Y/%m/%d %H:%M:%S'),
+    }
+
+
+def build_context(scheme: str, settings: dict) -> CryptContext:
+    """
+    Create a context hashing with a scheme and settings, and verifying every known scheme.
+
+    Other schemes are deprecated and hashes with other parameters, e.g. bcrypt hashes of
+    a lower or a higher cost, are flagged, so that ``verify_and_update`` returns a new
+    hash for them.
+
+    Attributes:
+        scheme (str): The scheme of the new hashes.
+        settings (dict): The parameters of the scheme, e.g. ``rounds`` or ``time_cost``.
+
+    Returns:
+        CryptContext: The password hashing context.
+    """
+    options = {f'{scheme}__{name}': value for name, value in settings.items()}
+    if scheme == 'bcrypt':
+        rounds = options.pop('bcrypt__rounds')
+        options.update(
+            bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds, bcrypt__max_rounds=rounds
+        )
+    schemes = [scheme, *(known for known in KNOWN_SCHEMES if known != scheme)]
+    return CryptContext(schemes=schemes, default=scheme, deprecated='auto', **options)
+
+
+def save_calibration(calibration: dict, path: str = PASSWORD_HASH_CONFIG_PATH):
+    """
+    Write a calibration to the file read by the backend.
+
+    The calibration is written to a temporary file first, then renamed over the file,
+    so that a worker starting meanwhile reads either the previous or the new one.
+    """
+    temporary = f'{path}.{os.getpid()}.tmp'
+    try:
+        with open(temporary, 'w') as file:
+            json.dump(calibration, file, indent=2)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+def load_context(path: str = PASSWORD_HASH_CONFIG_PATH) -> CryptContext:
+    """
+    Create the password hashing context from the stored calibration.
+
+    Calibrates and stores the result first if the file does not exist yet. The server
+    workers start together, so the calibration is done under a lock, by the first
+    worker to take it, and the others read its result.
+
+    Attributes:
+        path (str): The file holding the calibration.
+
+    Returns:
+        CryptContext: The password hashing context.
+    """
+    if not os.path.exists(path):
+        with open(f'{path}.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # Another worker may have calibrated while this one waited for the lock
+            if not os.path.exists(path):
+                save_calibration(calibrate(), path)
+    with open(path) as file:
+        calibration = json.load(file)
+    return build_context(calibration['scheme'], calibration['settings'])
+
+
+def benchmark(context: CryptContext, samples: int) -> dict:
+    """
+    Measure the cost of logging in: verifying a password against its stored hash.
+
+    Attributes:
+        context (CryptContext): The context verifying the passwords.
+        samples (int): Number of verifications timed.
+
+    Returns:
+        dict: Median and 95th percentile latency in milliseconds, and logins per second
+        a single CPU sustains.
+    """
+    password = secrets.token_urlsafe(16)
+    stored = context.hash(password)
+    timings = []
+    for _ in range(samples):
+        start = time.perf_counter()
+        context.verify(password, stored)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    median = statistics.median(timings)
+    return {
+        'median_ms': round(median, 1),
+        'p95_ms': round(timings[int(0.95 * (len(timings) - 1))], 1),
+        'logins_per_second_per_cpu': round(1000 / median, 1),
+    }
+
+
+def main():
+    """Calibrate the hashing of this machine or measure the cost of a login."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+    calibrate_parser = commands.add_parser('calibrate', help='Pick the scheme and the work factor')
+    calibrate_parser.add_argument('--target-ms', type=float, default=PASSWORD_HASH_TARGET_MS)
+    calibrate_parser.add_argument('--schemes', default=','.join(PASSWORD_HASH_SCHEMES))
+    calibrate_parser.add_argument('--config', default=PASSWORD_HASH_CONFIG_PATH)
+    calibrate_parser.add_argument(
+        '--dry-run', action='store_true', help='Print the calibration without storing it'
+    )
+    benchmark_parser = commands.add_parser('benchmark', help='Measure the cost of a login')
+    benchmark_parser.add_argument('--config', default=PASSWORD_HASH_CONFIG_PATH)
+    benchmark_parser.add_argument('--samples', type=int, default=20)
+    args = parser.parse_args()
+
+    if args.command == 'calibrate':
+        calibration = calibrate(args.target_ms, args.schemes.split(','))
+        print(json.dumps(calibration, indent=2))
+        if not args.dry_run:
+            save_calibration(calibration, args.config)
+            print(f'Stored in {args.config}, restart the backend to use it')
+        return
+
+    contexts = {
+        'calibrated': load_context(args.config),
+        'bcrypt default cost': CryptContext(schemes=['bcrypt']),
+    }
+    for name, context in contexts.items():
+        scheme = context.default_scheme()
+        print(f'{name} ({scheme}): {benchmark(context, args.samples)}')
+
+
+if __name__ == '__main__':
+    main()
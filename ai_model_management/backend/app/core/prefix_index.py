@@ -0,0 +1,267 @@
+"""In-memory per-owner prefix index serving name autocomplete without scanning the tables."""
+
+import bisect
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from sqlalchemy import event, func, select
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from ..database.config import engine, open_shard, shard_router
+from ..database.db_models import Dataset, DeletionCount, Model, User
+
+# Number of server workers. With several, each worker keeps its own index and catches
+# up on the rows created or deleted by the others before searching.
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+# Shortest time between two checks of a database for the changes of the other workers
+PREFIX_INDEX_CATCH_UP_MS = float(os.environ.get('PREFIX_INDEX_CATCH_UP_MS', 1000))
+
+
+@event.listens_for(Session, 'after_flush')
+def count_flushed_deletions(session: Session, flush_context):
+    """
+    Count the deleted datasets, models and users, in the same transaction.
+
+    Attributes:
+        session (Session): The session being flushed.
+        flush_context: The internal state of the flush.
+    """
+    # With sharded storage, a deletion is counted in the database the row was deleted from
+    deletions = {}
+    for obj in session.deleted:
+        if isinstance(obj, (Dataset, Model, User)):
+            deletions.setdefault(session.get_bind(type(obj)), Counter())[obj.__tablename__] += 1
+    statement = insert(DeletionCount)
+    for bind, counts in deletions.items():
+        session.connection(bind_arguments={'bind': bind}).execute(
+            statement.on_conflict_do_update(
+                index_elements=['table_name'],
+                set_={'count': DeletionCount.count + statement.excluded.count},
+            ),
+            [{'table_name': name, 'count': count} for name, count in counts.items()],
+        )
+
+
+class PrefixIndex:
+    """
+    Sorted arrays of names per owner, searched by binary search on the prefix.
+
+    The index mirrors the visibility rule of the list routes: a user sees the rows
+    they own and the rows owned by admins. It is loaded from the database on first
+    use and then kept up to date by the create and delete routes.
+
+    With sharded storage, the rows of admins are loaded from the main database on the
+    first search, and the rows of a user from their shard on their first search.
+
+    When the server runs several workers, a search first picks up the rows created
+    by the other workers since, by ID, and reloads the rows of a database if rows of
+    the table or users were deleted since, which the deletion counts reveal. Each
+    database is checked at most once per catch-up interval, so the suggestions may
+    miss the latest changes of the other workers for that long.
+
+    Attributes:
+        table: The ORM model class whose names are indexed.
+        catch_up_interval (float): Seconds between two checks of a database for the
+            changes of the other workers.
+    """
+
+    def __init__(self, table, catch_up_interval_ms: float = PREFIX_INDEX_CATCH_UP_MS):
+        self.table = table
+        self.catch_up_interval = catch_up_interval_ms / 1000
+        self._entries = {}
+        self._admin_owners = set()
+        # The ID of the last row, the deletion count and the time of the last check of
+        # each loaded database, by shard ID, 0 for the main database
+        self._databases = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _database(owner_id: int, owner_is_admin: bool) -> int:
+        """Return the shard holding the rows of an owner, 0 for the main database."""
+        return owner_id if shard_router.enabled and not owner_is_admin else 0
+
+    @contextmanager
+    def _session(self, db: Session, database: int):
+        """Provide a session reading a database, the given one when sharding is off."""
+        if not shard_router.enabled:
+            yield db
+            return
+        with open_shard(database) as session:
+            yield session
+
+    def _deletions(self, session: Session) -> int:
+        """Count the deletions from the table and from the users owning its rows."""
+        count = select(func.coalesce(func.sum(DeletionCount.count), 0))
+        rows = session.scalar(count.where(DeletionCount.table_name == self.table.__tablename__))
+        # Users are deleted from the main database
+        users = session.scalar(
+            count.where(DeletionCount.table_name == User.__tablename__),
+            bind_arguments={'bind': engine},
+        )
+        return rows + users
+
+    def _rows(self, session: Session, database: int, after_id: int = 0) -> list:
+        """Query the rows of a database to index whose ID is greater than the given one."""
+        table = self.table
+        if database:
+            # A shard only holds the rows of its user, who is not an admin
+            rows = (
+                session.query(table.id, table.name, table.user_id)
+                .filter(table.user_id == database, table.id > after_id)
+                .all()
+            )
+            return [(row_id, name, owner_id, False) for row_id, name, owner_id in rows]
+        return (
+            session.query(table.id, table.name, table.user_id, User.is_admin)
+            .join(User)
+            .filter(table.id > after_id)
+            .all()
+        )
+
+    def _load(self, db: Session, database: int):
+        """Build the index of the rows of a database, once."""
+        with self._lock:
+            if database in self._databases:
+                return
+            with self._session(db, database) as session:
+                deletions = self._deletions(session) if WEB_CONCURRENCY > 1 else 0
+                rows = self._rows(session, database)
+            for row_id, name, owner_id, owner_is_admin in rows:
+                self._entries.setdefault(owner_id, []).append((name.casefold(), row_id, name))
+                if owner_is_admin:
+                    self._admin_owners.add(owner_id)
+            for owner_id in {row[2] for row in rows}:
+                self._entries[owner_id].sort()
+            self._databases[database] = {
+                'max_id': max((row[0] for row in rows), default=0),
+                'deletions': deletions,
+                'checked_at': time.monotonic(),
+            }
+
+    def _unload(self, database: int):
+        """Drop the rows of a database from the index, to be loaded again."""
+        with self._lock:
+            for owner_id in list(self._entries):
+                if self._database(owner_id, owner_id in self._admin_owners) == database:
+                    del self._entries[owner_id]
+                    self._admin_owners.discard(owner_id)
+            self._databases.pop(database, None)
+
+    def _catch_up(self, db: Session, database: int):
+        """Pick up the changes the other server workers made to a database since the last check."""
+        now = time.monotonic()
+        with self._lock:
+            state = self._databases.get(database)
+            # The database may be being reloaded by another thread
+            if state is None or now - state['checked_at'] < self.catch_up_interval:
+                return
+            state['checked_at'] = now
+        with self._session(db, database) as session:
+            deletions = self._deletions(session)
+            rows = (
+                []
+                if deletions != state['deletions']
+                else self._rows(session, database, state['max_id'])
+            )
+        if deletions != state['deletions']:
+            self._unload(database)
+            self._load(db, database)
+            return
+        for row_id, name, owner_id, owner_is_admin in rows:
+            self.add(owner_id, row_id, name, owner_is_admin)
+        with self._lock:
+            state['max_id'] = max([state['max_id'], *(row[0] for row in rows)])
+
+    def add(self, owner_id: int, row_id: int, name: str, owner_is_admin: bool = False):
+        """
+        Index a newly created row.
+
+        Attributes:
+            owner_id (int): The ID of the user who owns the row.
+            row_id (int): The ID of the row.
+            name (str): The name of the row.
+            owner_is_admin (bool): Whether the owner is an admin.
+        """
+        with self._lock:
+            if self._database(owner_id, owner_is_admin) not in self._databases:
+                return
+            entries = self._entries.setdefault(owner_id, [])
+            entry = (name.casefold(), row_id, name)
+            position = bisect.bisect_left(entries, entry)
+            # The row may already have been picked up by a concurrent load
+            if position == len(entries) or entries[position] != entry:
+                entries.insert(position, entry)
+            if owner_is_admin:
+                self._admin_owners.add(owner_id)
+
+    def remove(self, owner_id: int, row_id: int, name: str):
+        """
+        Drop a deleted row from the index.
+
+        Attributes:
+            owner_id (int): The ID of the user who owns the row.
+            row_id (int): The ID of the row.
+            name (str): The name of the row.
+        """
+        with self._lock:
+            entries = self._entries.get(owner_id)
+            if not entries:
+                return
+            entry = (name.casefold(), row_id, name)
+            position = bisect.bisect_left(entries, entry)
+            if position < len(entries) and entries[position] == entry:
+                del entries[position]
+
+    def remove_owner(self, owner_id: int):
+        """
+        Drop every row of a deleted user from the index.
+
+        Attributes:
+            owner_id (int): The ID of the deleted user.
+        """
+        with self._lock:
+            self._entries.pop(owner_id, None)
+            self._admin_owners.discard(owner_id)
+
+    def search(self, db: Session, user_id: int, prefix: str, limit: int = 10) -> list:
+        """
+        Find the names visible to a user that start with a prefix, case-insensitively.
+
+        Attributes:
+            db (Session): SQLAlchemy session used to load the index and catch up on it.
+            user_id (int): The ID of the user searching.
+            prefix (str): The typed prefix.
+            limit (int): Maximum number of suggestions.
+
+        Returns:
+            list: Up to ``limit`` dicts with ``id`` and ``name``, sorted by name.
+        """
+        databases = [0]
+        if shard_router.enabled and shard_router.exists(user_id):
+            databases.append(user_id)
+        for database in databases:
+            if database not in self._databases:
+                self._load(db, database)
+            elif WEB_CONCURRENCY > 1:
+                self._catch_up(db, database)
+
+        key = prefix.casefold()
+        matches = []
+        with self._lock:
+            for owner_id in {user_id} | self._admin_owners:
+                entries = self._entries.get(owner_id, ())
+                position = bisect.bisect_left(entries, (key,))
+                for folded, row_id, name in entries[position : position + limit]:
+                    if not folded.startswith(key):
+                        break
+                    matches.append((folded, row_id, name))
+        matches.sort()
+        return [{'id': row_id, 'name': name} for _, row_id, name in matches[:limit]]
+
+
+dataset_index = PrefixIndex(Dataset)
+model_index = PrefixIndex(Model)
@@ -0,0 +1,247 @@
+"""Streaming, chunked profiling of dataset files with NumPy reductions."""
+
+import csv
+import json
+import logging
+import math
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from ..database.config import SessionLocal
+from ..database.db_models import DatasetProfile
+from ..database.transactions import commit
+
+# Number of rows parsed and reduced at once
+PROFILE_CHUNK_ROWS = int(os.environ.get('PROFILE_CHUNK_ROWS', 65536))
+# Number of profiles computed concurrently in the background
+PROFILE_WORKERS = int(os.environ.get('PROFILE_WORKERS', 1))
+# Maximum number of bins of a numeric histogram
+HISTOGRAM_BINS = 32
+# Distinct values tracked per column before the value counts are dropped
+MAX_DISTINCT_VALUES = 1000
+# Number of most frequent values reported per column
+TOP_VALUES = 10
+
+NULL_TOKENS = np.array(['', 'na', 'n/a', 'nan', 'null', 'none'])
+
+logger = logging.getLogger(__name__)
+
+
+class ColumnProfile:
+    """
+    Running statistics of one column, updated chunk by chunk.
+
+    Numeric histograms use bins of a power-of-two width anchored at zero. When the
+    values outgrow the bin budget the width is doubled and neighbouring bins merge
+    exactly, so a single pass is enough whatever the value range.
+
+    Attributes:
+        name (str): The column name from the header.
+        count (int): The number of values seen.
+        nulls (int): The number of empty or null-like values.
+        numeric (bool): Whether every non-null value so far parsed as a number.
+        integral (bool): Whether every numeric value so far is a whole number.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+        self.nulls = 0
+        self.numeric = True
+        self.integral = True
+        self.minimum = math.inf
+        self.maximum = -math.inf
+        self.total = 0.0
+        self.total_squares = 0.0
+        self.bin_width = None
+        self.bins = Counter()
+        self.values = Counter()
+
+    def update(self, values: np.ndarray):
+        """
+        Fold a chunk of raw string values into the statistics.
+
+        Attributes:
+            values (np.ndarray): The column values of the chunk, as strings.
+        """
+        self.count += values.size
+        null_mask = np.isin(np.char.lower(np.char.strip(values)), NULL_TOKENS)
+        self.nulls += int(null_mask.sum())
+        present = values[~null_mask]
+        if present.size == 0:
+            return
+
+        if self.values is not None:
+            distinct, counts = np.unique(present, return_counts=True)
+            self.values.update(dict(zip(distinct.tolist(), counts.tolist())))
+            if len(self.values) > MAX_DISTINCT_VALUES:
+                self.values = None
+
+        if self.numeric:
+            try:
+                numbers = present.astype(np.float64)
+            except ValueError:
+                self.numeric = False
+                return
+            numbers = numbers[np.isfinite(numbers)]
+            if numbers.size:
+                self._update_numeric(numbers)
+
+    def _update_numeric(self, numbers: np.ndarray):
+        """Fold a chunk of finite numbers into the moments and the histogram."""
+        self.integral = self.integral and bool(np.all(numbers == np.floor(numbers)))
+        self.minimum = min(self.minimum, float(numbers.min()))
+        self.maximum = max(self.maximum, float(numbers.max()))
+        self.total += float(numbers.sum())
+        self.total_squares += float(np.square(numbers).sum())
+
+        if self.bin_width is None:
+            spread = self.maximum - self.minimum
+            self.bin_width = 2.0 ** math.ceil(math.log2(spread / HISTOGRAM_BINS)) if spread else 1.0
+        while (
+            math.floor(self.maximum / self.bin_width) - math.floor(self.minimum / self.bin_width)
+            >= HISTOGRAM_BINS
+        ):
+            self.bin_width *= 2
+            merged = Counter()
+            for index, count in self.bins.items():
+                merged[index // 2] += count
+            self.bins = merged
+
+        indexes, counts = np.unique(np.floor(numbers / self.bin_width), return_counts=True)
+        self.bins.update(dict(zip(indexes.astype(np.int64).tolist(), counts.tolist())))
+
+    def result(self) -> dict:
+        """
+        Summarize the column.
+
+        Returns:
+            dict: The type, null rate, numeric summary and value histogram of the column.
+        """
+        present = self.count - self.nulls
+        numeric = self.numeric and present > 0 and self.minimum <= self.maximum
+        summary = {
+            'name': self.name,
+            'type': ('integer' if self.integral else 'float') if numeric else 'string',
+            'count': self.count,
+            'null_count': self.nulls,
+            'null_rate': self.nulls / self.count if self.count else 0.0,
+            'distinct_count': len(self.values) if self.values is not None else None,
+        }
+        if numeric:
+            numeric_count = sum(self.bins.values())
+            mean = self.total / numeric_count
+            summary.update(
+                minimum=self.minimum,
+                maximum=self.maximum,
+                mean=mean,
+                std=math.sqrt(max(self.total_squares / numeric_count - mean * mean, 0.0)),
+                histogram=[
+                    {
+                        'low': index * self.bin_width,
+                        'high': (index + 1) * self.bin_width,
+                        'count': count,
+                    }
+                    for index, count in sorted(self.bins.items())
+                ],
+            )
+        elif self.values is not None:
+            summary['top_values'] = [
+                {'value': value, 'count': count}
+                for value, count in self.values.most_common(TOP_VALUES)
+            ]
+        return summary
+
+
+def profile_file(path: str, chunk_rows: int = PROFILE_CHUNK_ROWS) -> dict:
+    """
+    Profile a delimited text file with a header row in one streaming pass.
+
+    Attributes:
+        path (str): The location of the file.
+        chunk_rows (int): Number of rows parsed and reduced at once.
+
+    Returns:
+        dict: The row count and the per-column profiles.
+    """
+    with open(path, newline='', encoding='utf-8', errors='replace') as file:
+        sample = file.read(64 * 1024)
+        file.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(file, dialect)
+        header = next(reader, [])
+        columns = [ColumnProfile(name) for name in header]
+        row_count = 0
+
+        while True:
+            rows = [row for _, row in zip(range(chunk_rows), reader)]
+            if not rows:
+                break
+            row_count += len(rows)
+            width = len(columns)
+            # Ragged rows are padded with empty values or truncated to the header width
+            rows = [row[:width] + [''] * (width - len(row)) for row in rows]
+            for column, values in zip(columns, zip(*rows)):
+                column.update(np.array(values, dtype=str))
+
+    return {'row_count': row_count, 'columns': [column.result() for column in columns]}
+
+
+class ProfileWorker:
+    """
+    Compute dataset profiles in background threads, once per file content.
+
+    Profiles are stored against the SHA-256 of the file, so a file shared by several
+    datasets, or viewed again, is profiled only once.
+
+    Attributes:
+        executor (ThreadPoolExecutor): The pool running the computations.
+    """
+
+    def __init__(self, workers: int = PROFILE_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='profile')
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def submit(self, file_hash: str, path: str):
+        """
+        Start profiling a file unless it is already being profiled.
+
+        Attributes:
+            file_hash (str): The SHA-256 of the file.
+            path (str): The location of the file.
+        """
+        with self._lock:
+            if file_hash not in self._running:
+                self._running[file_hash] = self.executor.submit(self._run, file_hash, path)
+
+    def _run(self, file_hash: str, path: str):
+        """Profile the file and store the result, or the error, against its hash."""
+        try:
+            result = {'profile': json.dumps(profile_file(path)), 'error': None}
+        except Exception as exc:
+            logger.exception('Profiling %s failed', file_hash)
+            result = {'profile': None, 'error': str(exc)}
+        db = SessionLocal()
+        try:
+            if db.get(DatasetProfile, file_hash) is None:
+                db.add(DatasetProfile(file_hash=file_hash, **result))
+                commit(db)
+        finally:
+            db.close()
+            with self._lock:
+                self._running.pop(file_hash, None)
+
+    def shutdown(self):
+        """Wait for the running computations and stop the pool."""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+profile_worker = ProfileWorker()
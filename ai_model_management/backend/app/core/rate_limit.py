@@ -0,0 +1,322 @@
+"""Admission control: per-user/per-IP token buckets and a global in-flight limit."""
+
+import hashlib
+import logging
+import math
+import multiprocessing
+import os
+import time
+from contextlib import contextmanager
+
+import jwt
+
+# Route classes used to pick a bucket configuration
+AUTH = 'auth'
+WRITES = 'writes'
+READS = 'reads'
+
+# Paths issuing tokens, through the password hashing path or from a refresh token
+AUTH_PATHS = {'/token', '/signin', '/token/refresh'}
+WRITE_METHODS = {'POST', 'PUT', 'PATCH', 'DELETE'}
+
+# Number of slots of the bucket table, shared by all the tracked users and IPs
+MAX_BUCKETS = 10000
+# Number of server workers whose in-flight requests are counted apart, including the
+# extra worker of a rolling restart
+MAX_WORKERS = 256
+# Seconds after which the lock is deemed held by a worker that exited, every critical
+# section taking microseconds
+LOCK_RECOVERY_SECONDS = 1
+
+logger = logging.getLogger(__name__)
+
+
+def _limit_from_env(name, default_rate, default_burst):
+    """
+    Read a "<rate>/<burst>" bucket configuration from an environment variable.
+
+    Attributes:
+        name (str): The environment variable name.
+        default_rate (float): Tokens added per second if the variable is not set.
+        default_burst (int): Bucket capacity if the variable is not set.
+
+    Returns:
+        tuple: The (rate, burst) pair.
+    """
+    value = os.environ.get(name)
+    if not value:
+        return default_rate, default_burst
+    rate, burst = value.split('/')
+    return float(rate), int(burst)
+
+
+def _key_hash(key: tuple) -> int:
+    """Hash a bucket key to a non-zero 63-bit integer, stable across processes."""
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') >> 1 or 1
+
+
+class AdmissionController:
+    """
+    Decide whether a request is admitted, rate limited, or shed because of overload.
+
+    The token buckets and the counters live in shared memory guarded by a process
+    lock. When the application is preloaded before forking workers, as done by
+    ``app.serve``, every worker shares them, so the limits hold for the server as a
+    whole rather than per worker.
+
+    Buckets are kept in a fixed table indexed by a hash of their key. A key landing
+    on a slot held by another key takes it over with a full bucket, which bounds the
+    memory like the eviction of the least recently used bucket would.
+
+    The in-flight requests are also counted by worker slot, so that when a worker
+    exits, e.g. killed by the master after its graceful timeout, the master gives
+    back the ones it was processing with ``release_worker``, as well as the lock if
+    the worker died holding it.
+
+    Attributes:
+        limits (dict): Mapping of route class to its (rate, burst) configuration.
+        max_in_flight (int): Maximum number of requests processed concurrently.
+        max_buckets (int): Number of slots of the bucket table.
+        worker_slot (int): The slot of this process, set by the master in each worker.
+    """
+
+    def __init__(self, limits: dict, max_in_flight: int, max_buckets: int = MAX_BUCKETS):
+        self.limits = limits
+        self.max_in_flight = max_in_flight
+        self.max_buckets = max_buckets
+        self.worker_slot = 0
+        self._shed_reasons = ['overloaded', *limits]
+        self._keys = multiprocessing.RawArray('q', max_buckets)
+        self._tokens = multiprocessing.RawArray('d', max_buckets)
+        self._updated_at = multiprocessing.RawArray('d', max_buckets)
+        # In-flight requests, admitted requests, then the shed requests by reason
+        self._counters = multiprocessing.RawArray('q', 2 + len(self._shed_reasons))
+        self._worker_in_flight = multiprocessing.RawArray('q', MAX_WORKERS)
+        self._lock = multiprocessing.Lock()
+        # PID of the process holding the lock, 0 when free
+        self._holder = multiprocessing.RawValue('q', 0)
+
+    @contextmanager
+    def _locked(self):
+        """Hold the lock, recording the process holding it."""
+        with self._lock:
+            self._holder.value = os.getpid()
+            try:
+                yield
+            finally:
+                self._holder.value = 0
+
+    def _take(self, key: tuple, now: float) -> float:
+        """
+        Try to take one token from the bucket of a key, refilled continuously at its rate.
+
+        Attributes:
+            key (tuple): The (route class, 'ip' or 'user', value) bucket key.
+            now (float): The current monotonic time.
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds until one is available.
+        """
+        rate, capacity = self.limits[key[0]]
+        key_hash = _key_hash(key)
+        slot = key_hash % self.max_buckets
+        if self._keys[slot] != key_hash:
+            self._keys[slot] = key_hash
+            self._tokens[slot] = capacity
+            self._updated_at[slot] = now
+        tokens = min(capacity, self._tokens[slot] + (now - self._updated_at[slot]) * rate)
+        self._updated_at[slot] = now
+        if tokens >= 1:
+            self._tokens[slot] = tokens - 1
+            return 0.0
+        self._tokens[slot] = tokens
+        return (1 - tokens) / rate
+
+    def acquire(self, route_class: str, client_ip: str, user: str | None = None):
+        """
+        Admit a request or report why it was rejected.
+
+        An authenticated request takes a token from the bucket of its user for the
+        route class, so that users sharing an address, e.g. behind a NAT or a proxy,
+        do not limit each other. An anonymous request takes one from the bucket of
+        its client IP.
+
+        Attributes:
+            route_class (str): One of the AUTH, WRITES or READS route classes.
+            client_ip (str): The address of the client.
+            user (str | None): The subject of the bearer token, if any.
+
+        Returns:
+            tuple: (status_code, retry_after) where status_code is None if admitted.
+        """
+        with self._locked():
+            if self._counters[0] >= self.max_in_flight:
+                self._counters[2] += 1
+                return 503, 1
+
+            # CLOCK_MONOTONIC is system-wide, so workers agree on the bucket times
+            now = time.monotonic()
+            if user is not None:
+                wait = self._take((route_class, 'user', user), now)
+            else:
+                wait = self._take((route_class, 'ip', client_ip), now)
+            if wait:
+                self._counters[2 + self._shed_reasons.index(route_class)] += 1
+                return 429, max(1, math.ceil(wait))
+
+            self._counters[0] += 1
+            self._counters[1] += 1
+            self._worker_in_flight[self.worker_slot] += 1
+            return None, 0
+
+    def release(self):
+        """Mark an admitted request as finished."""
+        with self._locked():
+            self._counters[0] -= 1
+            self._worker_in_flight[self.worker_slot] -= 1
+
+    def release_worker(self, slot: int, pid: int):
+        """
+        Give back the in-flight requests of a worker that exited, and the lock if it
+        died holding it.
+
+        Attributes:
+            slot (int): The worker slot of the exited worker.
+            pid (int): The PID of the exited worker.
+        """
+        if not self._lock.acquire(timeout=LOCK_RECOVERY_SECONDS):
+            if self._holder.value not in (0, pid):
+                # Held by a live process after all
+                self._lock.acquire()
+            else:
+                # The worker exited holding the lock, which is taken over
+                logger.warning('Worker %d exited holding the admission lock', pid)
+        try:
+            self._counters[0] -= self._worker_in_flight[slot]
+            self._worker_in_flight[slot] = 0
+        finally:
+            self._holder.value = 0
+            self._lock.release()
+
+    def stats(self) -> dict:
+        """
+        Snapshot the admission counters.
+
+        Returns:
+            dict: Admitted and shed request counts and the current in-flight value.
+        """
+        with self._locked():
+            return {
+                'in_flight': self._counters[0],
+                'max_in_flight': self.max_in_flight,
+                'admitted': self._counters[1],
+                'shed': dict(zip(self._shed_reasons, self._counters[2:])),
+                'tracked_buckets': sum(1 for key_hash in self._keys if key_hash),
+            }
+
+
+def classify(method: str, path: str) -> str:
+    """
+    Map a request to its route class.
+
+    Attributes:
+        method (str): The HTTP method.
+        path (str): The request path.
+
+    Returns:
+        str: The route class of the request.
+    """
+    if path in AUTH_PATHS:
+        return AUTH
+    if method in WRITE_METHODS:
+        return WRITES
+    return READS
+
+
+def token_subject(headers: list) -> str | None:
+    """
+    Extract the subject of the bearer token from raw ASGI headers.
+
+    Only the signature is checked, the user is not looked up in the database.
+
+    Attributes:
+        headers (list): The raw ASGI header pairs.
+
+    Returns:
+        str | None: The token subject, or None if there is no valid token.
+    """
+    for name, value in headers:
+        if name == b'authorization':
+            scheme, _, token = value.decode('latin-1').partition(' ')
+            if scheme.lower() != 'bearer' or not token:
+                return None
+            # Imported lazily to avoid a circular import with the users module
+            from ..api.users import ALGORITHM, SECRET_KEY
+
+            try:
+                return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]).get('sub')
+            except jwt.PyJWTError:
+                return None
+    return None
+
+
+admission_controller = AdmissionController(
+    limits={
+        AUTH: _limit_from_env('RATE_LIMIT_AUTH', 1, 10),
+        WRITES: _limit_from_env('RATE_LIMIT_WRITES', 20, 40),
+        READS: _limit_from_env('RATE_LIMIT_READS', 50, 100),
+    },
+    max_in_flight=int(os.environ.get('MAX_IN_FLIGHT_REQUESTS', 64)),
+)
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware rejecting requests with 429 or 503 before they reach the routes.
+
+    Attributes:
+        app: The wrapped ASGI application.
+        controller (AdmissionController): The controller deciding on admission.
+    """
+
+    def __init__(self, app, controller: AdmissionController = admission_controller):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'OPTIONS':
+            await self.app(scope, receive, send)
+            return
+
+        client_ip = scope['client'][0] if scope.get('client') else 'unknown'
+        route_class = classify(scope['method'], scope['path'])
+        user = token_subject(scope['headers']) if route_class != AUTH else None
+
+        status_code, retry_after = self.controller.acquire(route_class, client_ip, user)
+        if status_code is not None:
+            await self._reject(send, status_code, retry_after)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release()
+
+    @staticmethod
+    async def _reject(send, status_code: int, retry_after: int):
+        """Send a minimal JSON rejection response with a Retry-After header."""
+        detail = 'Too many requests' if status_code == 429 else 'Server is overloaded'
+        body = b'{"detail":"' + detail.encode() + b'"}'
+        await send(
+            {
+                'type': 'http.response.start',
+                'status': status_code,
+                'headers': [
+                    (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode()),
+                    (b'retry-after', str(retry_after).encode()),
+                ],
+            }
+        )
+        await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,422 @@
+"""On-demand sampling profiler of requests, storing flamegraph-compatible profiles."""
+
+import asyncio
+import contextvars
+import functools
+import glob
+import hashlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from urllib.parse import parse_qs
+
+from starlette.concurrency import run_in_threadpool
+
+from ..database.config import SessionLocal
+from ..database.db_models import User, current_timestamp
+from .rate_limit import token_subject
+
+# Milliseconds between two samples of the stacks of a profiled request
+REQUEST_PROFILE_INTERVAL_MS = float(os.environ.get('REQUEST_PROFILE_INTERVAL_MS', 5))
+# Number of slowest requests profiled and kept per route, 0 turns the rolling sampler off
+REQUEST_PROFILE_SLOWEST = int(os.environ.get('REQUEST_PROFILE_SLOWEST', 0))
+# Number of profiles requested by admins kept, the oldest are deleted first
+REQUEST_PROFILE_MAX_REQUESTED = int(os.environ.get('REQUEST_PROFILE_MAX_REQUESTED', 100))
+# Directory of the stored profiles, shared by the server workers
+REQUEST_PROFILE_DIR = os.environ.get('REQUEST_PROFILE_DIR', './profiles')
+
+logger = logging.getLogger(__name__)
+
+# The profile of the request being served, copied into the tasks and threads serving it
+current_profile = contextvars.ContextVar('current_profile', default=None)
+
+
+class RequestProfile:
+    """
+    Stacks sampled while serving a request, counted per distinct stack.
+
+    Attributes:
+        id (str): A unique identifier for the profile.
+        method (str): The HTTP method of the request.
+        path (str): The path of the request.
+        trigger (str): 'request' if asked for by an admin, 'slowest' if kept by the rolling sampler.
+    """
+
+    def __init__(self, method: str, path: str, trigger: str):
+        self.id = uuid.uuid4().hex
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.route = path
+        self.status_code = None
+        self.duration_ms = None
+        self.creation_date = current_timestamp()
+        self.stacks = Counter()
+        self._started = time.perf_counter()
+
+    def finish(self, route: str, status_code: int | None):
+        """
+        Record the outcome of the request once it is served.
+
+        Attributes:
+            route (str): The path template of the matched route.
+            status_code (int | None): The status code of the response, if one was sent.
+        """
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+        self.route = route
+        self.status_code = status_code
+
+    def metadata(self) -> dict:
+        """Describe the profile, without its stacks."""
+        return {
+            'id': self.id,
+            'trigger': self.trigger,
+            'method': self.method,
+            'path': self.path,
+            'route': self.route,
+            'status_code': self.status_code,
+            'duration_ms': self.duration_ms,
+            'samples': sum(self.stacks.values()),
+            'creation_date': self.creation_date,
+        }
+
+    def folded(self) -> str:
+        """
+        Format the stacks in the folded format read by flamegraph.pl and speedscope.
+
+        Returns:
+            str: One line per distinct stack, root first, frames separated by
+            semicolons and followed by the number of samples.
+        """
+        return ''.join(f"{';'.join(stack)} {count}\n" for stack, count in self.stacks.items())
+
+
+@functools.lru_cache(maxsize=4096)
+def _frame_name(code) -> str:
+    """Name a frame after its function and the file and line it is defined at."""
+    return f'{code.co_qualname} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def _runner_contexts() -> dict:
+    """
+    Map the code of the frames running work on behalf of a task to their context getter.
+
+    Coroutines run from asyncio handles and threadpool calls run from anyio worker
+    threads, both inside the context copied from the request, so the context of
+    the innermost of these frames tells which request a stack works for.
+    """
+    runners = {asyncio.events.Handle._run.__code__: lambda frame: frame.f_locals['self']._context}
+    try:
+        from anyio._backends._asyncio import WorkerThread
+
+        runners[WorkerThread.run.__code__] = lambda frame: frame.f_locals.get('context')
+    except (ImportError, AttributeError):
+        logger.warning('Threadpool calls are not attributed to the profiled requests')
+    return runners
+
+
+class StackSampler:
+    """
+    Background thread sampling the stacks of every thread while requests are profiled.
+
+    Each sample walks the stack of each thread down to the frame running it for a
+    task or a threadpool call, and adds the frames above it to the profile found in
+    that context. The thread only runs while a profiled request is in progress, so
+    profiling costs nothing when it is off.
+
+    Attributes:
+        interval (float): Seconds between two samples.
+    """
+
+    def __init__(self, interval_ms: float = REQUEST_PROFILE_INTERVAL_MS):
+        self.interval = interval_ms / 1000
+        self._active = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._runners = None
+
+    def start(self, profile: RequestProfile):
+        """
+        Sample the stacks of a request until it is stopped.
+
+        Attributes:
+            profile (RequestProfile): The profile collecting the samples of the request.
+        """
+        with self._lock:
+            self._active.add(profile)
+            if self._runners is None:
+                self._runners = _runner_contexts()
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name='request-profiler', daemon=True
+                )
+                self._thread.start()
+
+    def stop(self, profile: RequestProfile):
+        """
+        Stop sampling the stacks of a request.
+
+        Attributes:
+            profile (RequestProfile): The profile of the request.
+        """
+        with self._lock:
+            self._active.discard(profile)
+
+    def _run(self):
+        """Thread loop: sample until no request is profiled anymore."""
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                active = set(self._active)
+            frames = sys._current_frames()
+            for thread_id, frame in frames.items():
+                if thread_id != own_id:
+                    self._sample(frame, active)
+            # Do not keep the frames of the threads alive while sleeping
+            del frames, frame
+            time.sleep(self.interval)
+
+    def _sample(self, frame, active: set):
+        """Add the stack of a thread to the profile of the request it works for, if any."""
+        stack = []
+        while frame is not None:
+            get_context = self._runners.get(frame.f_code)
+            if get_context is not None:
+                context = get_context(frame)
+                profile = context.get(current_profile) if context is not None else None
+                if profile in active:
+                    profile.stacks[tuple(reversed(stack))] += 1
+                return
+            stack.append(_frame_name(frame.f_code))
+            frame = frame.f_back
+
+
+class ProfileStore:
+    """
+    Profiles stored as files, a JSON description next to the folded stacks.
+
+    File names start with the trigger and a sort key, the creation time for the
+    profiles requested by admins and the duration for the slowest requests of a
+    route, so that pruning only lists the directory.
+
+    Attributes:
+        directory (str): The directory of the profile files.
+        max_requested (int): Number of profiles requested by admins kept.
+        slowest (int): Number of slowest requests kept per route.
+    """
+
+    def __init__(
+        self,
+        directory: str = REQUEST_PROFILE_DIR,
+        max_requested: int = REQUEST_PROFILE_MAX_REQUESTED,
+        slowest: int = REQUEST_PROFILE_SLOWEST,
+    ):
+        self.directory = directory
+        self.max_requested = max_requested
+        self.slowest = slowest
+        # Duration of the slowest requests kept per route, as last seen by this process
+        self._thresholds = {}
+
+    def _prefix(self, profile: RequestProfile) -> str:
+        """Return the file name prefix shared by the profiles pruned together."""
+        if profile.trigger == 'request':
+            return 'request-'
+        route_key = hashlib.sha1(f'{profile.method} {profile.route}'.encode()).hexdigest()[:16]
+        return f'slowest-{route_key}-'
+
+    def save(self, profile: RequestProfile):
+        """
+        Store a profile, then prune the profiles of the same kind over the limit.
+
+        Profiles of the slowest requests are only stored if the request is slower
+        than those already kept for its route.
+
+        Attributes:
+            profile (RequestProfile): The finished profile.
+        """
+        prefix = self._prefix(profile)
+        if profile.trigger == 'request':
+            sort_key, keep = time.time_ns(), self.max_requested
+        else:
+            sort_key, keep = round(profile.duration_ms * 1000), self.slowest
+            if sort_key <= self._thresholds.get(prefix, -1):
+                return
+
+        os.makedirs(self.directory, exist_ok=True)
+        stem = os.path.join(self.directory, f'{prefix}{sort_key:020d}-{profile.id}')
+        with open(f'{stem}.folded.tmp', 'w') as file:
+            file.write(profile.folded())
+        os.replace(f'{stem}.folded.tmp', f'{stem}.folded')
+        with open(f'{stem}.json.tmp', 'w') as file:
+            json.dump(profile.metadata(), file)
+        os.replace(f'{stem}.json.tmp', f'{stem}.json')
+
+        kept = sorted(glob.glob(os.path.join(self.directory, f'{prefix}*.json')))
+        for path in kept[:-keep]:
+            for suffix in ('.json', '.folded'):
+                try:
+                    os.remove(path[: -len('.json')] + suffix)
+                except FileNotFoundError:
+                    # Pruned concurrently by another worker
+                    pass
+        if profile.trigger == 'slowest' and len(kept) >= keep:
+            threshold = os.path.basename(kept[-keep])[len(prefix) :].split('-')[0]
+            self._thresholds[prefix] = int(threshold)
+
+    def list(self, route: str | None = None) -> list:
+        """
+        Describe the stored profiles, slowest first.
+
+        Attributes:
+            route (str | None): Only describe the profiles of this route template.
+
+        Returns:
+            list: The descriptions of the profiles.
+        """
+        profiles = []
+        for path in glob.glob(os.path.join(self.directory, '*.json')):
+            try:
+                with open(path) as file:
+                    metadata = json.load(file)
+            except FileNotFoundError:
+                continue
+            if route is None or metadata['route'] == route:
+                profiles.append(metadata)
+        return sorted(profiles, key=lambda metadata: metadata['duration_ms'], reverse=True)
+
+    def folded(self, profile_id: str) -> str | None:
+        """
+        Read the folded stacks of a profile.
+
+        Attributes:
+            profile_id (str): The ID of the profile.
+
+        Returns:
+            str | None: The folded stacks, or None if there is no such profile.
+        """
+        if not profile_id.isalnum():
+            return None
+        for path in glob.glob(os.path.join(self.directory, f'*-{profile_id}.folded')):
+            try:
+                with open(path) as file:
+                    return file.read()
+            except FileNotFoundError:
+                return None
+        return None
+
+
+stack_sampler = StackSampler()
+profile_store = ProfileStore()
+
+
+def profile_requested(scope) -> bool:
+    """
+    Tell whether a request asks to be profiled, with an ``X-Profile: 1`` header or ``?profile=1``.
+
+    Attributes:
+        scope (dict): The ASGI scope of the request.
+
+    Returns:
+        bool: Whether the request asks to be profiled.
+    """
+    for name, value in scope['headers']:
+        if name == b'x-profile':
+            return value in (b'1', b'true')
+    if b'profile' in scope['query_string']:
+        values = parse_qs(scope['query_string'].decode('latin-1')).get('profile', [])
+        return values[-1:] in (['1'], ['true'])
+    return False
+
+
+def is_admin(email: str | None) -> bool:
+    """
+    Tell whether a token subject is an admin.
+
+    Attributes:
+        email (str | None): The subject of the bearer token.
+
+    Returns:
+        bool: Whether the user exists and is an admin.
+    """
+    if email is None:
+        return False
+    db = SessionLocal()
+    try:
+        return bool(db.query(User.is_admin).filter(User.email == email).scalar())
+    finally:
+        db.close()
+
+
+class RequestProfilingMiddleware:
+    """
+    ASGI middleware profiling the requests of admins asking for it, and the slowest requests.
+
+    A profiled request answers with an ``X-Profile-Id`` header naming its stored
+    profile. Requests of other users asking for a profile are served unprofiled.
+    With the rolling sampler off, requests not asking for a profile go straight
+    through.
+
+    Attributes:
+        app: The wrapped ASGI application.
+        sampler (StackSampler): The sampler of the stacks.
+        store (ProfileStore): The store of the finished profiles.
+    """
+
+    def __init__(
+        self, app, sampler: StackSampler = stack_sampler, store: ProfileStore = profile_store
+    ):
+        self.app = app
+        self.sampler = sampler
+        self.store = store
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        requested = profile_requested(scope)
+        if requested:
+            requested = await run_in_threadpool(is_admin, token_subject(scope['headers']))
+        if not requested and self.store.slowest <= 0:
+            await self.app(scope, receive, send)
+            return
+
+        profile = RequestProfile(
+            scope['method'], scope['path'], 'request' if requested else 'slowest'
+        )
+        status_code = None
+
+        async def send_with_profile_id(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                if requested:
+                    message = dict(message)
+                    message['headers'] = [
+                        *message.get('headers', []),
+                        (b'x-profile-id', profile.id.encode()),
+                    ]
+            await send(message)
+
+        token = current_profile.set(profile)
+        self.sampler.start(profile)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            self.sampler.stop(profile)
+            current_profile.reset(token)
+            route = scope.get('route')
+            profile.finish(getattr(route, 'path', scope['path']), status_code)
+            try:
+                await run_in_threadpool(self.store.save, profile)
+            except OSError:
+                logger.exception(
+                    'Storing the profile of %s %s failed', profile.method, profile.path
+                )
@@ -0,0 +1,160 @@
+"""Cache of training results, keyed by a fingerprint of everything the run depends on."""
+
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from ..database.config import SessionLocal
+from ..database.db_models import Dataset, Model, TrainingResult, current_timestamp
+from ..database.transactions import begin_write, commit
+from .background import PeriodicJob
+
+# Maximum number of cached results, the least recently used are evicted first by a
+# background job, so the cache may exceed it between two of its runs
+TRAINING_CACHE_MAX_ENTRIES = int(os.environ.get('TRAINING_CACHE_MAX_ENTRIES', 10000))
+# Age in days after which cached results are no longer reused, 0 disables the cache
+TRAINING_CACHE_MAX_AGE_DAYS = float(os.environ.get('TRAINING_CACHE_MAX_AGE_DAYS', 30))
+# Seconds between two evictions of the expired and least recently used results
+TRAINING_CACHE_EVICT_INTERVAL_SECONDS = float(
+    os.environ.get('TRAINING_CACHE_EVICT_INTERVAL_SECONDS', 600)
+)
+
+DATE_FORMAT = '%Y/%m/%d %H:%M:%S'
+
+
+def training_fingerprint(model: Model, dataset: Dataset, params: dict) -> str:
+    """
+    Fingerprint the inputs of a training run.
+
+    The model version is the hash of its uploaded artifact and the dataset is
+    identified by the hash of its file, so re-uploading different weights or data
+    changes the fingerprint while identical files shared by several records do not.
+
+    Attributes:
+        model (Model): The trained model.
+        dataset (Dataset): The dataset trained on.
+        params (dict): The hyperparameters of the training.
+
+    Returns:
+        str: The SHA-256 of the canonical JSON encoding of the inputs.
+    """
+    key = {
+        'model': model.artifact_hash or f'model-{model.id}',
+        'dataset': dataset.file_hash or f'dataset-{dataset.id}',
+        'params': params,
+    }
+    encoded = json.dumps(key, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+def _cutoff() -> str:
+    """Return the creation date before which cached results have expired."""
+    oldest = datetime.now() - timedelta(days=TRAINING_CACHE_MAX_AGE_DAYS)
+    return oldest.strftime(DATE_FORMAT)
+
+
+def get_result(db: Session, fingerprint: str) -> TrainingResult | None:
+    """
+    Look up the cached results of a run and mark them as used, the caller commits.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        fingerprint (str): The fingerprint of the run.
+
+    Returns:
+        TrainingResult | None: The results, or None if the run is not cached or has expired.
+    """
+    if TRAINING_CACHE_MAX_AGE_DAYS <= 0:
+        return None
+    result = (
+        db.query(TrainingResult)
+        .filter(
+            TrainingResult.fingerprint == fingerprint, TrainingResult.creation_date >= _cutoff()
+        )
+        .first()
+    )
+    if result is not None:
+        result.hits += 1
+        result.last_used = current_timestamp()
+    return result
+
+
+def put_result(db: Session, fingerprint: str, precision: float, recall: float, training_id: int):
+    """
+    Cache the results of a run.
+
+    Expired and least recently used results are evicted by a background job,
+    outside of the write transactions of the routes.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        fingerprint (str): The fingerprint of the run.
+        precision (float): The precision of the run.
+        recall (float): The recall of the run.
+        training_id (int): The ID of the training that computed the results.
+    """
+    if TRAINING_CACHE_MAX_AGE_DAYS <= 0:
+        return
+    now = current_timestamp()
+    values = {
+        'precision': precision,
+        'recall': recall,
+        'training_id': training_id,
+        'hits': 0,
+        'creation_date': now,
+        'last_used': now,
+    }
+    begin_write(db)
+    # A forced fresh run, or an expired entry, replaces the previous results
+    db.execute(
+        insert(TrainingResult)
+        .values(fingerprint=fingerprint, **values)
+        .on_conflict_do_update(index_elements=['fingerprint'], set_=values)
+    )
+    commit(db)
+
+
+def evict(db: Session) -> int:
+    """
+    Delete the expired results and the least recently used ones over the size limit.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+
+    Returns:
+        int: The number of results deleted.
+    """
+    begin_write(db)
+    evicted = (
+        db.query(TrainingResult)
+        .filter(TrainingResult.creation_date < _cutoff())
+        .delete(synchronize_session=False)
+    )
+    overflow = (
+        db.query(TrainingResult.fingerprint)
+        .order_by(TrainingResult.last_used.desc())
+        .offset(TRAINING_CACHE_MAX_ENTRIES)
+    )
+    evicted += (
+        db.query(TrainingResult)
+        .filter(TrainingResult.fingerprint.in_(overflow))
+        .delete(synchronize_session=False)
+    )
+    commit(db)
+    return evicted
+
+
+def evict_results():
+    """Evict from the cache in a session of its own, the function of the eviction job."""
+    db = SessionLocal()
+    try:
+        evict(db)
+    finally:
+        db.close()
+
+
+cache_evictor = PeriodicJob('result-cache', evict_results, TRAINING_CACHE_EVICT_INTERVAL_SECONDS)
@@ -0,0 +1,148 @@
+"""Coalescing of identical concurrent reads into a single execution."""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from functools import lru_cache
+from typing import Any, Callable, Hashable
+
+from fastapi import Response
+from pydantic import TypeAdapter
+
+from ..database.transactions import transaction_stats
+
+# Longest time a request waits for the identical one in flight before giving up
+SINGLE_FLIGHT_TIMEOUT_SECONDS = float(os.environ.get('SINGLE_FLIGHT_TIMEOUT_SECONDS', 30))
+
+
+class CoalescingTimeout(Exception):
+    """Raised when the identical request in flight did not finish in time."""
+
+
+class SingleFlight:
+    """
+    Run at most one execution per key and generation at a time, sharing its result
+    with the callers asking for the same key meanwhile.
+
+    Each execution is stamped with the generation of the data when it starts, e.g. the
+    number of write transactions committed so far. A caller only joins an execution
+    of the current generation, and starts a new one otherwise, so that it never gets
+    a result missing a write committed before its request, such as the training a
+    user created just before listing them. Results are not kept once the execution
+    ends. Coalescing happens within a server worker; the counters live in shared
+    memory, so that they cover the whole server when the application is preloaded
+    before forking workers, as done by ``app.serve``.
+
+    Attributes:
+        timeout (float): Seconds a caller waits for the execution in flight.
+        generation (Callable[[], int]): Returns the generation of the data, which
+            changes whenever it may have changed.
+    """
+
+    names = ('executions', 'shared', 'timeouts')
+
+    def __init__(
+        self,
+        timeout: float = SINGLE_FLIGHT_TIMEOUT_SECONDS,
+        generation: Callable[[], int] = lambda: 0,
+    ):
+        self.timeout = timeout
+        self.generation = generation
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._counters = multiprocessing.RawArray('q', len(self.names))
+        self._counters_lock = multiprocessing.Lock()
+
+    def _count(self, name: str):
+        with self._counters_lock:
+            self._counters[self.names.index(name)] += 1
+
+    def do(self, key: Hashable, function: Callable[[], Any]) -> Any:
+        """
+        Call a function, or wait for the call in flight with the same key, if it
+        started since the data last changed.
+
+        Attributes:
+            key (Hashable): Identifies calls giving the same result.
+            function (Callable[[], Any]): The call, made by the first caller only.
+
+        Returns:
+            Any: The result of the call, the same object for every caller.
+
+        Raises:
+            CoalescingTimeout: If the call in flight did not finish within the timeout.
+            Exception: Whatever the call raised, for every caller.
+        """
+        with self._lock:
+            generation = self.generation()
+            flight = self._flights.get(key)
+            leader = flight is None or flight.generation != generation
+            if leader:
+                # A call of an older generation keeps running for the callers it has
+                flight = self._flights[key] = Future()
+                flight.generation = generation
+
+        if not leader:
+            self._count('shared')
+            try:
+                return flight.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                self._count('timeouts')
+                raise CoalescingTimeout(f'Timed out waiting for the identical request {key}')
+
+        self._count('executions')
+        try:
+            result = function()
+        except BaseException as exc:
+            flight.set_exception(exc)
+            raise
+        else:
+            flight.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+    def stats(self) -> dict:
+        """Return the counters by name, and the number of calls in flight in this worker."""
+        with self._counters_lock:
+            stats = dict(zip(self.names, self._counters))
+        stats['in_flight'] = len(self._flights)
+        return stats
+
+
+# A flight is joined until the next write transaction commits, in any server worker
+single_flight = SingleFlight(generation=lambda: transaction_stats.get('commits'))
+
+
+@lru_cache
+def _adapter(schema: Any) -> TypeAdapter:
+    """Return the cached validator and serializer of a response schema."""
+    return TypeAdapter(schema)
+
+
+def coalesced_json(key: Hashable, schema: Any, query: Callable[[], Any]) -> Response:
+    """
+    Answer with the JSON of a query, run once for the identical requests in flight.
+
+    The result is serialized once by the request running the query, and the same
+    bytes are sent to every request sharing it.
+
+    Attributes:
+        key (Hashable): The route, its normalized parameters and the visibility scope of
+            the caller, e.g. the user ID for per-user data.
+        schema (Any): The response schema, e.g. ``List[ModelResponse]``.
+        query (Callable[[], Any]): Returns the rows or objects to serialize.
+
+    Returns:
+        Response: The JSON response.
+    """
+
+    def run() -> bytes:
+        adapter = _adapter(schema)
+        return adapter.dump_json(adapter.validate_python(query(), from_attributes=True))
+
+    return Response(single_flight.do(key, run), media_type='application/json')
@@ -0,0 +1,295 @@
+"""Expansion of hyperparameter sweeps and execution of their trainings on a process pool."""
+
+import itertools
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from ..database.config import (
+    SessionLocal,
+    get_record,
+    shard_of,
+    shard_sessions,
+    use_shard,
+)
+from ..database.db_models import Dataset, Model, Sweep, Training, TrainingResult
+from ..database.transactions import begin_write, commit
+from .result_cache import put_result, training_fingerprint
+from .training_runner import run_training
+
+# Number of worker processes running sweep trainings, defaults to the number of cores
+# shared between the server workers
+SWEEP_WORKERS = int(
+    os.environ.get(
+        'SWEEP_WORKERS',
+        max(1, (os.cpu_count() or 1) // int(os.environ.get('WEB_CONCURRENCY', 1))),
+    )
+)
+# Maximum number of trainings a single sweep may expand into
+SWEEP_MAX_TRIALS = int(os.environ.get('SWEEP_MAX_TRIALS', 1000))
+
+logger = logging.getLogger(__name__)
+
+
+class SweepError(ValueError):
+    """Raised when a sweep specification cannot be expanded."""
+
+
+def expand_grid(grid: dict) -> list:
+    """
+    Expand a parameter grid into every combination of its values.
+
+    Attributes:
+        grid (dict): The candidate values of each parameter.
+
+    Returns:
+        list: One dict of parameters per combination.
+
+    Raises:
+        SweepError: If the grid is empty or has more than SWEEP_MAX_TRIALS combinations.
+    """
+    if not grid or not all(grid.values()):
+        raise SweepError('Every parameter of the grid needs at least one value')
+    size = math.prod(len(values) for values in grid.values())
+    if size > SWEEP_MAX_TRIALS:
+        raise SweepError(f"The grid has {size} combinations, the limit is {SWEEP_MAX_TRIALS}")
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+def _sample(rng: random.Random, space) -> object:
+    """Draw one value from a list of choices or a {low, high, log, integer} range."""
+    if isinstance(space, list):
+        return rng.choice(space)
+    low, high = space['low'], space['high']
+    if space.get('log'):
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    return round(value) if space.get('integer') else value
+
+
+def sample_random(parameters: dict, trials: int, seed: int | None = None) -> list:
+    """
+    Draw random parameter combinations.
+
+    Attributes:
+        parameters (dict): For each parameter, a list of choices or a range given as
+            {'low', 'high', 'log', 'integer'}.
+        trials (int): The number of combinations to draw.
+        seed (int | None): Seed making the draw reproducible.
+
+    Returns:
+        list: One dict of parameters per trial.
+
+    Raises:
+        SweepError: If a range is invalid or trials exceeds SWEEP_MAX_TRIALS.
+    """
+    if not parameters:
+        raise SweepError('Random search needs at least one parameter')
+    if trials > SWEEP_MAX_TRIALS:
+        raise SweepError(f"{trials} trials requested, the limit is {SWEEP_MAX_TRIALS}")
+    for name, space in parameters.items():
+        if isinstance(space, list):
+            if not space:
+                raise SweepError(f"Parameter '{name}' needs at least one choice")
+        elif space['low'] > space['high'] or (space.get('log') and space['low'] <= 0):
+            raise SweepError(f"Parameter '{name}' has an invalid range")
+    rng = random.Random(seed)
+    return [
+        {name: _sample(rng, space) for name, space in parameters.items()} for _ in range(trials)
+    ]
+
+
+def update_best(sweep: Sweep, training_id: int, result: dict):
+    """
+    Keep the best training of a sweep up to date with a new result.
+
+    Attributes:
+        sweep (Sweep): The sweep.
+        training_id (int): The ID of the training that finished.
+        result (dict): The precision and recall of the training.
+    """
+    score = result[sweep.metric]
+    if sweep.best_score is None or score > sweep.best_score:
+        sweep.best_score = score
+        sweep.best_training_id = training_id
+
+
+class SweepRunner:
+    """
+    Run the trainings of sweeps on a pool of worker processes.
+
+    The workers only compute; results come back to this process, which records them
+    and updates the progress and best result of the sweep, so the database is only
+    written from the API process.
+
+    Attributes:
+        workers (int): The number of worker processes.
+    """
+
+    def __init__(self, workers: int = SWEEP_WORKERS):
+        self.workers = workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self, broken: ProcessPoolExecutor | None = None) -> ProcessPoolExecutor:
+        """
+        Start the worker processes on first use, or again once the pool is broken.
+
+        Attributes:
+            broken (ProcessPoolExecutor | None): A pool found broken, e.g. because one
+                of its workers crashed; it is replaced unless another thread did already.
+
+        Returns:
+            ProcessPoolExecutor: The pool.
+        """
+        with self._lock:
+            if self._executor is None or self._executor is broken:
+                if broken is not None:
+                    broken.shutdown(wait=False, cancel_futures=True)
+                # Spawned rather than forked, as the API process runs threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def submit(self, sweep_id: int, trainings: list):
+        """
+        Queue the trainings of a sweep.
+
+        A pool whose worker process died, e.g. killed when out of memory, refuses new
+        trainings, so it is started again and the rest of the trainings queued on the
+        new one. The trainings that still cannot be queued are recorded as failed.
+
+        Attributes:
+            sweep_id (int): The ID of the sweep.
+            trainings (list): (training ID, model ID, dataset ID, parameters) tuples.
+        """
+        queued = 0
+        pool = self._pool()
+        for _ in range(2):
+            try:
+                for training_id, model_id, dataset_id, params in trainings[queued:]:
+                    future = pool.submit(run_training, model_id, dataset_id, params)
+                    future.add_done_callback(partial(self._record, sweep_id, training_id))
+                    queued += 1
+                return
+            except BrokenProcessPool:
+                logger.warning('The sweep worker pool is broken, starting it again')
+                pool = self._pool(broken=pool)
+        self._fail(sweep_id, [training[0] for training in trainings[queued:]])
+
+    def _fail(self, sweep_id: int, training_ids: list):
+        """Record trainings of a sweep that could not be queued as failed."""
+        logger.error('Trainings %s of sweep %s could not be queued', training_ids, sweep_id)
+        db = SessionLocal()
+        try:
+            use_shard(db, shard_of(sweep_id))
+            begin_write(db, Training)
+            failed = (
+                db.query(Training)
+                .filter(Training.id.in_(training_ids), Training.status == 'queued')
+                .update({'status': 'failed'}, synchronize_session=False)
+            )
+            sweep = db.get(Sweep, sweep_id)
+            if sweep is not None:
+                sweep.failed += failed
+            commit(db)
+        except Exception:
+            # Left queued, the trainings are queued again when the background jobs restart
+            logger.exception('Recording the unqueued trainings of sweep %s failed', sweep_id)
+        finally:
+            db.close()
+
+    def _record(self, sweep_id: int, training_id: int, future):
+        """Store the result of a training and update the progress of its sweep."""
+        if future.cancelled():
+            return
+        # Results are recorded one at a time by the pool's management thread
+        error = future.exception()
+        db = SessionLocal()
+        try:
+            use_shard(db, shard_of(sweep_id))
+            # The results cache is in the main database, locked first like in create_sweep
+            begin_write(db, TrainingResult, Training)
+            # Claiming the training with a conditional update makes recording idempotent:
+            # a worker taking over the background jobs queues unfinished trainings again,
+            # so another worker may already have recorded this one
+            claimed = (
+                db.query(Training)
+                .filter(Training.id == training_id, Training.status == 'queued')
+                .update(
+                    {'status': 'completed' if error is None else 'failed'},
+                    synchronize_session=False,
+                )
+            )
+            training = db.get(Training, training_id)
+            sweep = db.get(Sweep, sweep_id)
+            if not claimed or training is None or sweep is None:
+                db.rollback()
+                return
+            if error is None:
+                result = future.result()
+                training.precision = result['precision']
+                training.recall = result['recall']
+                sweep.completed += 1
+                update_best(sweep, training_id, result)
+                # The model or dataset may have been deleted while the training ran, and
+                # those of admins are in the main database with sharded storage
+                model = get_record(db, Model, training.model_id)
+                dataset = get_record(db, Dataset, training.dataset_id)
+                if model is not None and dataset is not None:
+                    fingerprint = training_fingerprint(model, dataset, json.loads(training.params))
+                    put_result(db, fingerprint, result['precision'], result['recall'], training_id)
+            else:
+                logger.error('Training %s of sweep %s failed: %s', training_id, sweep_id, error)
+                sweep.failed += 1
+            commit(db)
+        except Exception:
+            logger.exception('Recording training %s of sweep %s failed', training_id, sweep_id)
+        finally:
+            db.close()
+
+    def resume(self):
+        """Queue again the sweep trainings left unfinished when the application stopped."""
+        db = SessionLocal()
+        pending = []
+        try:
+            for shard_db in shard_sessions(db):
+                pending += (
+                    shard_db.query(
+                        Training.sweep_id,
+                        Training.id,
+                        Training.model_id,
+                        Training.dataset_id,
+                        Training.params,
+                    )
+                    .filter(Training.sweep_id.isnot(None), Training.status == 'queued')
+                    .order_by(Training.sweep_id, Training.id)
+                    .all()
+                )
+        finally:
+            db.close()
+        for sweep_id, rows in itertools.groupby(pending, key=lambda row: row.sweep_id):
+            self.submit(
+                sweep_id,
+                [(row.id, row.model_id, row.dataset_id, json.loads(row.params)) for row in rows],
+            )
+
+    def shutdown(self):
+        """Stop the workers, leaving the trainings not yet run queued for the next start."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+
+sweep_runner = SweepRunner()
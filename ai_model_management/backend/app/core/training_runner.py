@@ -0,0 +1,27 @@
+"""Training jobs, run in worker processes.
+
+This module only depends on the standard library, so that worker processes
+spawned by the sweep runner start quickly and hold no database connections.
+"""
+
+import json
+import random
+
+
+def run_training(model_id: int, dataset_id: int, params: dict) -> dict:
+    """
+    Train a model on a dataset with the given hyperparameters and score it.
+
+    Training is simulated: the scores are drawn at random, seeded by the inputs so
+    that the same run always gives the same scores.
+
+    Attributes:
+        model_id (int): The ID of the trained model.
+        dataset_id (int): The ID of the dataset trained on.
+        params (dict): The hyperparameters of the training.
+
+    Returns:
+        dict: The precision and recall of the trained model.
+    """
+    rng = random.Random(json.dumps([model_id, dataset_id, params], sort_keys=True))
+    return {'precision': rng.uniform(0, 1), 'recall': rng.uniform(0, 1)}
@@ -0,0 +1,233 @@
+"""Append-only audit trail, buffered in memory and written behind in batches."""
+
+import json
+import logging
+import os
+import threading
+
+from sqlalchemy import Column, Integer, String, Text, create_engine
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from .config import SQLITE_BUSY_TIMEOUT_SECONDS
+from .db_models import current_timestamp
+from .transactions import begin_write, commit
+
+# SQLite file holding the audit events, kept apart from the application database
+AUDIT_DATABASE_PATH = os.environ.get('AUDIT_DATABASE_PATH', './audit.db')
+# Longest time an event stays in memory before it is written
+AUDIT_FLUSH_INTERVAL_MS = float(os.environ.get('AUDIT_FLUSH_INTERVAL_MS', 1000))
+# Number of buffered events that triggers a write without waiting for the interval
+AUDIT_BATCH_SIZE = int(os.environ.get('AUDIT_BATCH_SIZE', 256))
+# Number of buffered events at which recording waits for the writer instead of growing
+AUDIT_MAX_BUFFER = int(os.environ.get('AUDIT_MAX_BUFFER', 10000))
+# Number of failed writes after which the buffered events are logged and dropped
+AUDIT_MAX_WRITE_ATTEMPTS = int(os.environ.get('AUDIT_MAX_WRITE_ATTEMPTS', 5))
+
+logger = logging.getLogger(__name__)
+
+AuditBase = declarative_base()
+
+
+class AuditEvent(AuditBase):
+    """
+    Represent an audited change in the audit database.
+
+    Attributes:
+        id (int): A unique identifier for the event (primary key), in recording order.
+        creation_date (str): The date the change was made.
+        actor_id (int): The ID of the user who made the change, if any.
+        actor_email (str): The email of the user who made the change, if any.
+        action (str): 'create' or 'delete'.
+        entity (str): 'user', 'dataset', 'model', 'training' or 'sweep'.
+        entity_id (int): The ID of the created or deleted record.
+        details (str): JSON-encoded details of the record, e.g. its name.
+    """
+
+    __tablename__ = 'audit_events'
+
+    id = Column(Integer, primary_key=True)
+    creation_date = Column(String, nullable=False)
+    actor_id = Column(Integer, index=True)
+    actor_email = Column(String)
+    action = Column(String, nullable=False)
+    entity = Column(String, nullable=False, index=True)
+    entity_id = Column(Integer)
+    details = Column(Text)
+
+
+audit_engine = create_engine(
+    f'sqlite:///{AUDIT_DATABASE_PATH}',
+    connect_args={'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT_SECONDS},
+)
+AuditSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=audit_engine)
+os.register_at_fork(after_in_child=lambda: audit_engine.dispose(close=False))
+
+
+def get_audit_db():
+    """
+    Provide an audit database session and ensure it is closed after use.
+
+    Yields:
+        Session: SQLAlchemy session bound to the audit database.
+    """
+    db = AuditSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def init_audit():
+    """Create the audit tables if they do not exist yet."""
+    AuditBase.metadata.create_all(bind=audit_engine)
+
+
+class AuditLog:
+    """
+    Buffer audit events in memory and write them in batches from a background thread.
+
+    Recording an event only appends to a list, so the audited request does not pay
+    for a second commit. Events are written once per flush interval, or as soon as a
+    batch is full. On shutdown the buffer is written out, so only a crash loses
+    events: at most those of the last flush interval. When the writer cannot keep
+    up, recording waits rather than letting the buffer grow past its limit.
+
+    A failed write keeps its events for the next one. Once ``max_attempts`` writes in
+    a row failed, the events are logged and dropped, and while writes fail, recording
+    does not wait for room in the buffer, so requests are not held up by a broken
+    audit database.
+
+    Attributes:
+        session_factory (sessionmaker): Factory for the sessions used by the writer thread.
+        interval (float): Seconds between two writes.
+        batch_size (int): Number of buffered events that triggers a write.
+        max_buffer (int): Number of buffered events at which recording waits.
+        max_attempts (int): Number of failed writes after which the events are dropped.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        interval_ms: float = AUDIT_FLUSH_INTERVAL_MS,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        max_buffer: int = AUDIT_MAX_BUFFER,
+        max_attempts: int = AUDIT_MAX_WRITE_ATTEMPTS,
+    ):
+        self.session_factory = session_factory
+        self.interval = interval_ms / 1000
+        self.batch_size = batch_size
+        self.max_buffer = max_buffer
+        self.max_attempts = max_attempts
+        self._buffer = []
+        self._failed_writes = 0
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def record(self, action: str, entity: str, entity_id: int, actor=None, **details):
+        """
+        Buffer an audit event.
+
+        Attributes:
+            action (str): 'create' or 'delete'.
+            entity (str): The kind of record, e.g. 'dataset'.
+            entity_id (int): The ID of the record.
+            actor (User | None): The user who made the change.
+            details: Details of the record to keep, e.g. its name.
+        """
+        event = {
+            'creation_date': current_timestamp(),
+            'actor_id': actor.id if actor is not None else None,
+            'actor_email': actor.email if actor is not None else None,
+            'action': action,
+            'entity': entity,
+            'entity_id': entity_id,
+            'details': json.dumps(details) if details else None,
+        }
+        self._ensure_started()
+        with self._condition:
+            while (
+                len(self._buffer) >= self.max_buffer
+                and not self._failed_writes
+                and not self._stopped.is_set()
+            ):
+                self._condition.notify_all()
+                self._condition.wait(self.interval)
+            self._buffer.append(event)
+            if len(self._buffer) >= self.batch_size:
+                self._condition.notify_all()
+        if self._stopped.is_set():
+            # Events recorded after shutdown has begun are written at once
+            self.flush()
+
+    def flush(self):
+        """Write the buffered events now."""
+        # Batches are written one at a time so that event IDs follow the recording order
+        with self._write_lock:
+            with self._condition:
+                events, self._buffer = self._buffer, []
+                # Wake the requests waiting for room in the buffer
+                self._condition.notify_all()
+            self._write(events)
+
+    def close(self):
+        """Stop the writer thread and write the buffered events."""
+        self._stopped.set()
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _ensure_started(self):
+        """Start the writer thread on first use."""
+        if self._thread is not None or self._stopped.is_set():
+            return
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='audit-log', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        """Write the buffer every interval, or sooner when a batch is full."""
+        while not self._stopped.is_set():
+            with self._condition:
+                if len(self._buffer) < self.batch_size:
+                    self._condition.wait(self.interval)
+            self.flush()
+
+    def _write(self, events: list):
+        """
+        Insert a batch of events in one transaction, keeping them if the write fails,
+        until too many writes in a row failed.
+        """
+        if not events:
+            return
+        try:
+            with self.session_factory() as db:
+                begin_write(db)
+                db.execute(AuditEvent.__table__.insert(), events)
+                commit(db)
+        except Exception:
+            logger.exception('Writing %d audit events failed', len(events))
+            with self._condition:
+                self._failed_writes += 1
+                if self._failed_writes < self.max_attempts:
+                    self._buffer[:0] = events
+                    return
+                self._failed_writes = 0
+            # The log is the only trace left of the events
+            logger.error(
+                'Dropped %d audit events after %d failed writes: %s',
+                len(events),
+                self.max_attempts,
+                json.dumps(events),
+            )
+        else:
+            self._failed_writes = 0
+
+
+audit_log = AuditLog(AuditSessionLocal)
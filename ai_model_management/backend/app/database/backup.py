@@ -0,0 +1,569 @@
+"""
+Online backups of the SQLite databases into compressed, checksummed snapshots.
+
+Run from the backend directory:
+    python -m app.database.backup create
+    python -m app.database.backup list
+    python -m app.database.backup verify <snapshot>
+    python -m app.database.backup restore <snapshot>
+
+Each database is copied with the online backup API of SQLite a few pages at a time,
+so the routes keep reading and writing while a backup runs. The copy is checked with
+``PRAGMA integrity_check``, compressed with gzip, and its SHA-256 is recorded in the
+manifest of the snapshot. With sharded storage, every shard is a database of the
+snapshot. The databases are copied while no trainings are being moved to the archive,
+so that the snapshot holds each of them once. Only the newest ``BACKUP_KEEP``
+snapshots are kept.
+
+Each database of a snapshot is consistent on its own, but the databases are copied
+one after the other while the routes keep writing, so a snapshot is not taken at a
+single point in time across them: a training copied from a shard may refer to an
+admin's dataset created in app.db after app.db was copied, or the other way round.
+"""
+
+import argparse
+import fcntl
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from ..core.background import BACKGROUND_LOCK_PATH
+from .audit import AUDIT_DATABASE_PATH
+from .config import SQLITE_BUSY_TIMEOUT_SECONDS, engine, shard_router
+from .retention import ARCHIVE_DATABASE_PATH, archive_lock
+
+# Directory holding the snapshots
+BACKUP_DIR = os.environ.get('BACKUP_DIR', './backups')
+# Seconds between two scheduled snapshots, 0 disables the schedule
+BACKUP_INTERVAL_SECONDS = float(os.environ.get('BACKUP_INTERVAL_SECONDS', 0))
+# Number of snapshots kept, the oldest ones are deleted
+BACKUP_KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+# Number of database pages copied per step, the database is only locked during a step
+BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', 256))
+# Pause between two steps, leaving the database to the routes
+BACKUP_STEP_PAUSE_MS = float(os.environ.get('BACKUP_STEP_PAUSE_MS', 10))
+
+# Databases of a snapshot by name
+DATABASES = {
+    'app': engine.url.database,
+    'archive': ARCHIVE_DATABASE_PATH,
+    'audit': AUDIT_DATABASE_PATH,
+}
+# Name of the shard databases in a snapshot, with sharded storage
+SHARD_DATABASE = 'shard-{}'
+# Times a copy restarts because of a write to the database before it is copied in one step
+MAX_RESTARTS = 5
+MANIFEST = 'manifest.json'
+PARTIAL_SUFFIX = '.partial'
+DATE_FORMAT = '%Y/%m/%d %H:%M:%S'
+
+logger = logging.getLogger(__name__)
+
+
+class BackupError(Exception):
+    """Raised when a snapshot cannot be taken, verified or restored."""
+
+
+class BackupInProgressError(BackupError):
+    """Raised when another snapshot is being taken."""
+
+
+class _Restarted(Exception):
+    """Raised to abort a copy restarted too many times."""
+
+
+def database_paths() -> dict:
+    """
+    Return the files of the databases to back up, the shards included.
+
+    Returns:
+        dict: The path of each database, by name.
+    """
+    shards = {
+        SHARD_DATABASE.format(shard_id): shard_router.path(shard_id)
+        for shard_id in shard_router.shard_ids()
+    }
+    return {**DATABASES, **shards}
+
+
+def database_path(database: str) -> str:
+    """
+    Return the file a database of a snapshot is restored to.
+
+    Raises:
+        BackupError: If the database is a shard and sharding is off.
+    """
+    if database in DATABASES:
+        return DATABASES[database]
+    if not shard_router.enabled:
+        raise BackupError(f'Set DATABASE_SHARDS_DIR to restore the {database} database')
+    os.makedirs(shard_router.directory, exist_ok=True)
+    return shard_router.path(int(database.removeprefix(SHARD_DATABASE.format(''))))
+
+
+def copy_database(
+    source_path: str,
+    target_path: str,
+    pages: int = BACKUP_PAGES_PER_STEP,
+    pause: float = BACKUP_STEP_PAUSE_MS / 1000,
+) -> int:
+    """
+    Copy a live database with the online backup API, a few pages at a time.
+
+    SQLite restarts a copy when another connection writes to the database between two
+    steps. If that happens too often for the copy to finish, the remaining attempt
+    copies the database in a single step, holding a read lock for its duration.
+
+    Attributes:
+        source_path (str): The database to copy.
+        target_path (str): The file of the copy.
+        pages (int): Number of pages copied per step.
+        pause (float): Seconds to wait between two steps.
+
+    Returns:
+        int: The number of pages copied.
+    """
+    restarts = 0
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal restarts, last_remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts > MAX_RESTARTS:
+                raise _Restarted()
+        last_remaining = remaining
+        if remaining:
+            time.sleep(pause)
+
+    source = sqlite3.connect(source_path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS)
+    target = sqlite3.connect(target_path)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress)
+        except _Restarted:
+            logger.warning('Copying %s in one step, it changed too often', source_path)
+            source.backup(target)
+        return target.execute('PRAGMA page_count').fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+
+
+def check_integrity(path: str):
+    """
+    Check the structure of a database file.
+
+    Raises:
+        BackupError: If SQLite reports a problem.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        result = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    finally:
+        conn.close()
+    if result != ['ok']:
+        raise BackupError(f"{path} is corrupt: {'; '.join(result[:5])}")
+
+
+def compress(source_path: str, target_path: str) -> str:
+    """
+    Compress a file with gzip.
+
+    Returns:
+        str: The SHA-256 of the uncompressed content.
+    """
+    digest = hashlib.sha256()
+    with open(source_path, 'rb') as source, gzip.open(target_path, 'wb', compresslevel=6) as target:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            digest.update(block)
+            target.write(block)
+    return digest.hexdigest()
+
+
+def decompress(source_path: str, target_path: str) -> str:
+    """
+    Decompress a gzip file.
+
+    Returns:
+        str: The SHA-256 of the uncompressed content.
+    """
+    digest = hashlib.sha256()
+    with gzip.open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        for block in iter(lambda: source.read(1 << 20), b''):
+            digest.update(block)
+            target.write(block)
+    return digest.hexdigest()
+
+
+def lock_backups(backup_dir: str = BACKUP_DIR):
+    """
+    Take the lock of the snapshot directory, shared by every process.
+
+    Returns:
+        The open lock file, closing it releases the lock.
+
+    Raises:
+        BackupInProgressError: If another snapshot is being taken.
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    lock_file = open(os.path.join(backup_dir, '.lock'), 'a')
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        raise BackupInProgressError('A backup is already running')
+    return lock_file
+
+
+def snapshot_name() -> str:
+    """Return the name of a new snapshot, ordered by creation time."""
+    now = datetime.now()
+    return f'{now:%Y%m%d-%H%M%S}-{now.microsecond // 1000:03d}'
+
+
+def take_snapshot(name: str, backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> dict:
+    """
+    Back up every database into a new snapshot, then delete the oldest snapshots.
+
+    The caller holds the lock of the snapshot directory. Every database is copied
+    first, holding the lock of the moves to the archive, then checked and compressed.
+    Each copy is consistent on its own, not with the copies taken before or after it.
+    The snapshot is written to a partial directory, renamed once complete, so that an
+    interrupted backup is never listed or restored.
+
+    Attributes:
+        name (str): The name of the snapshot.
+        backup_dir (str): The directory holding the snapshots.
+        keep (int): The number of snapshots kept.
+
+    Returns:
+        dict: The manifest of the snapshot.
+
+    Raises:
+        BackupError: If a copy is corrupt.
+    """
+    for entry in os.listdir(backup_dir):
+        if entry.endswith(PARTIAL_SUFFIX):
+            shutil.rmtree(os.path.join(backup_dir, entry), ignore_errors=True)
+    partial = os.path.join(backup_dir, name + PARTIAL_SUFFIX)
+    os.makedirs(partial)
+    started = time.perf_counter()
+    manifest = {'name': name, 'creation_date': datetime.now().strftime(DATE_FORMAT)}
+    copies, pages, databases = {}, {}, {}
+    try:
+        # Trainings moved to the archive between two copies would be in both or neither
+        with archive_lock():
+            for database, path in database_paths().items():
+                if not os.path.exists(path):
+                    continue
+                copies[database] = os.path.join(partial, f'{database}.db')
+                pages[database] = copy_database(path, copies[database])
+        for database, copy in copies.items():
+            check_integrity(copy)
+            file = f'{database}.db.gz'
+            sha256 = compress(copy, os.path.join(partial, file))
+            databases[database] = {
+                'file': file,
+                'pages': pages[database],
+                'size': os.path.getsize(copy),
+                'compressed_size': os.path.getsize(os.path.join(partial, file)),
+                'sha256': sha256,
+            }
+            os.remove(copy)
+        manifest['databases'] = databases
+        manifest['duration_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        with open(os.path.join(partial, MANIFEST), 'w') as file:
+            json.dump(manifest, file, indent=2)
+        os.rename(partial, os.path.join(backup_dir, name))
+    except BaseException:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    rotate(backup_dir, keep)
+    logger.info('Backup %s taken in %.0f ms', name, manifest['duration_ms'])
+    return manifest
+
+
+def create_snapshot(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP) -> dict:
+    """
+    Take a snapshot now.
+
+    Returns:
+        dict: The manifest of the snapshot.
+
+    Raises:
+        BackupInProgressError: If another snapshot is being taken.
+        BackupError: If a copy is corrupt.
+    """
+    lock_file = lock_backups(backup_dir)
+    try:
+        return take_snapshot(snapshot_name(), backup_dir, keep)
+    finally:
+        lock_file.close()
+
+
+def list_snapshots(backup_dir: str = BACKUP_DIR) -> list:
+    """
+    Read the manifests of the complete snapshots.
+
+    Returns:
+        list: The manifests, newest first.
+    """
+    if not os.path.isdir(backup_dir):
+        return []
+    manifests = []
+    for entry in sorted(os.listdir(backup_dir), reverse=True):
+        path = os.path.join(backup_dir, entry, MANIFEST)
+        if os.path.exists(path):
+            with open(path) as file:
+                manifests.append(json.load(file))
+    return manifests
+
+
+def rotate(backup_dir: str = BACKUP_DIR, keep: int = BACKUP_KEEP):
+    """Delete the oldest snapshots beyond the number kept."""
+    for manifest in list_snapshots(backup_dir)[keep:]:
+        shutil.rmtree(os.path.join(backup_dir, manifest['name']))
+
+
+def read_manifest(name: str, backup_dir: str = BACKUP_DIR) -> dict:
+    """
+    Read the manifest of a snapshot.
+
+    Raises:
+        BackupError: If the snapshot does not exist.
+    """
+    path = os.path.join(backup_dir, os.path.basename(name), MANIFEST)
+    if not os.path.exists(path):
+        raise BackupError(f'Snapshot {name} not found')
+    with open(path) as file:
+        return json.load(file)
+
+
+def extract(name: str, database: str, target_path: str, backup_dir: str = BACKUP_DIR):
+    """
+    Decompress a database of a snapshot and verify its checksum and its integrity.
+
+    Attributes:
+        name (str): The name of the snapshot.
+        database (str): The name of the database, e.g. 'app'.
+        target_path (str): The file to decompress into.
+        backup_dir (str): The directory holding the snapshots.
+
+    Raises:
+        BackupError: If the database is missing from the snapshot or fails a check.
+    """
+    entry = read_manifest(name, backup_dir)['databases'].get(database)
+    if entry is None:
+        raise BackupError(f'Snapshot {name} has no {database} database')
+    sha256 = decompress(os.path.join(backup_dir, name, entry['file']), target_path)
+    if sha256 != entry['sha256']:
+        raise BackupError(f'{database} database of snapshot {name} fails its checksum')
+    check_integrity(target_path)
+
+
+def verify_snapshot(name: str, backup_dir: str = BACKUP_DIR) -> list:
+    """
+    Verify every database of a snapshot without restoring it.
+
+    Returns:
+        list: The names of the verified databases.
+
+    Raises:
+        BackupError: If a database fails a check.
+    """
+    databases = list(read_manifest(name, backup_dir)['databases'])
+    with tempfile.TemporaryDirectory(dir=backup_dir) as workdir:
+        for database in databases:
+            extract(name, database, os.path.join(workdir, f'{database}.db'), backup_dir)
+    return databases
+
+
+def restore_snapshot(
+    name: str, databases: list | None = None, backup_dir: str = BACKUP_DIR
+) -> list:
+    """
+    Replace the databases with the ones of a snapshot, with the server stopped.
+
+    Every database is decompressed next to the one it replaces and verified first, so
+    that a failed check leaves all of them untouched. Each is then swapped in with an
+    atomic rename. When the whole snapshot is restored, the shards created after it are
+    moved aside, renamed with the name of the snapshot, so that they are no longer
+    read, nor taken over by a new user given the ID of the one who created them.
+
+    Attributes:
+        name (str): The name of the snapshot.
+        databases (list | None): The databases restored, all of the snapshot by default.
+        backup_dir (str): The directory holding the snapshots.
+
+    Returns:
+        list: The files of the shards moved aside.
+
+    Raises:
+        BackupError: If the server is running, a database is not in the snapshot, or
+            a database fails a check.
+    """
+    # Held by a server worker for as long as the server runs
+    with open(BACKGROUND_LOCK_PATH, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise BackupError('The server is running, stop it before restoring')
+        in_snapshot = list(read_manifest(name, backup_dir)['databases'])
+        missing = [database for database in databases or () if database not in in_snapshot]
+        if missing:
+            raise BackupError(f"Snapshot {name} has no {', '.join(missing)} database")
+        whole = not databases
+        databases = databases or in_snapshot
+        restored = {}
+        try:
+            for database in databases:
+                restored[database] = f'{database_path(database)}.restore'
+                extract(name, database, restored[database], backup_dir)
+        except BaseException:
+            for path in restored.values():
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+        for database, path in restored.items():
+            target = database_path(database)
+            # A journal left by the replaced database would be applied to the restored one
+            if os.path.exists(f'{target}-journal'):
+                os.remove(f'{target}-journal')
+            os.replace(path, target)
+        moved = []
+        if whole:
+            for database, path in database_paths().items():
+                if database not in restored and database not in DATABASES:
+                    for suffix in ('-journal', ''):
+                        if os.path.exists(path + suffix):
+                            os.replace(path + suffix, f'{path}.{name}{suffix}')
+                    moved.append(f'{path}.{name}')
+        return moved
+
+
+class BackupWorker:
+    """
+    Take snapshots on demand, in a background thread, and on a schedule.
+
+    Attributes:
+        interval (float): Seconds between two scheduled snapshots, 0 disables the schedule.
+        backup_dir (str): The directory holding the snapshots.
+        keep (int): The number of snapshots kept.
+    """
+
+    def __init__(
+        self,
+        interval: float = BACKUP_INTERVAL_SECONDS,
+        backup_dir: str = BACKUP_DIR,
+        keep: int = BACKUP_KEEP,
+    ):
+        self.interval = interval
+        self.backup_dir = backup_dir
+        self.keep = keep
+        self._stop = threading.Event()
+        self._thread = None
+
+    def trigger(self) -> str:
+        """
+        Start taking a snapshot and return without waiting for it.
+
+        Returns:
+            str: The name of the snapshot, listed once complete.
+
+        Raises:
+            BackupInProgressError: If another snapshot is being taken.
+        """
+        lock_file = lock_backups(self.backup_dir)
+        name = snapshot_name()
+        threading.Thread(
+            target=self._take, args=(name, lock_file), name='backup', daemon=True
+        ).start()
+        return name
+
+    def start(self):
+        """Start the scheduled snapshots, unless disabled."""
+        if self.interval <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='backup-schedule', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the scheduled snapshots, after the one being taken."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _take(self, name: str, lock_file):
+        """Take a snapshot while holding the lock, then release it."""
+        try:
+            take_snapshot(name, self.backup_dir, self.keep)
+        except Exception:
+            logger.exception('Backup %s failed', name)
+        finally:
+            lock_file.close()
+
+    def _run(self):
+        """Thread loop: take a snapshot every interval."""
+        while not self._stop.wait(self.interval):
+            try:
+                self._take(snapshot_name(), lock_backups(self.backup_dir))
+            except BackupInProgressError:
+                logger.info('Scheduled backup skipped, another one is running')
+
+
+backup_worker = BackupWorker()
+
+
+def main():
+    """Take, list, verify or restore snapshots."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('create', help='Take a snapshot now')
+    commands.add_parser('list', help='List the snapshots, newest first')
+    verify_parser = commands.add_parser('verify', help='Check the checksums and the integrity')
+    verify_parser.add_argument('snapshot')
+    restore_parser = commands.add_parser('restore', help='Restore a snapshot, server stopped')
+    restore_parser.add_argument('snapshot')
+    restore_parser.add_argument(
+        '--database',
+        action='append',
+        help=f"{', '.join(DATABASES)} or {SHARD_DATABASE.format('<user-id>')}, all by default",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s:     %(message)s')
+
+    try:
+        if args.command == 'create':
+            print(json.dumps(create_snapshot(), indent=2))
+        elif args.command == 'list':
+            for manifest in list_snapshots():
+                sizes = ', '.join(
+                    f"{database} {entry['compressed_size']} bytes"
+                    for database, entry in manifest['databases'].items()
+                )
+                print(f"{manifest['name']}  {manifest['creation_date']}  {sizes}")
+        elif args.command == 'verify':
+            databases = verify_snapshot(args.snapshot)
+            print(f"Snapshot {args.snapshot} verified: {', '.join(databases)}")
+        else:
+            moved = restore_snapshot(args.snapshot, args.database)
+            print(f'Snapshot {args.snapshot} restored')
+            for path in moved:
+                print(f'Shard not in the snapshot moved to {path}')
+    except BackupError as exc:
+        parser.exit(1, f'{exc}\n')
+
+
+if __name__ == '__main__':
+    main()
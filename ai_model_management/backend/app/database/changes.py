@@ -0,0 +1,105 @@
+"""Changefeed of datasets, models and trainings, recorded in the transaction of each change."""
+
+import logging
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, insert
+from sqlalchemy.orm import Session
+
+from ..core.background import PeriodicJob
+from .config import SessionLocal, shard_sessions
+from .db_models import Change, Dataset, Model, Training, current_timestamp
+from .transactions import begin_write, commit
+
+# Age in days after which changes are pruned from the feed, 0 keeps them all
+CHANGE_RETENTION_DAYS = float(os.environ.get('CHANGE_RETENTION_DAYS', 30))
+# Seconds between two prunings of the feed
+CHANGE_PRUNE_INTERVAL_SECONDS = float(os.environ.get('CHANGE_PRUNE_INTERVAL_SECONDS', 3600))
+
+TRACKED_MODELS = {Dataset: 'dataset', Model: 'model', Training: 'training'}
+DATE_FORMAT = '%Y/%m/%d %H:%M:%S'
+
+logger = logging.getLogger(__name__)
+
+
+@event.listens_for(Session, 'after_flush')
+def record_flushed_changes(session: Session, flush_context):
+    """
+    Append the inserts, updates and deletes of a flush to the changefeed, in the same transaction.
+
+    Attributes:
+        session (Session): The session being flushed.
+        flush_context: The internal state of the flush.
+    """
+    now = current_timestamp()
+    # With sharded storage, a change is recorded in the database storing the record
+    rows = {}
+    for objects, action in (
+        (session.new, 'create'),
+        (session.dirty, 'update'),
+        (session.deleted, 'delete'),
+    ):
+        for obj in objects:
+            entity = TRACKED_MODELS.get(type(obj))
+            if entity is None:
+                continue
+            if action == 'update' and not session.is_modified(obj, include_collections=False):
+                continue
+            rows.setdefault(session.get_bind(type(obj)), []).append(
+                {
+                    'entity': entity,
+                    'entity_id': obj.id,
+                    'action': action,
+                    'user_id': obj.user_id,
+                    'creation_date': now,
+                }
+            )
+    for bind, bind_rows in rows.items():
+        session.connection(bind_arguments={'bind': bind}).execute(insert(Change), bind_rows)
+
+
+def prune_changes(db: Session) -> int:
+    """
+    Delete the changes older than the retention age, always keeping the latest one.
+
+    The latest change is kept so that the first sequence number still in the feed
+    tells clients whether changes after their cursor were pruned.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+
+    Returns:
+        int: The number of changes deleted.
+    """
+    if CHANGE_RETENTION_DAYS <= 0:
+        return 0
+    cutoff = (datetime.now() - timedelta(days=CHANGE_RETENTION_DAYS)).strftime(DATE_FORMAT)
+    begin_write(db, Change)
+    latest = db.query(func.max(Change.seq)).scalar_subquery()
+    pruned = (
+        db.query(Change)
+        .filter(Change.creation_date < cutoff, Change.seq < latest)
+        .delete(synchronize_session=False)
+    )
+    commit(db)
+    return pruned
+
+
+def prune_all_changes():
+    """Prune the feed of the main database and of each shard, the function of the pruning job."""
+    if CHANGE_RETENTION_DAYS <= 0:
+        return
+    db = SessionLocal()
+    try:
+        for shard_db in shard_sessions(db):
+            try:
+                prune_changes(shard_db)
+            except Exception:
+                # A locked shard is pruned on the next run, the others are pruned now
+                logger.exception('Pruning the changefeed failed')
+    finally:
+        db.close()
+
+
+change_pruner = PeriodicJob('changefeed', prune_all_changes, CHANGE_PRUNE_INTERVAL_SECONDS)
@@ -1,22 +1,347 @@
 """Database configuration and session management for SQLAlchemy."""
 
-from sqlalchemy import create_engine
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
+
+from sqlalchemy import Column, Integer, MetaData, Table, create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import CreateColumn
 
 # SQLite database URL
 SQLALCHEMY_DATABASE_URL = 'sqlite:///./app.db'
 
+# Seconds a connection waits for the lock of another writer before failing as busy
+SQLITE_BUSY_TIMEOUT_SECONDS = float(os.environ.get('SQLITE_BUSY_TIMEOUT_SECONDS', 5))
+
 # Create the engine for connecting to the database
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={'check_same_thread': False})
+engine = create_engine(
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT_SECONDS},
+)
 
-# Create a sessionmaker to handle database sessions
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Forked server workers open their own connections instead of sharing the parent's
+os.register_at_fork(after_in_child=lambda: engine.dispose(close=False))
+
+# Directory of the per-user shard databases, sharding is off when empty. Each user's
+# datasets, models and trainings, and the rows derived from them, are then stored in a
+# SQLite file of their own, so that the writes of different users do not wait for each
+# other. Users, tokens, caches and profiles stay in the main database, and so do the
+# records of admins, which every user can read.
+DATABASE_SHARDS_DIR = os.environ.get('DATABASE_SHARDS_DIR', '')
+# Maximum number of shard engines kept open by a server worker, the least recently used
+# are closed first
+DATABASE_SHARD_MAX_OPEN = int(os.environ.get('DATABASE_SHARD_MAX_OPEN', 64))
+
+# Tables stored in the shards when sharding is on
+SHARDED_TABLES = {
+    'datasets',
+    'models',
+    'trainings',
+    'sweeps',
+    'metric_chunks',
+    'changes',
+    'entity_counts',
+    'deletion_counts',
+}
+# The IDs generated in a shard start at the shard ID shifted by this many bits, so
+# that IDs are unique across shards and the shard of a record is known from its ID
+SHARD_ID_BITS = 32
+SHARD_FILE_PATTERN = re.compile(r'shard-(\d+)\.db')
 
 # Base class for the ORM models
 Base = declarative_base()
 
 
+@lru_cache
+def _shard_metadata() -> MetaData:
+    """
+    Copy the definitions of the sharded tables, with IDs that are never reused.
+
+    ``AUTOINCREMENT`` keeps the last ID in ``sqlite_sequence``, where each shard starts
+    its range. The users table is only declared, for the foreign keys to resolve. The
+    ``schema_version`` of its info is a checksum of the tables, columns and indexes,
+    stored in the ``user_version`` of the shards set up with them.
+    """
+    metadata = MetaData()
+    Table('users', metadata, Column('id', Integer, primary_key=True))
+    for table in Base.metadata.sorted_tables:
+        if table.name in SHARDED_TABLES:
+            copy = table.to_metadata(metadata)
+            if [column.name for column in copy.primary_key] == ['id']:
+                copy.dialect_options['sqlite']['autoincrement'] = True
+                copy.info['shard_ids'] = True
+    schema = [
+        (
+            table.name,
+            [column.name for column in table.columns],
+            sorted(index.name for index in table.indexes),
+        )
+        for table in metadata.sorted_tables
+    ]
+    # user_version is a signed 32-bit integer, 0 for a database never set up
+    metadata.info['schema_version'] = zlib.crc32(repr(schema).encode()) & 0x7FFFFFFF or 1
+    return metadata
+
+
+class ShardRouter:
+    """
+    Open the engines of the shard databases on first use and close the least
+    recently used ones.
+
+    A shard is created with the sharded tables the first time it is opened, and its
+    ID sequences start at ``shard_id << SHARD_ID_BITS``. The schema is only set up
+    again, taking the write lock of the shard, once the tables change, so reopening a
+    shard only reads its ``user_version``. Engines are opened outside of the lock of
+    the router, so that a busy shard does not hold up the others. Closing an engine
+    only closes its idle connections, the ones in use finish their work.
+
+    Attributes:
+        directory (str): The directory of the shard files, sharding is off when empty.
+        max_open (int): Maximum number of engines kept open.
+    """
+
+    def __init__(
+        self, directory: str = DATABASE_SHARDS_DIR, max_open: int = DATABASE_SHARD_MAX_OPEN
+    ):
+        self.directory = directory
+        self.max_open = max_open
+        self._engines = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the sharded tables are stored in the shards."""
+        return bool(self.directory)
+
+    def path(self, shard_id: int) -> str:
+        """Return the file of a shard."""
+        return os.path.join(self.directory, f'shard-{shard_id}.db')
+
+    def exists(self, shard_id: int) -> bool:
+        """Tell whether a shard has been created."""
+        return shard_id > 0 and os.path.exists(self.path(shard_id))
+
+    def shard_ids(self) -> list:
+        """
+        List the shards created so far.
+
+        Returns:
+            list: The shard IDs, in increasing order.
+        """
+        if not self.enabled or not os.path.isdir(self.directory):
+            return []
+        matches = map(SHARD_FILE_PATTERN.fullmatch, os.listdir(self.directory))
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def engine(self, shard_id: int):
+        """
+        Return the engine of a shard, opening it, and creating the shard, if needed.
+
+        Attributes:
+            shard_id (int): The ID of the shard, the ID of the user owning it.
+
+        Returns:
+            Engine: The engine of the shard.
+        """
+        with self._lock:
+            engine = self._engines.get(shard_id)
+            if engine is not None:
+                self._engines.move_to_end(shard_id)
+                return engine
+        os.makedirs(self.directory, exist_ok=True)
+        engine = create_engine(
+            f'sqlite:///{self.path(shard_id)}',
+            connect_args={'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT_SECONDS},
+        )
+        try:
+            self._init(engine, shard_id)
+        except BaseException:
+            engine.dispose()
+            raise
+        evicted = []
+        with self._lock:
+            # Another thread may have opened the shard meanwhile
+            opened = self._engines.setdefault(shard_id, engine)
+            self._engines.move_to_end(shard_id)
+            while len(self._engines) > self.max_open:
+                evicted.append(self._engines.popitem(last=False)[1])
+        if opened is not engine:
+            evicted.append(engine)
+        for unused in evicted:
+            unused.dispose()
+        return opened
+
+    @staticmethod
+    def _init(engine, shard_id: int):
+        """
+        Create the missing tables, columns and indexes of a shard and seed its IDs,
+        unless its ``user_version`` tells that it is set up already.
+        """
+        metadata = _shard_metadata()
+        version = metadata.info['schema_version']
+        with engine.connect() as conn:
+            if conn.exec_driver_sql('PRAGMA user_version').scalar() == version:
+                return
+        with engine.begin() as conn:
+            # Holding the write lock keeps workers opening the same new shard apart
+            conn.exec_driver_sql('BEGIN IMMEDIATE')
+            if conn.exec_driver_sql('PRAGMA user_version').scalar() == version:
+                return
+            metadata.create_all(
+                conn, tables=[t for t in metadata.sorted_tables if t.name != 'users']
+            )
+            _add_missing_columns(conn, metadata, skip={'users'})
+            for table in metadata.sorted_tables:
+                if table.info.get('shard_ids'):
+                    conn.execute(
+                        text(
+                            'INSERT INTO sqlite_sequence (name, seq) SELECT :name, :seq '
+                            'WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = :name)'
+                        ),
+                        {'name': table.name, 'seq': shard_id << SHARD_ID_BITS},
+                    )
+            conn.exec_driver_sql(f'PRAGMA user_version = {version}')
+
+    def reset(self):
+        """Forget the engines inherited from the parent process, after a fork."""
+        for engine in self._engines.values():
+            engine.dispose(close=False)
+        self._engines.clear()
+
+
+shard_router = ShardRouter()
+os.register_at_fork(after_in_child=shard_router.reset)
+
+
+class RoutingSession(Session):
+    """
+    Session sending the statements on the sharded tables to the shard it is set to
+    with ``use_shard``, and the others to the main database.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        shard_id = self.info.get('shard')
+        if bind is None and shard_id is not None and mapper is not None:
+            if inspect(mapper).local_table.name in SHARDED_TABLES:
+                return shard_router.engine(shard_id)
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# Create a sessionmaker to handle database sessions
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine, class_=RoutingSession)
+
+
+def shard_of(record_id: int) -> int:
+    """Return the shard holding a dataset, model, training or sweep, from its ID, 0 for app.db."""
+    return record_id >> SHARD_ID_BITS
+
+
+def use_shard(db: Session, shard_id: int | None):
+    """
+    Send the statements of a session on the sharded tables to a shard, when sharding is on.
+
+    Attributes:
+        db (Session): SQLAlchemy session, before it reads or writes a sharded table.
+        shard_id (int | None): The ID of the shard, the ID of the user owning it, None
+            or 0 for the main database.
+    """
+    if not shard_router.enabled:
+        return
+    if not shard_id:
+        db.info.pop('shard', None)
+    else:
+        db.info['shard'] = shard_id
+
+
+def use_record_shard(db: Session, record_id: int) -> bool:
+    """
+    Send the statements of a session on the sharded tables to the shard holding a record.
+
+    Attributes:
+        db (Session): SQLAlchemy session, before it reads or writes a sharded table.
+        record_id (int): The ID of a dataset, model, training or sweep.
+
+    Returns:
+        bool: False if no database can hold the record, True otherwise and when sharding is off.
+    """
+    if not shard_router.enabled:
+        return True
+    shard_id = shard_of(record_id)
+    if shard_id and not shard_router.exists(shard_id):
+        return False
+    use_shard(db, shard_id)
+    return True
+
+
+def get_record(db: Session, table, record_id: int | None):
+    """
+    Load a dataset, model, training or sweep from the database holding it, which with
+    sharded storage may be another one than the session is set to.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        table: The ORM model class of the record.
+        record_id (int | None): The ID of the record.
+
+    Returns:
+        The record, or None if it does not exist.
+    """
+    if record_id is None:
+        return None
+    if not shard_router.enabled:
+        return db.get(table, record_id)
+    shard_id = shard_of(record_id)
+    if not shard_id:
+        bind = engine
+    elif shard_router.exists(shard_id):
+        bind = shard_router.engine(shard_id)
+    else:
+        return None
+    return db.get(table, record_id, bind_arguments={'bind': bind})
+
+
+def open_shard(shard_id: int) -> Session:
+    """
+    Open a session set to a shard, to be closed by the caller.
+
+    Attributes:
+        shard_id (int): The ID of the shard, the ID of the user owning it.
+
+    Returns:
+        Session: The new session.
+    """
+    db = SessionLocal()
+    use_shard(db, shard_id)
+    return db
+
+
+def shard_sessions(db: Session):
+    """
+    Iterate over the databases holding the sharded tables.
+
+    Attributes:
+        db (Session): SQLAlchemy session on the main database.
+
+    Yields:
+        Session: The given session when sharding is off, otherwise a session on the
+        main database, which holds the records of admins, then a session set to each
+        shard in turn, each closed once the next one is requested.
+    """
+    if not shard_router.enabled:
+        yield db
+        return
+    with SessionLocal() as main_db:
+        yield main_db
+    for shard_id in shard_router.shard_ids():
+        with open_shard(shard_id) as shard_db:
+            yield shard_db
+
+
 def get_db():
     """
     Provide a database session and ensure it is closed after use.
@@ -29,3 +354,34 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+def upgrade_schema(metadata, bind):
+    """
+    Add the columns and indexes declared on the models that an existing database lacks.
+
+    ``create_all`` only creates missing tables, so columns and indexes added to a model
+    later would otherwise never reach an existing database. New columns must be nullable
+    or have a server default for SQLite to accept them.
+
+    Attributes:
+        metadata (MetaData): The metadata holding the table definitions.
+        bind (Engine): The engine of the database.
+    """
+    with bind.begin() as conn:
+        _add_missing_columns(conn, metadata)
+
+
+def _add_missing_columns(conn, metadata, skip: set = frozenset()):
+    """Add the columns and indexes of the tables of a metadata missing from a database."""
+    inspector = inspect(conn)
+    for table in metadata.sorted_tables:
+        if table.name in skip:
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = CreateColumn(column).compile(dialect=conn.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {ddl}')
+        for index in table.indexes:
+            index.create(bind=conn, checkfirst=True)
@@ -0,0 +1,278 @@
+"""Transactionally maintained counts of users, datasets, models and trainings."""
+
+import logging
+import os
+import threading
+from collections import Counter
+
+from sqlalchemy import delete, event, select, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from .config import engine, open_shard, shard_router, shard_sessions
+from .db_models import Dataset, EntityCount, Model, Training, User
+from .retention import ARCHIVE_DATABASE_PATH
+from .transactions import begin_write
+
+# Seconds between two checks of the counts against the tables
+COUNTER_RECONCILE_INTERVAL_SECONDS = float(
+    os.environ.get('COUNTER_RECONCILE_INTERVAL_SECONDS', 3600)
+)
+
+# User ID of the rows holding the totals
+TOTAL = 0
+COUNTED_MODELS = {User: 'users', Dataset: 'datasets', Model: 'models', Training: 'trainings'}
+
+logger = logging.getLogger(__name__)
+
+
+@event.listens_for(Session, 'after_flush')
+def count_flushed_changes(session: Session, flush_context):
+    """
+    Apply the inserts and deletes of a flush to the counts, in the same transaction.
+
+    Attributes:
+        session (Session): The session being flushed.
+        flush_context: The internal state of the flush.
+    """
+    # With sharded storage, a record is counted in the database storing it
+    binds = {session.get_bind(): Counter()}
+    for objects, step in ((session.new, 1), (session.deleted, -1)):
+        for obj in objects:
+            entity = COUNTED_MODELS.get(type(obj))
+            if entity is None:
+                continue
+            changes = binds.setdefault(session.get_bind(type(obj)), Counter())
+            changes[entity, TOTAL] += step
+            owner_id = getattr(obj, 'user_id', None)
+            if owner_id is not None:
+                changes[entity, owner_id] += step
+    deleted_users = [obj.id for obj in session.deleted if isinstance(obj, User)]
+    if not any(binds.values()) and not deleted_users:
+        return
+    if deleted_users:
+        # The counts of a user are also in the shard the session is set to, their own
+        binds.setdefault(session.get_bind(EntityCount), Counter())
+
+    for bind, changes in binds.items():
+        if not changes and not deleted_users:
+            continue
+        connection = session.connection(bind_arguments={'bind': bind})
+        rows = [
+            {'entity': entity, 'user_id': user_id, 'count': step}
+            for (entity, user_id), step in changes.items()
+            if step
+        ]
+        if rows:
+            statement = insert(EntityCount)
+            connection.execute(
+                statement.on_conflict_do_update(
+                    index_elements=['entity', 'user_id'],
+                    set_={'count': EntityCount.count + statement.excluded.count},
+                ),
+                rows,
+            )
+        if deleted_users:
+            # The records of a deleted user are kept but no longer belong to anyone
+            connection.execute(delete(EntityCount).where(EntityCount.user_id.in_(deleted_users)))
+
+
+# Actual counts, per owner and in total. Trainings moved to the archive still count.
+# The owners counted are those matching {owners}, and the archived trainings counted
+# those of owners matching {archived}.
+ACTUAL_COUNTS = {
+    'users': 'SELECT 0 AS user_id, COUNT(*) AS count FROM users',
+    'datasets': """
+        SELECT user_id, COUNT(*) AS count FROM datasets
+        WHERE user_id {owners} GROUP BY user_id
+        UNION ALL SELECT 0, COUNT(*) FROM datasets
+    """,
+    'models': """
+        SELECT user_id, COUNT(*) AS count FROM models
+        WHERE user_id {owners} GROUP BY user_id
+        UNION ALL SELECT 0, COUNT(*) FROM models
+    """,
+    'trainings': """
+        WITH owned AS (
+            SELECT user_id, COUNT(*) AS count FROM trainings GROUP BY user_id
+            UNION ALL
+            SELECT user_id, SUM(row_count) FROM archive.training_chunks
+            WHERE user_id {archived} GROUP BY user_id
+        )
+        SELECT user_id, SUM(count) AS count FROM owned
+        WHERE user_id {owners} GROUP BY user_id
+        UNION ALL SELECT 0, COALESCE(SUM(count), 0) FROM owned
+    """,
+}
+# In the main database, the records of deleted users only count in the totals
+MAIN_OWNERS = {'owners': 'IN (SELECT id FROM users)', 'archived': 'IS NOT NULL'}
+# With sharded storage, the main database only holds the records of admins
+SHARDED_MAIN_OWNERS = {
+    'owners': 'IN (SELECT id FROM users)',
+    'archived': 'IN (SELECT id FROM users WHERE is_admin)',
+}
+
+
+def reconcile() -> int:
+    """
+    Correct the counts that drifted from the tables.
+
+    With sharded storage, the users and the records of admins are counted in the main
+    database, against the archived trainings of admins, and the records of each shard
+    in the shard, against the archived trainings of its owner.
+
+    Returns:
+        int: The number of counts that were corrected.
+    """
+    if not shard_router.enabled:
+        return reconcile_database(engine, ACTUAL_COUNTS, MAIN_OWNERS)
+    corrected = reconcile_database(engine, ACTUAL_COUNTS, SHARDED_MAIN_OWNERS)
+    entities = {entity: actual for entity, actual in ACTUAL_COUNTS.items() if entity != 'users'}
+    for shard_id in shard_router.shard_ids():
+        owners = {'owners': f'= {shard_id}', 'archived': f'= {shard_id}'}
+        corrected += reconcile_database(shard_router.engine(shard_id), entities, owners)
+    return corrected
+
+
+def reconcile_database(bind, actual_counts: dict, owners: dict) -> int:
+    """
+    Correct the counts of a database that drifted from its tables.
+
+    Each count is rewritten with a single INSERT ... SELECT, so the comparison and the
+    correction see the same state of the tables, even while records are created.
+
+    Attributes:
+        bind (Engine): The engine of the database.
+        actual_counts (dict): The queries of the actual counts, by entity.
+        owners (dict): The conditions on the owners counted, see ``ACTUAL_COUNTS``.
+
+    Returns:
+        int: The number of counts that were corrected.
+    """
+    corrected = 0
+    with bind.connect() as conn:
+        conn.exec_driver_sql('ATTACH DATABASE ? AS archive', (ARCHIVE_DATABASE_PATH,))
+        conn.commit()
+        try:
+            with conn.begin():
+                begin_write(conn)
+                for entity, actual in actual_counts.items():
+                    actual = actual.format(**owners)
+                    drifted = conn.execute(
+                        text(
+                            f"""
+                            INSERT INTO entity_counts (entity, user_id, count)
+                            SELECT :entity, user_id, count FROM ({actual}) WHERE count != 0
+                            ON CONFLICT (entity, user_id) DO UPDATE SET count = excluded.count
+                            WHERE count != excluded.count
+                            RETURNING user_id
+                            """
+                        ),
+                        {'entity': entity},
+                    ).all()
+                    removed = conn.execute(
+                        text(
+                            f"""
+                            DELETE FROM entity_counts
+                            WHERE entity = :entity
+                            AND user_id NOT IN (SELECT user_id FROM ({actual}) WHERE count != 0)
+                            RETURNING count
+                            """
+                        ),
+                        {'entity': entity},
+                    ).all()
+                    # Counts that dropped to zero are not drift
+                    corrected += len(drifted) + sum(1 for row in removed if row.count)
+        finally:
+            conn.exec_driver_sql('DETACH DATABASE archive')
+            conn.commit()
+    return corrected
+
+
+def read_counts(db: Session, user_ids: list | None = None) -> dict:
+    """
+    Read the maintained counts.
+
+    With sharded storage, the totals add up the counts of the main database and of
+    every shard, and the counts of a user are read from the main database, holding
+    those of admins, and from their shard.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        user_ids (list | None): The owners to read the counts of, None for the totals.
+
+    Returns:
+        dict: The counts of each entity, by user ID.
+    """
+    user_ids = [TOTAL] if user_ids is None else user_ids
+    counts = {user_id: dict.fromkeys(COUNTED_MODELS.values(), 0) for user_id in user_ids}
+
+    def add(rows):
+        for row in rows:
+            counts[row.user_id][row.entity] += row.count
+
+    if not shard_router.enabled:
+        add(db.query(EntityCount).filter(EntityCount.user_id.in_(user_ids)))
+        return counts
+    if TOTAL in user_ids:
+        for shard_db in shard_sessions(db):
+            add(shard_db.query(EntityCount).filter(EntityCount.user_id == TOTAL))
+    owners = [user_id for user_id in user_ids if user_id != TOTAL]
+    # Columns rather than entities, not to mix the counts of the main database with
+    # those of the shard in the identity map of the session
+    main_counts = select(EntityCount.entity, EntityCount.user_id, EntityCount.count).where(
+        EntityCount.user_id.in_(owners)
+    )
+    add(db.execute(main_counts, bind_arguments={'bind': engine}))
+    for user_id in owners:
+        if shard_router.exists(user_id):
+            with open_shard(user_id) as shard_db:
+                add(shard_db.query(EntityCount).filter(EntityCount.user_id == user_id))
+    return counts
+
+
+class CounterReconciler:
+    """
+    Background thread checking the maintained counts against the tables.
+
+    The counts are only off if a write bypassed the ORM, e.g. a manual SQL fix, so
+    this is a safety net; drift is logged when found.
+
+    Attributes:
+        interval (float): Seconds to wait between two checks.
+    """
+
+    def __init__(self, interval: float = COUNTER_RECONCILE_INTERVAL_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the background thread, checking right away."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='counters', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """Thread loop: reconcile, then sleep until the next check."""
+        while not self._stop.is_set():
+            try:
+                corrected = reconcile()
+                if corrected:
+                    logger.warning('Corrected %d drifted entity counts', corrected)
+            except Exception:
+                # Try again on the next check, e.g. when the database was locked
+                logger.exception('Reconciling entity counts failed')
+            self._stop.wait(self.interval)
+
+
+counter_reconciler = CounterReconciler()
@@ -1,12 +1,34 @@
 """Defines the structure for tables in the database."""
 
-from sqlalchemy import Column, Float, ForeignKey, Integer, String, Boolean
-from sqlalchemy.orm import relationship
 from datetime import datetime
 
+from sqlalchemy import (
+    Boolean,
+    Column,
+    Float,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    Text,
+    false,
+)
+from sqlalchemy.orm import relationship
+
 from .config import Base
 
 
+def current_timestamp():
+    """
+    Format the current local time the way dates are stored in the tables.
+
+    Returns:
+        str: The current time as 'YYYY/MM/DD HH:MM:SS'.
+    """
+    return datetime.now().strftime('%Y/%m/%d %H:%M:%S')
+
+
 class User(Base):
     """
     User model for storing user data.
@@ -32,7 +54,7 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
-    registration_date = Column(String, default=datetime.now().strftime('%Y/%m/%d %H:%M:%S'))
+    registration_date = Column(String, default=current_timestamp)
     is_admin = Column(Boolean, default=False)
 
     datasets = relationship('Dataset', back_populates='owner')
@@ -48,6 +70,9 @@ class Dataset(Base):
         id (int): A unique identifier for the dataset (primary key).
         name (str): The name of the dataset.
         creation_date (str): The creation date of dataset.
+        file_hash (str): The SHA-256 of the uploaded data file, if any.
+        file_size (int): The size in bytes of the uploaded data file.
+        row_count (int): The number of lines of the uploaded data file.
         user_id (int): The ID of the user who created this dataset.
 
     Relationships:
@@ -58,10 +83,15 @@ class Dataset(Base):
     """
 
     __tablename__ = 'datasets'
+    # Serves the latest activity of each user in the admin user listing
+    __table_args__ = (Index('ix_datasets_user_id_creation_date', 'user_id', 'creation_date'),)
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
-    creation_date = Column(String, default=datetime.now().strftime('%Y/%m/%d %H:%M:%S'))
+    creation_date = Column(String, default=current_timestamp)
+    file_hash = Column(String, index=True)
+    file_size = Column(Integer)
+    row_count = Column(Integer)
 
     user_id = Column(Integer, ForeignKey('users.id'))
 
@@ -77,6 +107,9 @@ class Model(Base):
         id (int): A unique identifier for the model (primary key).
         name (str): The name of the model.
         creation_date (str): The creation date of model.
+        artifact_hash (str): The SHA-256 checksum of the uploaded model artifact, if any.
+        artifact_size (int): The size in bytes of the uploaded model artifact.
+        artifact_name (str): The file name of the uploaded model artifact.
         user_id (int): The ID of the user who created this model.
 
     Relationships:
@@ -87,10 +120,15 @@ class Model(Base):
     """
 
     __tablename__ = 'models'
+    # Serves the latest activity of each user in the admin user listing
+    __table_args__ = (Index('ix_models_user_id_creation_date', 'user_id', 'creation_date'),)
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
-    creation_date = Column(String, default=datetime.now().strftime('%Y/%m/%d %H:%M:%S'))
+    creation_date = Column(String, default=current_timestamp)
+    artifact_hash = Column(String, index=True)
+    artifact_size = Column(Integer)
+    artifact_name = Column(String)
 
     user_id = Column(Integer, ForeignKey('users.id'))
 
@@ -111,6 +149,12 @@ class Training(Base):
         dataset_name (str): The name of the dataset used in the training.
         precision (float): The precision value for the training results.
         recall (float): The recall value for the training results.
+        evaluation (str): The JSON-encoded confusion matrix and per-class scores, set once
+                predictions have been evaluated against the dataset labels.
+        sweep_id (int): The ID of the sweep this training is part of, if any.
+        params (str): The JSON-encoded hyperparameters of the training.
+        status (str): 'queued', 'completed' or 'failed'.
+        reused (bool): Whether the results were reused from an identical earlier run.
         creation_date (str): The creation date of the experiment.
         user_id (int): The ID of the user who conducted this training.
 
@@ -124,6 +168,18 @@ class Training(Base):
     """
 
     __tablename__ = 'trainings'
+    # Serve the latest activity of each user in the admin user listing, and the listings
+    # of a user's trainings filtered by model or dataset in metric order, read in index
+    # order so that the best k are found without sorting
+    __table_args__ = (
+        Index('ix_trainings_user_id_creation_date', 'user_id', 'creation_date'),
+        Index('ix_trainings_user_id_precision', 'user_id', 'precision'),
+        Index('ix_trainings_user_id_recall', 'user_id', 'recall'),
+        Index('ix_trainings_user_id_model_id_precision', 'user_id', 'model_id', 'precision'),
+        Index('ix_trainings_user_id_model_id_recall', 'user_id', 'model_id', 'recall'),
+        Index('ix_trainings_user_id_dataset_id_precision', 'user_id', 'dataset_id', 'precision'),
+        Index('ix_trainings_user_id_dataset_id_recall', 'user_id', 'dataset_id', 'recall'),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     training_name = Column(String, nullable=False)
@@ -133,10 +189,255 @@ class Training(Base):
     dataset_name = Column(String)
     precision = Column(Float)
     recall = Column(Float)
-    creation_date = Column(String, default=datetime.now().strftime('%Y/%m/%d %H:%M:%S'))
+    evaluation = Column(Text)
+    sweep_id = Column(Integer, ForeignKey('sweeps.id'), index=True)
+    params = Column(Text)
+    status = Column(String, default='completed')
+    reused = Column(Boolean, default=False, server_default=false())
+    creation_date = Column(String, default=current_timestamp)
 
     user_id = Column(Integer, ForeignKey('users.id'))
 
     model = relationship('Model', back_populates='trainings')
     dataset = relationship('Dataset', back_populates='trainings')
     owner = relationship('User', back_populates='trainings')
+    sweep = relationship('Sweep', back_populates='trainings')
+
+
+class Sweep(Base):
+    """
+    Represent a hyperparameter sweep in the database.
+
+    A sweep expands a parameter grid or a random-search specification into child
+    trainings of one model on one dataset, and tracks their progress.
+
+    Attributes:
+        id (int): A unique identifier for the sweep (primary key).
+        sweep_name (str): The name of the sweep.
+        model_id (int): The ID of the model trained by the sweep.
+        model_name (str): The name of the model trained by the sweep.
+        dataset_id (int): The ID of the dataset used by the sweep.
+        dataset_name (str): The name of the dataset used by the sweep.
+        strategy (str): 'grid' or 'random'.
+        space (str): The JSON-encoded parameter grid or random-search specification.
+        metric (str): The score used to rank the trainings, 'precision' or 'recall'.
+        total (int): The number of child trainings.
+        completed (int): The number of child trainings that finished.
+        failed (int): The number of child trainings that failed.
+        best_training_id (int): The ID of the best child training so far.
+        best_score (float): The metric of the best child training so far.
+        creation_date (str): The creation date of the sweep.
+        user_id (int): The ID of the user who launched the sweep.
+
+    Relationships:
+        trainings: A one-to-many relationship with the Training table,
+                representing the child trainings of the sweep.
+    """
+
+    __tablename__ = 'sweeps'
+
+    id = Column(Integer, primary_key=True, index=True)
+    sweep_name = Column(String, nullable=False)
+    model_id = Column(Integer, ForeignKey('models.id'))
+    model_name = Column(String)
+    dataset_id = Column(Integer, ForeignKey('datasets.id'))
+    dataset_name = Column(String)
+    strategy = Column(String, nullable=False)
+    space = Column(Text, nullable=False)
+    metric = Column(String, nullable=False)
+    total = Column(Integer, nullable=False)
+    completed = Column(Integer, default=0, nullable=False)
+    failed = Column(Integer, default=0, nullable=False)
+    best_training_id = Column(Integer)
+    best_score = Column(Float)
+    creation_date = Column(String, default=current_timestamp)
+
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
+
+    trainings = relationship('Training', back_populates='sweep')
+
+    @property
+    def status(self) -> str:
+        """Return 'running' while child trainings are queued, 'completed' afterwards."""
+        return 'running' if self.completed + self.failed < self.total else 'completed'
+
+
+class DatasetProfile(Base):
+    """
+    Represent the cached profile of a dataset file in the database.
+
+    Profiles are keyed by the content hash of the file, so datasets sharing the same
+    file share the same profile.
+
+    Attributes:
+        file_hash (str): The SHA-256 of the profiled file (primary key).
+        profile (str): The JSON-encoded row count and column statistics.
+        error (str): The error message if profiling failed.
+        creation_date (str): The date the profile was computed.
+    """
+
+    __tablename__ = 'dataset_profiles'
+
+    file_hash = Column(String, primary_key=True)
+    profile = Column(Text)
+    error = Column(String)
+    creation_date = Column(String, default=current_timestamp)
+
+
+class TrainingResult(Base):
+    """
+    Represent the cached results of a training run in the database.
+
+    Results are keyed by a fingerprint of the model version, the dataset content and
+    the training parameters, so an identical run can reuse them instead of training again.
+
+    Attributes:
+        fingerprint (str): The SHA-256 of the run inputs (primary key).
+        precision (float): The precision of the run.
+        recall (float): The recall of the run.
+        training_id (int): The ID of the training that computed the results.
+        hits (int): The number of trainings that reused the results.
+        creation_date (str): The date the results were computed.
+        last_used (str): The date the results were last computed or reused.
+    """
+
+    __tablename__ = 'training_results'
+
+    fingerprint = Column(String, primary_key=True)
+    precision = Column(Float)
+    recall = Column(Float)
+    training_id = Column(Integer)
+    hits = Column(Integer, default=0)
+    creation_date = Column(String, default=current_timestamp, index=True)
+    last_used = Column(String, default=current_timestamp, index=True)
+
+
+class EntityCount(Base):
+    """
+    Represent a maintained count of users, datasets, models or trainings in the database.
+
+    Counts are updated in the same transaction as the inserts and deletes they count,
+    so reading them never requires scanning the counted tables.
+
+    Attributes:
+        entity (str): The counted table: 'users', 'datasets', 'models' or 'trainings' (primary key).
+        user_id (int): The owner whose records are counted, 0 for the total (primary key).
+        count (int): The number of records.
+    """
+
+    __tablename__ = 'entity_counts'
+
+    entity = Column(String, primary_key=True)
+    user_id = Column(Integer, primary_key=True, index=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class DeletionCount(Base):
+    """
+    Represent the number of rows ever deleted from a table.
+
+    Server workers compare it with the value seen when they built an in-memory index
+    of the table, to know that another worker deleted rows since.
+
+    Attributes:
+        table_name (str): The name of the table (primary key).
+        count (int): The number of rows deleted from the table.
+    """
+
+    __tablename__ = 'deletion_counts'
+
+    table_name = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+
+class Change(Base):
+    """
+    Represent a created, updated or deleted dataset, model or training in the changefeed.
+
+    Sequence numbers are never reused, so a client that has seen every change up to
+    a sequence number only needs the changes after it to stay up to date.
+
+    Attributes:
+        seq (int): The position of the change in the feed (primary key).
+        entity (str): 'dataset', 'model' or 'training'.
+        entity_id (int): The ID of the changed row.
+        action (str): 'create', 'update' or 'delete'.
+        user_id (int): The ID of the user who owns the row.
+        creation_date (str): The date of the change.
+    """
+
+    __tablename__ = 'changes'
+    __table_args__ = (
+        Index('ix_changes_user_id_seq', 'user_id', 'seq'),
+        {'sqlite_autoincrement': True},
+    )
+
+    seq = Column(Integer, primary_key=True)
+    entity = Column(String, nullable=False)
+    entity_id = Column(Integer, nullable=False)
+    action = Column(String, nullable=False)
+    user_id = Column(Integer)
+    creation_date = Column(String, default=current_timestamp, index=True)
+
+
+class MetricChunk(Base):
+    """
+    Represent consecutive points of a per-step metric of a training in the database.
+
+    The steps and values are packed little-endian uint32 and float32 arrays, and the
+    extremes of the chunk are kept alongside, so that coarse series are read without
+    unpacking every chunk. Chunks are not removed when their training is archived.
+
+    Attributes:
+        id (int): A unique identifier for the chunk (primary key).
+        training_id (int): The ID of the training the metric was recorded for.
+        metric (str): The name of the metric, e.g. 'loss'.
+        first_step (int): The first step of the chunk.
+        last_step (int): The last step of the chunk.
+        count (int): The number of points in the chunk.
+        min_step (int): The step of the lowest value.
+        min_value (float): The lowest value.
+        max_step (int): The step of the highest value.
+        max_value (float): The highest value.
+        steps (bytes): The packed steps, in increasing order.
+        values (bytes): The packed values, one per step.
+    """
+
+    __tablename__ = 'metric_chunks'
+    __table_args__ = (
+        Index(
+            'ix_metric_chunks_training_id_metric_first_step', 'training_id', 'metric', 'first_step'
+        ),
+    )
+
+    id = Column(Integer, primary_key=True)
+    training_id = Column(Integer, nullable=False)
+    metric = Column(String, nullable=False)
+    first_step = Column(Integer, nullable=False)
+    last_step = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False)
+    min_step = Column(Integer)
+    min_value = Column(Float)
+    max_step = Column(Integer)
+    max_value = Column(Float)
+    steps = Column(LargeBinary, nullable=False)
+    values = Column(LargeBinary, nullable=False)
+
+
+class RevokedToken(Base):
+    """
+    Represent a revoked refresh token, or a revoked family of refresh tokens, in the database.
+
+    A refresh token is revoked once exchanged for a new one. Its family, the tokens
+    rotated from the same login, is revoked at logout or when a revoked token is used
+    again. Entries are purged once the tokens they revoke are expired anyway.
+
+    Attributes:
+        token_id (str): The ID of the refresh token or of its family (primary key).
+        expires_at (int): The UNIX time after which the revoked tokens are expired.
+    """
+
+    __tablename__ = 'revoked_tokens'
+
+    token_id = Column(String, primary_key=True)
+    expires_at = Column(Integer, nullable=False, index=True)
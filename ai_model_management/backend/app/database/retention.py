@@ -0,0 +1,314 @@
+"""Hot/cold retention tiering moving old trainings into a compressed archive database."""
+
+import fcntl
+import json
+import logging
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import groupby
+
+from sqlalchemy import (
+    Column,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    create_engine,
+    delete,
+    insert,
+)
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import sessionmaker
+
+from .config import SQLITE_BUSY_TIMEOUT_SECONDS, engine, shard_router
+from .db_models import Change, Training, current_timestamp
+from .transactions import begin_write
+
+# SQLite file holding the archived trainings
+ARCHIVE_DATABASE_PATH = os.environ.get('ARCHIVE_DATABASE_PATH', './archive.db')
+# Trainings older than this many days are moved to the archive, 0 disables the move
+TRAINING_RETENTION_DAYS = int(os.environ.get('TRAINING_RETENTION_DAYS', 365))
+# Number of trainings moved per transaction
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 500))
+# Pause between two batches, keeping the writer lock available for the routes
+RETENTION_PAUSE_SECONDS = float(os.environ.get('RETENTION_PAUSE_SECONDS', 0.5))
+# Pause between two runs once every old training has been moved
+RETENTION_INTERVAL_SECONDS = float(os.environ.get('RETENTION_INTERVAL_SECONDS', 3600))
+
+# File locked while trainings move to the archive, and while the databases are backed up
+ARCHIVE_LOCK_PATH = f'{ARCHIVE_DATABASE_PATH}.lock'
+
+# Columns of a training stored in the compressed payload, user_id is kept on the chunk
+ARCHIVED_COLUMNS = [
+    column.name for column in Training.__table__.columns if column.name != 'user_id'
+]
+# Values of the columns missing from older chunks, the scalar column defaults
+COLUMN_DEFAULTS = {
+    column.name: (
+        column.default.arg if column.default is not None and column.default.is_scalar else None
+    )
+    for column in Training.__table__.columns
+}
+DATE_FORMAT = '%Y/%m/%d %H:%M:%S'
+
+logger = logging.getLogger(__name__)
+
+ArchiveBase = declarative_base()
+
+
+class TrainingChunk(ArchiveBase):
+    """
+    A compressed, column-oriented chunk of archived trainings of one user.
+
+    Attributes:
+        id (int): A unique identifier for the chunk (primary key).
+        user_id (int): The ID of the user who conducted the trainings.
+        min_id (int): The smallest training ID in the chunk.
+        max_id (int): The largest training ID in the chunk.
+        first_date (str): The creation date of the oldest training in the chunk.
+        last_date (str): The creation date of the newest training in the chunk.
+        row_count (int): The number of trainings in the chunk.
+        payload (bytes): The zlib-compressed JSON mapping each column to its values.
+    """
+
+    __tablename__ = 'training_chunks'
+    # The chunks are written through the hot database with the archive file attached
+    # under the "archive" schema, and read from the archive file directly.
+    __table_args__ = (
+        Index('ix_training_chunks_user_id_max_id', 'user_id', 'max_id'),
+        {'schema': 'archive'},
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False)
+    min_id = Column(Integer, nullable=False)
+    max_id = Column(Integer, nullable=False)
+    first_date = Column(String, nullable=False)
+    last_date = Column(String, nullable=False)
+    row_count = Column(Integer, nullable=False)
+    payload = Column(LargeBinary, nullable=False)
+
+    def rows(self) -> list:
+        """
+        Decompress the chunk.
+
+        Returns:
+            list: The archived trainings as dicts, ordered by ID.
+        """
+        columns = json.loads(zlib.decompress(self.payload))
+        # Columns added to the trainings table after the chunk was written take their default
+        for name in ARCHIVED_COLUMNS:
+            if name not in columns:
+                columns[name] = [COLUMN_DEFAULTS[name]] * self.row_count
+        return [
+            dict(zip(ARCHIVED_COLUMNS, values), user_id=self.user_id)
+            for values in zip(*(columns[name] for name in ARCHIVED_COLUMNS))
+        ]
+
+
+archive_engine = create_engine(
+    f'sqlite:///{ARCHIVE_DATABASE_PATH}',
+    connect_args={'check_same_thread': False, 'timeout': SQLITE_BUSY_TIMEOUT_SECONDS},
+    execution_options={'schema_translate_map': {'archive': None}},
+)
+ArchiveSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=archive_engine)
+os.register_at_fork(after_in_child=lambda: archive_engine.dispose(close=False))
+
+
+def get_archive_db():
+    """
+    Provide an archive database session and ensure it is closed after use.
+
+    Yields:
+        Session: SQLAlchemy session bound to the archive database.
+    """
+    db = ArchiveSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def init_archive():
+    """Create the archive tables if they do not exist yet."""
+    ArchiveBase.metadata.create_all(bind=archive_engine)
+
+
+@contextmanager
+def archive_lock():
+    """
+    Hold the lock of the moves to the archive, across threads and server workers.
+
+    A move deletes trainings from a hot database and inserts them in the archive in
+    one transaction of the hot database, so the backups hold the lock while copying
+    the databases one after the other, for no training to be copied twice or missed.
+    """
+    with open(ARCHIVE_LOCK_PATH, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def compress_chunk(user_id: int, rows: list) -> dict:
+    """
+    Build a chunk record from the trainings of one user.
+
+    Attributes:
+        user_id (int): The ID of the user who conducted the trainings.
+        rows (list): The training rows, ordered by ID.
+
+    Returns:
+        dict: The column values of the chunk.
+    """
+    columns = {name: [row[name] for row in rows] for name in ARCHIVED_COLUMNS}
+    return {
+        'user_id': user_id,
+        'min_id': rows[0]['id'],
+        'max_id': rows[-1]['id'],
+        'first_date': min(columns['creation_date']),
+        'last_date': max(columns['creation_date']),
+        'row_count': len(rows),
+        'payload': zlib.compress(json.dumps(columns, separators=(',', ':')).encode(), 9),
+    }
+
+
+def archive_batch(cutoff: str, batch_size: int = RETENTION_BATCH_SIZE, bind=engine) -> int:
+    """
+    Move one batch of trainings created before the cutoff to the archive.
+
+    The archive file is attached to the hot database connection so that the chunk
+    inserts and the deletes from the hot table commit in the same transaction. The
+    deletes bypass the ORM, so their tombstones are added to the changefeed here.
+
+    Attributes:
+        cutoff (str): Trainings with an older creation date are moved.
+        batch_size (int): Maximum number of trainings moved.
+        bind (Engine): The engine of the hot database, the main one or a shard.
+
+    Returns:
+        int: The number of trainings moved.
+    """
+    trainings = Training.__table__
+    with archive_lock(), bind.connect() as conn:
+        conn.exec_driver_sql('ATTACH DATABASE ? AS archive', (ARCHIVE_DATABASE_PATH,))
+        conn.commit()
+        try:
+            with conn.begin():
+                begin_write(conn)
+                rows = (
+                    conn.execute(
+                        trainings.select()
+                        .where(trainings.c.creation_date < cutoff)
+                        # Old trainings have the lowest IDs, so the scan in ID order stops
+                        # early and each user's chunks cover increasing ID ranges.
+                        .order_by(trainings.c.id)
+                        .limit(batch_size)
+                    )
+                    .mappings()
+                    .all()
+                )
+                if not rows:
+                    return 0
+                rows = sorted(rows, key=lambda row: row['user_id'])
+                chunks = [
+                    compress_chunk(user_id, list(user_rows))
+                    for user_id, user_rows in groupby(rows, key=lambda row: row['user_id'])
+                ]
+                conn.execute(insert(TrainingChunk.__table__), chunks)
+                conn.execute(
+                    delete(trainings).where(trainings.c.id.in_([row['id'] for row in rows]))
+                )
+                now = current_timestamp()
+                conn.execute(
+                    insert(Change),
+                    [
+                        {
+                            'entity': 'training',
+                            'entity_id': row['id'],
+                            'action': 'delete',
+                            'user_id': row['user_id'],
+                            'creation_date': now,
+                        }
+                        for row in rows
+                    ],
+                )
+            return len(rows)
+        finally:
+            conn.exec_driver_sql('DETACH DATABASE archive')
+            conn.commit()
+
+
+class RetentionWorker:
+    """
+    Background thread moving old trainings to the archive in throttled batches.
+
+    Attributes:
+        retention_days (int): Age in days after which trainings are archived.
+        batch_size (int): Number of trainings moved per transaction.
+        pause (float): Seconds to wait between two batches.
+        interval (float): Seconds to wait between two runs.
+    """
+
+    def __init__(
+        self,
+        retention_days: int = TRAINING_RETENTION_DAYS,
+        batch_size: int = RETENTION_BATCH_SIZE,
+        pause: float = RETENTION_PAUSE_SECONDS,
+        interval: float = RETENTION_INTERVAL_SECONDS,
+    ):
+        self.retention_days = retention_days
+        self.batch_size = batch_size
+        self.pause = pause
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> int:
+        """
+        Move every training older than the retention age, one batch at a time, from
+        the main database then from each shard.
+
+        Returns:
+            int: The number of trainings moved.
+        """
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).strftime(DATE_FORMAT)
+        moved = 0
+        for shard_id in [None, *shard_router.shard_ids()]:
+            while not self._stop.is_set():
+                bind = engine if shard_id is None else shard_router.engine(shard_id)
+                count = archive_batch(cutoff, self.batch_size, bind)
+                moved += count
+                if count < self.batch_size:
+                    break
+                self._stop.wait(self.pause)
+        return moved
+
+    def start(self):
+        """Start the background thread, unless retention is disabled."""
+        if self.retention_days <= 0 or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread after its current batch."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """Thread loop: archive, then sleep until the next run."""
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                # Try again on the next run, e.g. when the database was locked
+                logger.exception('Archiving old trainings failed')
+            self._stop.wait(self.interval)
+
+
+retention_worker = RetentionWorker()
@@ -0,0 +1,86 @@
+"""Server-side store of the revoked refresh tokens, purged as the tokens expire."""
+
+import os
+import time
+
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from ..core.background import PeriodicJob
+from .config import SessionLocal
+from .db_models import RevokedToken
+from .transactions import begin_write, commit
+
+# Seconds between two purges of the revocations of expired tokens
+REVOKED_TOKEN_PURGE_INTERVAL_SECONDS = float(
+    os.environ.get('REVOKED_TOKEN_PURGE_INTERVAL_SECONDS', 3600)
+)
+
+
+def is_revoked(db: Session, *token_ids: str) -> bool:
+    """
+    Tell whether any of the given refresh tokens or token families is revoked.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        token_ids (str): The IDs of the tokens or families.
+
+    Returns:
+        bool: True if one of them is revoked.
+    """
+    query = db.query(RevokedToken.token_id).filter(RevokedToken.token_id.in_(token_ids))
+    return db.query(query.exists()).scalar()
+
+
+def revoke(db: Session, token_id: str, expires_at: int):
+    """
+    Revoke a refresh token or a token family, without committing.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+        token_id (str): The ID of the token or family.
+        expires_at (int): The UNIX time after which the revoked tokens are expired.
+    """
+    begin_write(db)
+    statement = insert(RevokedToken).values(token_id=token_id, expires_at=expires_at)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=['token_id'],
+            set_={'expires_at': statement.excluded.expires_at},
+            where=RevokedToken.expires_at < statement.excluded.expires_at,
+        )
+    )
+
+
+def purge_revoked_tokens(db: Session) -> int:
+    """
+    Delete the revocations of tokens that have expired since.
+
+    Attributes:
+        db (Session): SQLAlchemy session to access the database.
+
+    Returns:
+        int: The number of revocations deleted.
+    """
+    begin_write(db)
+    purged = (
+        db.query(RevokedToken)
+        .filter(RevokedToken.expires_at < int(time.time()))
+        .delete(synchronize_session=False)
+    )
+    commit(db)
+    return purged
+
+
+def purge_expired_revocations():
+    """Purge the expired revocations in a session of their own, the function of the purge job."""
+    db = SessionLocal()
+    try:
+        purge_revoked_tokens(db)
+    finally:
+        db.close()
+
+
+revocation_purger = PeriodicJob(
+    'token-revocations', purge_expired_revocations, REVOKED_TOKEN_PURGE_INTERVAL_SECONDS
+)
@@ -0,0 +1,187 @@
+"""Write transactions that wait out the lock of concurrent SQLite writers."""
+
+import multiprocessing
+import os
+import random
+import sqlite3
+import time
+from functools import partial
+
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+
+# Attempts to take the write lock, or to commit, before giving up with a busy error
+TRANSACTION_MAX_ATTEMPTS = int(os.environ.get('TRANSACTION_MAX_ATTEMPTS', 8))
+# Delay in milliseconds before the second attempt, doubled for each following attempt
+TRANSACTION_BACKOFF_MS = float(os.environ.get('TRANSACTION_BACKOFF_MS', 10))
+# Longest delay in milliseconds between two attempts
+TRANSACTION_MAX_BACKOFF_MS = float(os.environ.get('TRANSACTION_MAX_BACKOFF_MS', 500))
+
+# Primary result codes of SQLite for a database locked by another connection
+BUSY_CODES = {5, 6}
+BUSY_MESSAGES = ('database is locked', 'database table is locked', 'database is busy')
+
+
+class DatabaseBusyError(Exception):
+    """Raised when the database stays locked by other writers after every attempt."""
+
+
+class TransactionStats:
+    """
+    Count the write transactions and the attempts they retried.
+
+    The counters live in shared memory, so that when the application is preloaded
+    before forking workers, as done by ``app.serve``, they cover the whole server.
+    """
+
+    names = ('commits', 'retries', 'failures')
+
+    def __init__(self):
+        self._counters = multiprocessing.RawArray('q', len(self.names))
+        self._lock = multiprocessing.Lock()
+
+    def add(self, name: str, value: int = 1):
+        """Increment a counter."""
+        with self._lock:
+            self._counters[self.names.index(name)] += value
+
+    def get(self, name: str) -> int:
+        """Return a counter."""
+        with self._lock:
+            return self._counters[self.names.index(name)]
+
+    def snapshot(self) -> dict:
+        """Return the counters by name."""
+        with self._lock:
+            return dict(zip(self.names, self._counters))
+
+
+transaction_stats = TransactionStats()
+
+
+def is_busy(exc: Exception) -> bool:
+    """
+    Tell whether an error comes from a database locked by another connection.
+
+    Attributes:
+        exc (Exception): The error, raised by the driver or wrapped by SQLAlchemy.
+
+    Returns:
+        bool: True if retrying later may succeed.
+    """
+    exc = getattr(exc, 'orig', exc)
+    if not isinstance(exc, sqlite3.OperationalError):
+        return False
+    code = getattr(exc, 'sqlite_errorcode', None)
+    if code is not None:
+        return code & 0xFF in BUSY_CODES
+    return str(exc).startswith(BUSY_MESSAGES)
+
+
+def retry_busy(operation, attempts: int = TRANSACTION_MAX_ATTEMPTS):
+    """
+    Run an operation, retrying it with a jittered exponential backoff while the
+    database is busy.
+
+    Each attempt already waits up to ``SQLITE_BUSY_TIMEOUT_SECONDS`` for the lock in
+    SQLite itself. The random delay between attempts spreads the writers that failed
+    together, so that they do not all come back at the same time.
+
+    Attributes:
+        operation (callable): The operation, called without arguments.
+        attempts (int): The maximum number of attempts.
+
+    Returns:
+        The result of the operation.
+
+    Raises:
+        DatabaseBusyError: If the database is still busy after the last attempt.
+    """
+    for attempt in range(1, attempts + 1):
+        try:
+            return operation()
+        except sqlite3.OperationalError as exc:
+            if not is_busy(exc):
+                raise
+            if attempt == attempts:
+                transaction_stats.add('failures')
+                raise DatabaseBusyError(str(exc)) from exc
+        transaction_stats.add('retries')
+        backoff = min(TRANSACTION_BACKOFF_MS * 2 ** (attempt - 1), TRANSACTION_MAX_BACKOFF_MS)
+        time.sleep(random.uniform(0, backoff) / 1000)
+
+
+def _driver_connection(bind: Session | Connection, entity=None) -> sqlite3.Connection:
+    """
+    Return the sqlite3 connection used by a SQLAlchemy connection, or by a session for
+    the database storing a mapped class, the main database when none is given.
+    """
+    if isinstance(bind, Session):
+        bind = bind.connection(bind_arguments={'mapper': entity} if entity is not None else None)
+    return bind.connection.driver_connection
+
+
+def begin_write(bind: Session | Connection, *entities):
+    """
+    Start a write transaction with ``BEGIN IMMEDIATE``, unless one is already open.
+
+    The driver otherwise starts a deferred transaction before the first write. A
+    deferred transaction that read before writing has to upgrade its shared lock, and
+    fails at once, without waiting, if another connection is writing. Taking the
+    write lock up front makes every later statement of the transaction succeed, so
+    that only this call has to be retried. Call it before the first statement of a
+    transaction that writes.
+
+    With sharded storage, a session writes to the main database and to a shard through
+    separate connections, so the databases the transaction writes to are given by
+    the mapped classes it writes, each locked in turn.
+
+    Attributes:
+        bind (Session | Connection): The session or connection starting the transaction.
+        entities: For a session, mapped classes whose database is written, the main
+            database when none is given.
+
+    Raises:
+        DatabaseBusyError: If the write lock could not be taken.
+    """
+    for entity in entities or (None,):
+        driver = _driver_connection(bind, entity)
+        if isinstance(bind, Session):
+            bind.info.setdefault('write_binds', set()).add(
+                bind.get_bind(entity) if entity is not None else bind.get_bind()
+            )
+        if not driver.in_transaction:
+            retry_busy(partial(driver.execute, 'BEGIN IMMEDIATE'))
+
+
+def commit(db: Session):
+    """
+    Commit a session in a write transaction, retrying while the database is busy.
+
+    Replaces ``db.commit()``: the pending changes are flushed in a transaction
+    started with ``BEGIN IMMEDIATE``, then the commit, which waits for the readers of
+    the database, is retried if they hold it for too long. SQLite keeps the
+    transaction open when its commit fails as busy, so no change is lost or applied
+    twice by the retries. With sharded storage, each database written is committed
+    in turn, the main database first.
+
+    Attributes:
+        db (Session): SQLAlchemy session to commit.
+
+    Raises:
+        DatabaseBusyError: If the database stayed busy.
+    """
+    pending = [type(obj) for obj in (*db.new, *db.dirty, *db.deleted)]
+    if pending:
+        default = db.get_bind()
+        begin_write(db, *sorted(set(pending), key=lambda entity: db.get_bind(entity) != default))
+    db.flush()
+    if db.in_transaction():
+        binds = [db.get_bind()]
+        binds += [bind for bind in db.info.pop('write_binds', ()) if bind is not binds[0]]
+        for bind in binds:
+            driver = _driver_connection(db.connection(bind_arguments={'bind': bind}))
+            if driver.in_transaction:
+                retry_busy(driver.commit)
+                transaction_stats.add('commits')
+    db.commit()
@@ -0,0 +1,180 @@
+"""Group-commit write coalescer committing concurrent inserts in a single transaction."""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from sqlalchemy.orm import Session, sessionmaker
+
+from .config import SHARDED_TABLES, SessionLocal, shard_router, use_shard
+from .transactions import DatabaseBusyError, commit
+
+# Longest time the first queued insert waits for others to join its batch
+WRITE_BATCH_WINDOW_MS = float(os.environ.get('WRITE_BATCH_WINDOW_MS', 2))
+# Largest number of inserts committed in one transaction
+WRITE_BATCH_MAX_ROWS = int(os.environ.get('WRITE_BATCH_MAX_ROWS', 128))
+
+
+class WriteBatcher:
+    """
+    Collect inserts from concurrent requests and commit them together.
+
+    Each SQLite commit is an fsync on the single writer, so committing a batch of
+    inserts at once divides that cost by the batch size. Every caller still gets its
+    own persisted object back, or its own exception. With sharded storage, the
+    inserts of a batch are committed in one transaction per shard.
+
+    Attributes:
+        session_factory (sessionmaker): Factory for the sessions used by the writer thread.
+        window (float): Seconds to wait for more inserts after the first one arrives.
+        max_rows (int): Maximum number of inserts per transaction.
+    """
+
+    def __init__(
+        self,
+        session_factory: sessionmaker,
+        window_ms: float = WRITE_BATCH_WINDOW_MS,
+        max_rows: int = WRITE_BATCH_MAX_ROWS,
+    ):
+        self.session_factory = session_factory
+        self.window = window_ms / 1000
+        self.max_rows = max_rows
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def insert(self, obj, shard_id: int | None = None):
+        """
+        Persist a new ORM object and wait until its batch is committed.
+
+        Attributes:
+            obj: A transient ORM object to insert.
+            shard_id (int | None): The shard storing the object with sharded storage,
+                None for the main database.
+
+        Returns:
+            The same object, detached, with its generated columns loaded.
+
+        Raises:
+            SQLAlchemyError: If the insert of this object failed.
+        """
+        future = Future()
+        self._ensure_started()
+        self._queue.put((obj, shard_id, future))
+        return future.result()
+
+    def close(self):
+        """Commit everything still queued and stop the writer thread."""
+        with self._lock:
+            if self._thread is None:
+                return
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _ensure_started(self):
+        """Start the writer thread on first use."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='write-batcher', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        """Writer thread loop: gather a batch within the window and commit it."""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_rows:
+                try:
+                    item = self._queue.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            for shard_id, shard_batch in self._split(batch).items():
+                self._commit(shard_id, shard_batch)
+            if stop:
+                return
+
+    @staticmethod
+    def _split(batch: list) -> dict:
+        """
+        Split a batch by the database its objects are stored in, the main database or
+        a shard with sharded storage.
+
+        Returns:
+            dict: The (object, future) pairs, by shard ID, None for the main database.
+        """
+        shards = {}
+        for obj, shard_id, future in batch:
+            if not shard_router.enabled or obj.__table__.name not in SHARDED_TABLES:
+                shard_id = None
+            shards.setdefault(shard_id, []).append((obj, future))
+        return shards
+
+    def _session(self, shard_id: int | None) -> Session:
+        """Open a session set to a shard, or to the main database."""
+        session = self.session_factory(expire_on_commit=False)
+        use_shard(session, shard_id)
+        return session
+
+    def _commit(self, shard_id: int | None, batch: list):
+        """
+        Commit a batch of objects stored in the same database in one transaction.
+
+        If the batch fails as a whole, for example because of a unique constraint
+        violation in one of its rows, every insert is retried in its own transaction
+        so that only the offending callers get an error. If the database stayed
+        locked by other writers, every caller gets the busy error.
+
+        Attributes:
+            shard_id (int | None): The shard storing the objects, None for the main database.
+            batch (list): The (object, future) pairs to commit.
+        """
+        session = self._session(shard_id)
+        try:
+            session.add_all([obj for obj, _ in batch])
+            commit(session)
+        except DatabaseBusyError as exc:
+            # Inserting the objects one at a time would only wait for the lock again
+            session.rollback()
+            session.close()
+            for _, future in batch:
+                future.set_exception(exc)
+            return
+        except Exception:
+            session.rollback()
+            session.close()
+            for obj, future in batch:
+                self._commit_one(shard_id, obj, future)
+            return
+        session.close()
+        for obj, future in batch:
+            future.set_result(obj)
+
+    def _commit_one(self, shard_id: int | None, obj, future: Future):
+        """Insert a single object in its own transaction and resolve its future."""
+        session = self._session(shard_id)
+        try:
+            session.add(obj)
+            commit(session)
+        except Exception as exc:
+            session.rollback()
+            future.set_exception(exc)
+        else:
+            future.set_result(obj)
+        finally:
+            session.close()
+
+
+write_batcher = WriteBatcher(SessionLocal)
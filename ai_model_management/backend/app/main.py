@@ -3,18 +3,45 @@ Main FastAPI application entry point, including database initialization
 and route inclusion for the application.
 """
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 
-from .api import datasets, models, trainings, users
+from .api import admin, changes, dashboard, datasets, models, sweeps, trainings, users
 from .api.users import register_admin
-from .database.config import Base, SessionLocal, engine
+from .core.background import BackgroundJobs
+from .core.profiling import profile_worker
+from .core.rate_limit import AdmissionControlMiddleware
+from .core.request_profiler import RequestProfilingMiddleware
+from .core.result_cache import cache_evictor
+from .core.single_flight import CoalescingTimeout
+from .core.sweeps import sweep_runner
+from .database.audit import audit_log, init_audit
+from .database.backup import backup_worker
+from .database.changes import change_pruner
+from .database.config import Base, SessionLocal, engine, upgrade_schema
+from .database.counters import counter_reconciler
+from .database.retention import init_archive, retention_worker
+from .database.token_revocations import revocation_purger
+from .database.transactions import DatabaseBusyError
+from .database.write_batcher import write_batcher
 
 # Create all tables in database
 Base.metadata.create_all(bind=engine)
+upgrade_schema(Base.metadata, engine)
+init_archive()
+init_audit()
 
 app = FastAPI()
 
+# Profile the requests of admins asking for it and, when enabled, the slowest requests.
+# Added first so that the profiles only cover the admitted requests.
+app.add_middleware(RequestProfilingMiddleware)
+
+# Reject requests over the per-user/per-IP rate limits or the global in-flight limit.
+# Added before CORS so that rejections still carry the CORS headers.
+app.add_middleware(AdmissionControlMiddleware)
+
 # Allow frontend to communicate with the backend (CORS settings).
 app.add_middleware(
     CORSMiddleware,
@@ -29,6 +56,37 @@ app.include_router(users.router)
 app.include_router(datasets.router)
 app.include_router(models.router)
 app.include_router(trainings.router)
+app.include_router(sweeps.router)
+app.include_router(changes.router)
+app.include_router(dashboard.router)
+app.include_router(admin.router)
+
+
+@app.exception_handler(DatabaseBusyError)
+async def database_busy_handler(request: Request, exc: DatabaseBusyError):
+    """
+    Answer 503 with a Retry-After header when other writers kept the database locked,
+    instead of failing with a 500: the write was not committed, so the request can be
+    sent again as is.
+    """
+    return JSONResponse(
+        status_code=503,
+        content={'detail': 'Database busy, retry later'},
+        headers={'Retry-After': '1'},
+    )
+
+
+@app.exception_handler(CoalescingTimeout)
+async def coalescing_timeout_handler(request: Request, exc: CoalescingTimeout):
+    """
+    Answer 503 with a Retry-After header when the identical read this request waited
+    for did not finish in time.
+    """
+    return JSONResponse(
+        status_code=503,
+        content={'detail': 'Identical request still running, retry later'},
+        headers={'Retry-After': '1'},
+    )
 
 
 # Home route to welcome users to the app
@@ -43,14 +101,60 @@ def read_home():
     return {'message': 'Welcome to the AI Model Management App!'}
 
 
-def startup_event():
+def start_background_jobs():
     """
-    Create a new database session and register the admin user.
+    Register the admin user, start archiving old trainings, pruning the changefeed,
+    evicting from the training results cache, purging the expired token revocations,
+    checking the dashboard counts and the scheduled backups, and resume the unfinished
+    sweeps.
     """
     db = SessionLocal()
     register_admin(db)
     db.close()
+    retention_worker.start()
+    change_pruner.start()
+    cache_evictor.start()
+    revocation_purger.start()
+    counter_reconciler.start()
+    backup_worker.start()
+    sweep_runner.resume()
+
+
+def stop_background_jobs():
+    """
+    Stop archiving old trainings, pruning the changefeed, evicting from the training results
+    cache, purging the expired token revocations, checking the dashboard counts and the
+    scheduled backups.
+    """
+    retention_worker.stop()
+    change_pruner.stop()
+    cache_evictor.stop()
+    revocation_purger.stop()
+    counter_reconciler.stop()
+    backup_worker.stop()
+
+
+# The background jobs run in a single worker when the server runs several
+background_jobs = BackgroundJobs(start_background_jobs, stop_background_jobs)
+
+
+def startup_event():
+    """Start the background jobs, unless another server worker runs them."""
+    background_jobs.start()
+
+
+def shutdown_event():
+    """
+    Stop the background workers, commit the inserts still waiting in the write batcher
+    and write the buffered audit events.
+    """
+    background_jobs.stop()
+    profile_worker.shutdown()
+    sweep_runner.shutdown()
+    write_batcher.close()
+    audit_log.close()
 
 
-# Register the startup event handler
+# Register the startup and shutdown event handlers
 app.add_event_handler('startup', startup_event)
+app.add_event_handler('shutdown', shutdown_event)
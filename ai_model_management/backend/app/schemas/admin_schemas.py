@@ -0,0 +1,115 @@
+"""Pydantic schemas for the admin dashboard."""
+
+from pydantic import BaseModel
+
+
+class EntityCounts(BaseModel):
+    """
+    Pydantic schema for the numbers of records of each kind.
+
+    Attributes:
+        users (int): The number of users.
+        datasets (int): The number of datasets.
+        models (int): The number of models.
+        trainings (int): The number of trainings, archived ones included.
+    """
+
+    users: int = 0
+    datasets: int = 0
+    models: int = 0
+    trainings: int = 0
+
+
+class UserCounts(BaseModel):
+    """
+    Pydantic schema for the numbers of records owned by a user.
+
+    Attributes:
+        user_id (int): The ID of the user.
+        email (str): The email of the user.
+        datasets (int): The number of datasets of the user.
+        models (int): The number of models of the user.
+        trainings (int): The number of trainings of the user, archived ones included.
+    """
+
+    user_id: int
+    email: str
+    datasets: int
+    models: int
+    trainings: int
+
+
+class AdminSummary(BaseModel):
+    """
+    Pydantic schema for returning the admin dashboard summary in the response.
+
+    Attributes:
+        totals (EntityCounts): The numbers of records of each kind.
+        users (list[UserCounts]): The numbers of records of each user in the requested page.
+    """
+
+    totals: EntityCounts
+    users: list[UserCounts]
+
+
+class RequestProfileResponse(BaseModel):
+    """
+    Pydantic schema for describing a stored request profile in the response.
+
+    Attributes:
+        id (str): The ID of the profile, as returned in the X-Profile-Id header.
+        trigger (str): 'request' if asked for by an admin, 'slowest' if kept by the rolling sampler.
+        method (str): The HTTP method of the request.
+        path (str): The path of the request.
+        route (str): The path template of the matched route.
+        status_code (int | None): The status code of the response.
+        duration_ms (float): The time taken to serve the request.
+        samples (int): The number of stack samples taken.
+        creation_date (str): The date the request was received.
+    """
+
+    id: str
+    trigger: str
+    method: str
+    path: str
+    route: str
+    status_code: int | None = None
+    duration_ms: float
+    samples: int
+    creation_date: str
+
+
+class BackupDatabase(BaseModel):
+    """
+    Pydantic schema for describing a database copy in a snapshot.
+
+    Attributes:
+        file (str): The name of the compressed copy in the snapshot directory.
+        pages (int): The number of database pages copied.
+        size (int): The size of the database in bytes.
+        compressed_size (int): The size of the compressed copy in bytes.
+        sha256 (str): The SHA-256 of the database, checked before a restore.
+    """
+
+    file: str
+    pages: int
+    size: int
+    compressed_size: int
+    sha256: str
+
+
+class BackupResponse(BaseModel):
+    """
+    Pydantic schema for describing a snapshot in the response.
+
+    Attributes:
+        name (str): The name of the snapshot, as given to the restore command.
+        creation_date (str): The date the snapshot was started.
+        duration_ms (float): The time taken to back up the databases.
+        databases (dict[str, BackupDatabase]): The copies by database name, e.g. 'app'.
+    """
+
+    name: str
+    creation_date: str
+    duration_ms: float
+    databases: dict[str, BackupDatabase]
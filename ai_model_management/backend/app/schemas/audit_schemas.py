@@ -0,0 +1,38 @@
+"""Pydantic schemas for audit events."""
+
+from typing import Any
+
+from pydantic import BaseModel, Json
+
+
+class AuditEventResponse(BaseModel):
+    """
+    Pydantic schema for returning an audit event in the response.
+
+    Attributes:
+        id (int): The unique identifier for the event, in recording order.
+        creation_date (str): The date the change was made.
+        actor_id (int | None): The ID of the user who made the change.
+        actor_email (str | None): The email of the user who made the change.
+        action (str): 'create' or 'delete'.
+        entity (str): 'user', 'dataset', 'model', 'training' or 'sweep'.
+        entity_id (int | None): The ID of the created or deleted record.
+        details (dict | None): Details of the record, e.g. its name.
+    """
+
+    id: int
+    creation_date: str
+    actor_id: int | None = None
+    actor_email: str | None = None
+    action: str
+    entity: str
+    entity_id: int | None = None
+    details: Json[dict[str, Any]] | None = None
+
+    class Config:
+        """
+        Config class to enable Pydantic to work with ORM objects, allowing
+        initialization of the schema from attributes of database models.
+        """
+
+        from_attributes = True
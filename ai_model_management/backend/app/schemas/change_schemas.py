@@ -0,0 +1,43 @@
+"""Pydantic schemas for the changefeed."""
+
+from typing import Any
+
+from pydantic import BaseModel
+
+
+class ChangeResponse(BaseModel):
+    """
+    Pydantic schema for returning a changed dataset, model or training in the response.
+
+    Attributes:
+        seq (int): The position of the latest change of the row in the feed.
+        entity (str): 'dataset', 'model' or 'training'.
+        entity_id (int): The ID of the changed row.
+        action (str): 'create', 'update' or 'delete'; a delete is a tombstone.
+        data (dict | None): The current row as returned by its list route, None for a
+            tombstone or a row deleted since.
+    """
+
+    seq: int
+    entity: str
+    entity_id: int
+    action: str
+    data: dict[str, Any] | None = None
+
+
+class ChangeFeed(BaseModel):
+    """
+    Pydantic schema for returning a page of the changefeed in the response.
+
+    Attributes:
+        cursor (int): The sequence number to pass as ``since`` to get the next changes.
+        has_more (bool): Whether more changes are available right away.
+        reset (bool): Whether changes after ``since`` were pruned, in which case the
+            client has to list the rows again before following the feed from ``cursor``.
+        changes (list[ChangeResponse]): The latest change of each row changed in the page.
+    """
+
+    cursor: int
+    has_more: bool
+    reset: bool = False
+    changes: list[ChangeResponse]
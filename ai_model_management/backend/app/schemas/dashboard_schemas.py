@@ -0,0 +1,50 @@
+"""Pydantic schemas for the user dashboard."""
+
+from pydantic import BaseModel
+
+from .dataset_schemas import DatasetResponse
+from .model_schemas import ModelResponse
+from .training_schemas import TrainingResponse
+from .user_schemas import UserResponse
+
+
+class DashboardCounts(BaseModel):
+    """
+    Pydantic schema for the numbers of records owned by the user.
+
+    Attributes:
+        datasets (int): The number of datasets of the user.
+        models (int): The number of models of the user.
+        trainings (int): The number of trainings of the user, archived ones included.
+    """
+
+    datasets: int = 0
+    models: int = 0
+    trainings: int = 0
+
+
+class DashboardResponse(BaseModel):
+    """
+    Pydantic schema for returning the user dashboard in the response.
+
+    Only the requested sections are present.
+
+    Attributes:
+        user (UserResponse | None): The authenticated user.
+        counts (DashboardCounts | None): The numbers of records owned by the user.
+        datasets (list[DatasetResponse] | None): The newest datasets the user can see.
+        models (list[ModelResponse] | None): The newest models the user can see.
+        trainings (list[TrainingResponse] | None): The newest trainings of the user.
+        top_trainings (list[TrainingResponse] | None): The trainings of the user with the best
+            precision.
+        max_age (dict[str, int]): Seconds each returned section may be reused before being
+            requested again, by section name.
+    """
+
+    user: UserResponse | None = None
+    counts: DashboardCounts | None = None
+    datasets: list[DatasetResponse] | None = None
+    models: list[ModelResponse] | None = None
+    trainings: list[TrainingResponse] | None = None
+    top_trainings: list[TrainingResponse] | None = None
+    max_age: dict[str, int]
@@ -1,5 +1,7 @@
 """Pydantic schemas for datasets."""
 
+from typing import Any
+
 from pydantic import BaseModel
 
 
@@ -22,11 +24,17 @@ class DatasetResponse(BaseModel):
         id (int): The unique identifier for the dataset.
         name (str): The name of the dataset.
         creation_date (str): The date of dataset creation.
+        file_hash (str | None): The SHA-256 of the uploaded data file.
+        file_size (int | None): The size in bytes of the uploaded data file.
+        row_count (int | None): The number of lines of the uploaded data file.
     """
 
     id: int
     name: str
     creation_date: str
+    file_hash: str | None = None
+    file_size: int | None = None
+    row_count: int | None = None
 
     class Config:
         """
@@ -35,3 +43,33 @@ class DatasetResponse(BaseModel):
         """
 
         from_attributes = True
+
+
+class DatasetSuggestion(BaseModel):
+    """
+    Pydantic schema for a dataset name suggestion returned by autocomplete.
+
+    Attributes:
+        id (int): The unique identifier for the dataset.
+        name (str): The name of the dataset.
+    """
+
+    id: int
+    name: str
+
+
+class DatasetProfileResponse(BaseModel):
+    """
+    Pydantic schema for returning the profile of a dataset file.
+
+    Attributes:
+        status (str): 'ready', 'running' while it is computed, or 'failed'.
+        file_hash (str): The SHA-256 of the profiled file.
+        profile (dict | None): The row count and the per-column types, null rates and histograms.
+        error (str | None): The error message if profiling failed.
+    """
+
+    status: str
+    file_hash: str
+    profile: dict[str, Any] | None = None
+    error: str | None = None
@@ -22,11 +22,17 @@ class ModelResponse(BaseModel):
         id (int): The unique identifier for the model.
         name (str): The name of the model.
         creation_date (str): The date of model creation.
+        artifact_hash (str | None): The SHA-256 checksum of the uploaded model artifact.
+        artifact_size (int | None): The size in bytes of the uploaded model artifact.
+        artifact_name (str | None): The file name of the uploaded model artifact.
     """
 
     id: int
     name: str
     creation_date: str
+    artifact_hash: str | None = None
+    artifact_size: int | None = None
+    artifact_name: str | None = None
 
     class Config:
         """
@@ -35,3 +41,16 @@ class ModelResponse(BaseModel):
         """
 
         from_attributes = True
+
+
+class ModelSuggestion(BaseModel):
+    """
+    Pydantic schema for a model name suggestion returned by autocomplete.
+
+    Attributes:
+        id (int): The unique identifier for the model.
+        name (str): The name of the model.
+    """
+
+    id: int
+    name: str
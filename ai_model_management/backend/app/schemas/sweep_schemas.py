@@ -0,0 +1,109 @@
+"""Pydantic schemas for hyperparameter sweeps."""
+
+from typing import Any, Literal
+
+from pydantic import BaseModel, Field, Json
+
+
+class ParameterRange(BaseModel):
+    """
+    Pydantic schema for a numeric range sampled by random search.
+
+    Attributes:
+        low (float): The lower bound of the range.
+        high (float): The upper bound of the range.
+        log (bool): Whether to sample uniformly on a log scale, e.g. for learning rates.
+        integer (bool): Whether to round the sampled values to integers.
+    """
+
+    low: float
+    high: float
+    log: bool = False
+    integer: bool = False
+
+
+class RandomSearch(BaseModel):
+    """
+    Pydantic schema for a random-search specification.
+
+    Attributes:
+        trials (int): The number of parameter combinations to draw.
+        parameters (dict): For each parameter, a list of choices or a range.
+        seed (int | None): Seed making the draw reproducible.
+    """
+
+    trials: int = Field(ge=1)
+    parameters: dict[str, list[Any] | ParameterRange]
+    seed: int | None = None
+
+
+class SweepCreate(BaseModel):
+    """
+    Pydantic schema for launching a hyperparameter sweep.
+
+    Exactly one of grid and random must be given.
+
+    Attributes:
+        sweep_name (str): The name of the sweep, child trainings are named after it.
+        model_id (int): The ID of the model to train.
+        dataset_id (int): The ID of the dataset to train on.
+        grid (dict | None): The candidate values of each parameter, every combination is trained.
+        random (RandomSearch | None): A random-search specification.
+        metric (str): The score used to rank the trainings, 'precision' or 'recall'.
+    """
+
+    sweep_name: str
+    model_id: int
+    dataset_id: int
+    grid: dict[str, list[Any]] | None = None
+    random: RandomSearch | None = None
+    metric: Literal['precision', 'recall'] = 'precision'
+
+
+class SweepResponse(BaseModel):
+    """
+    Pydantic schema for returning the details and progress of a sweep in the response.
+
+    Attributes:
+        id (int): The unique identifier for the sweep.
+        sweep_name (str): The name of the sweep.
+        model_id (int): The ID of the trained model.
+        model_name (str): The name of the trained model.
+        dataset_id (int): The ID of the dataset trained on.
+        dataset_name (str): The name of the dataset trained on.
+        strategy (str): 'grid' or 'random'.
+        space (dict): The parameter grid or random-search specification.
+        metric (str): The score used to rank the trainings.
+        status (str): 'running' while trainings are queued, 'completed' afterwards.
+        total (int): The number of child trainings.
+        completed (int): The number of child trainings that finished.
+        failed (int): The number of child trainings that failed.
+        best_training_id (int | None): The ID of the best training so far.
+        best_score (float | None): The metric of the best training so far.
+        creation_date (str): The date the sweep was launched.
+    """
+
+    id: int
+    sweep_name: str
+    model_id: int
+    model_name: str
+    dataset_id: int
+    dataset_name: str
+    strategy: str
+    space: Json[dict[str, Any]]
+    metric: str
+    status: str
+    total: int
+    completed: int
+    failed: int
+    best_training_id: int | None = None
+    best_score: float | None = None
+    creation_date: str
+
+    class Config:
+        """
+        Config class to enable Pydantic to work with ORM objects, allowing
+        initialization of the schema from attributes of database models.
+        """
+
+        from_attributes = True
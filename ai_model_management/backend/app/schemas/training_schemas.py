@@ -1,6 +1,8 @@
 """Pydantic schemas for trainings."""
 
-from pydantic import BaseModel
+from typing import Any
+
+from pydantic import BaseModel, Json
 
 
 class TrainingCreate(BaseModel):
@@ -11,11 +13,13 @@ class TrainingCreate(BaseModel):
          training_name (str): The name of training to be created.
          model_id (int): The ID of the model used in the training.
          dataset_id (int): The ID of the dataset used in the training.
+         params (dict): The hyperparameters of the training.
     """
 
     training_name: str
     model_id: int
     dataset_id: int
+    params: dict[str, Any] = {}
 
 
 class TrainingResponse(BaseModel):
@@ -25,23 +29,31 @@ class TrainingResponse(BaseModel):
     Attributes:
          id (int): The unique identifier for the training.
          training_name (str): The name of training to be created.
-         model_id (int): The ID of the model used in the training.
+         model_id (int | None): The ID of the model used in the training, None once deleted.
          model_name (str): The name of the model used in the training.
-         dataset_id (int): The ID of the dataset used in the training.
+         dataset_id (int | None): The ID of the dataset used in the training, None once deleted.
          dataset_name (str): The name of the dataset used in the training.
-         precision (float): The precision value for the training results.
-         recall (float): The recall value for the training results.
+         precision (float | None): The precision value for the training results, None until run.
+         recall (float | None): The recall value for the training results, None until run.
+         sweep_id (int | None): The ID of the sweep the training is part of, if any.
+         params (dict | None): The hyperparameters of the training.
+         status (str | None): 'queued', 'completed' or 'failed'.
+         reused (bool): Whether the results were reused from an identical earlier run.
          creation_date (str): The date of training creation.
     """
 
     id: int
     training_name: str
-    model_id: int
+    model_id: int | None = None
     model_name: str
-    dataset_id: int
+    dataset_id: int | None = None
     dataset_name: str
-    precision: float
-    recall: float
+    precision: float | None = None
+    recall: float | None = None
+    sweep_id: int | None = None
+    params: Json[dict[str, Any]] | None = None
+    status: str | None = None
+    reused: bool = False
     creation_date: str
 
     class Config:
@@ -51,3 +63,90 @@ class TrainingResponse(BaseModel):
         """
 
         from_attributes = True
+
+
+class TrainingEvaluationResponse(BaseModel):
+    """
+    Pydantic schema for returning the evaluation of a training's predictions.
+
+    Attributes:
+        rows (int): The number of evaluated rows.
+        precision (float): The averaged precision.
+        recall (float): The averaged recall.
+        average (str): The averaging used: 'binary', 'micro' or 'macro'.
+        classes (list[str]): The class labels, in the order of the matrix rows and columns.
+        class_precision (list[float]): The precision of each class.
+        class_recall (list[float]): The recall of each class.
+        confusion_matrix (list[list[int]]): Counts of true class (rows) against predicted class (columns).
+    """
+
+    rows: int
+    precision: float
+    recall: float
+    average: str
+    classes: list[str]
+    class_precision: list[float]
+    class_recall: list[float]
+    confusion_matrix: list[list[int]]
+
+
+class MetricAppend(BaseModel):
+    """
+    Pydantic schema for appending per-step metric points to a training.
+
+    Attributes:
+        steps (list[int]): The steps of the points, strictly increasing and after the stored ones.
+        values (dict[str, list[float]]): The values of each metric, one per step, e.g.
+            ``{'loss': [...], 'precision': [...]}``.
+    """
+
+    steps: list[int]
+    values: dict[str, list[float]]
+
+
+class MetricAppendResponse(BaseModel):
+    """
+    Pydantic schema for returning the result of a metric append in the response.
+
+    Attributes:
+        appended (int): The number of points appended over all metrics.
+    """
+
+    appended: int
+
+
+class MetricSummary(BaseModel):
+    """
+    Pydantic schema for describing a recorded metric of a training in the response.
+
+    Attributes:
+        metric (str): The name of the metric.
+        points (int): The number of recorded points.
+        first_step (int): The first recorded step.
+        last_step (int): The last recorded step.
+    """
+
+    metric: str
+    points: int
+    first_step: int
+    last_step: int
+
+
+class MetricSeriesResponse(BaseModel):
+    """
+    Pydantic schema for returning a metric series of a training in the response.
+
+    Attributes:
+        metric (str): The name of the metric.
+        total (int): The number of recorded points in the requested step range.
+        downsampling (str | None): 'lttb' or 'minmax' if the points were downsampled, None
+            if every point of the range is returned.
+        steps (list[int]): The steps of the returned points.
+        values (list[float]): The values of the returned points.
+    """
+
+    metric: str
+    total: int
+    downsampling: str | None = None
+    steps: list[int]
+    values: list[float]
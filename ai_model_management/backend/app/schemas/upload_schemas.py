@@ -0,0 +1,16 @@
+"""Pydantic schemas for resumable file uploads."""
+
+from pydantic import BaseModel
+
+
+class UploadStatus(BaseModel):
+    """
+    Pydantic schema for the state of a resumable data file upload.
+
+    Attributes:
+        upload_id (str): The identifier of the upload.
+        offset (int): The number of bytes received so far, where the next chunk must start.
+    """
+
+    upload_id: str
+    offset: int
@@ -9,15 +9,29 @@ class Token(BaseModel):
 
     Attributes:
         access_token (str): The JWT access token for the user.
+        refresh_token (str | None): The JWT refresh token, exchanged for new tokens at
+            /token/refresh when the access token expires.
         token_type (str): The type of the token (e.g., 'bearer').
         redirect_url (str | None): Optional URL to redirect after successful login.
     """
 
     access_token: str
+    refresh_token: str | None = None
     token_type: str
     redirect_url: str | None = None
 
 
+class RefreshRequest(BaseModel):
+    """
+    Schema for exchanging or revoking a refresh token.
+
+    Attributes:
+        refresh_token (str): The refresh token.
+    """
+
+    refresh_token: str
+
+
 class TokenData(BaseModel):
     """
     Schema for the data extracted from the JWT token.
@@ -84,6 +98,7 @@ class UserResponse(BaseModel):
         registration_date (str): The User's registration date.
         is_admin (bool): Indicates if the user is admin.
     """
+
     id: int
     email: str
     registration_date: str
@@ -96,3 +111,22 @@ class UserResponse(BaseModel):
         """
 
         from_attributes = True
+
+
+class UserUsageResponse(UserResponse):
+    """
+    Schema for returning user data with usage figures for admin.
+
+    The usage figures are only present when requested.
+
+    Attributes:
+        datasets (int): The number of datasets of the user.
+        models (int): The number of models of the user.
+        trainings (int): The number of trainings of the user, archived ones included.
+        last_activity (str | None): The date the user last created a dataset, model or training.
+    """
+
+    datasets: int | None = None
+    models: int | None = None
+    trainings: int | None = None
+    last_activity: str | None = None
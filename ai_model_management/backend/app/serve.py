@@ -0,0 +1,318 @@
+"""
+Production server: a pre-forking master running the application in several uvicorn workers.
+
+Run from the backend directory:
+    python -m app.serve --host 0.0.0.0 --port 8000
+
+The master binds the listening socket and imports the application once, then forks
+the workers, which share the socket and the memory of the preloaded application. It
+replaces workers that crash, and on SIGHUP replaces every worker one at a time, each
+new worker accepting connections before an old one is stopped, so that the server
+keeps answering throughout. SIGTERM or SIGINT stop the workers gracefully.
+
+Workers forked from the master inherit the modules it imported, so SIGHUP does not
+pick up new code: deploying new code requires restarting the master.
+"""
+
+import argparse
+import logging
+import os
+import select
+import signal
+import socket
+import sys
+import threading
+import time
+
+import uvicorn
+
+from .core.rate_limit import MAX_WORKERS, AdmissionController, admission_controller
+
+# Number of worker processes, defaults to the CPUs this process may run on
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', len(os.sched_getaffinity(0))))
+# Length of the queue of connections waiting to be accepted by a worker
+SERVER_BACKLOG = int(os.environ.get('SERVER_BACKLOG', 2048))
+# Seconds an idle keep-alive connection stays open, longer than the idle timeout of a
+# load balancer in front so that it never reuses a connection the worker is closing
+SERVER_KEEP_ALIVE_SECONDS = int(os.environ.get('SERVER_KEEP_ALIVE_SECONDS', 75))
+# Seconds a stopping worker waits for the requests in progress before closing them
+SERVER_GRACEFUL_TIMEOUT_SECONDS = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT_SECONDS', 30))
+
+logger = logging.getLogger('app.serve')
+
+
+class WorkerServer(uvicorn.Server):
+    """
+    Uvicorn server telling the master through a pipe once it accepts connections.
+
+    Attributes:
+        config (uvicorn.Config): The configuration of the server.
+        ready_fd (int): The write end of the pipe read by the master.
+    """
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets: list | None = None):
+        """Start the application and the server, then report readiness."""
+        await super().startup(sockets=sockets)
+        try:
+            if self.started:
+                os.write(self.ready_fd, b'1')
+        except BrokenPipeError:
+            # The master only waits for the workers replacing others in a rolling restart
+            pass
+        finally:
+            os.close(self.ready_fd)
+
+
+class Master:
+    """
+    Fork the workers, keep their number constant and restart them on request.
+
+    Each worker is given a slot of the admission controller, under which it counts
+    the requests it processes. Once a worker has exited, the master gives back the
+    requests of its slot, which a worker killed or crashed could not do.
+
+    Attributes:
+        app: The preloaded ASGI application.
+        sock (socket.socket): The listening socket shared by the workers.
+        workers (int): The number of workers.
+        keep_alive (int): Seconds an idle keep-alive connection stays open.
+        graceful_timeout (int): Seconds a stopping worker waits for the requests in progress.
+        controller (AdmissionController): The admission controller shared by the workers.
+    """
+
+    def __init__(
+        self,
+        app,
+        sock: socket.socket,
+        workers: int,
+        keep_alive: int,
+        graceful_timeout: int,
+        controller: AdmissionController,
+    ):
+        self.app = app
+        self.sock = sock
+        self.workers = workers
+        self.keep_alive = keep_alive
+        self.graceful_timeout = graceful_timeout
+        self.controller = controller
+        self._pids = []
+        # Admission controller slot of each worker, by PID
+        self._slots = {}
+        self._wake = threading.Event()
+        self._stopping = False
+        self._restart = False
+
+    def run(self):
+        """Start the workers and supervise them until asked to stop."""
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_restart)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: self._wake.set())
+        logger.info('Master %d starting %d workers', os.getpid(), self.workers)
+        for _ in range(self.workers):
+            self._spawn()
+
+        while not self._stopping:
+            self._wake.wait(1)
+            self._wake.clear()
+            self._reap()
+            if self._stopping:
+                break
+            if self._restart:
+                self._restart = False
+                self._rolling_restart()
+            while len(self._pids) < self.workers and not self._stopping:
+                self._spawn()
+        self._stop_all()
+
+    def _handle_stop(self, signum, frame):
+        """Stop the server gracefully."""
+        self._stopping = True
+        self._wake.set()
+
+    def _handle_restart(self, signum, frame):
+        """Replace the workers one at a time."""
+        self._restart = True
+        self._wake.set()
+
+    def _spawn(self, wait_ready: bool = False) -> int | None:
+        """
+        Fork a worker.
+
+        Attributes:
+            wait_ready (bool): Wait until the worker accepts connections.
+
+        Returns:
+            int | None: The PID of the worker, None if it did not become ready.
+        """
+        slot = min(set(range(MAX_WORKERS)) - set(self._slots.values()))
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            self._run_worker(write_fd, slot)
+        os.close(write_fd)
+        self._pids.append(pid)
+        self._slots[pid] = slot
+        try:
+            if not wait_ready:
+                return pid
+            # Startup includes the lifespan events of the application
+            ready, _, _ = select.select([read_fd], [], [], self.graceful_timeout)
+            if ready and os.read(read_fd, 1) == b'1':
+                return pid
+            logger.error('Worker %d did not start', pid)
+            self._terminate(pid)
+            return None
+        finally:
+            os.close(read_fd)
+
+    def _run_worker(self, ready_fd: int, slot: int):
+        """Serve requests in the forked worker until it is stopped, then exit."""
+        self.controller.worker_slot = slot
+        # Uvicorn handles SIGTERM and SIGINT while serving, the other signals are the master's
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, signal.SIG_IGN)
+        for signum in (signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        exit_code = 1
+        try:
+            config = uvicorn.Config(
+                self.app,
+                lifespan='on',
+                timeout_keep_alive=self.keep_alive,
+                timeout_graceful_shutdown=self.graceful_timeout,
+            )
+            server = WorkerServer(config, ready_fd)
+            server.run(sockets=[self.sock])
+            exit_code = 0 if server.started else 1
+        # The worker must exit here whatever happens, never return into the code of the master
+        except BaseException:  # noqa: B036
+            logger.exception('Worker %d failed', os.getpid())
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(exit_code)
+
+    def _reap(self):
+        """Collect the exited workers."""
+        while self._pids:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                for pid in list(self._pids):
+                    self._forget(pid)
+                return
+            if pid == 0:
+                return
+            if pid in self._pids:
+                self._forget(pid)
+                if not self._stopping:
+                    logger.warning('Worker %d exited with status %d', pid, status)
+
+    def _forget(self, pid: int):
+        """Drop an exited worker and give back the requests it was processing."""
+        if pid in self._pids:
+            self._pids.remove(pid)
+        slot = self._slots.pop(pid, None)
+        if slot is not None:
+            self.controller.release_worker(slot, pid)
+
+    def _terminate(self, pid: int):
+        """Stop a worker gracefully and wait until it exits."""
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+        deadline = time.monotonic() + self.graceful_timeout + 5
+        while time.monotonic() < deadline:
+            try:
+                done, _ = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if done:
+                break
+            time.sleep(0.05)
+        else:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        self._forget(pid)
+
+    def _rolling_restart(self):
+        """Replace each worker by a new one, starting the new one before stopping the old."""
+        logger.info('Restarting %d workers', len(self._pids))
+        for old_pid in list(self._pids):
+            if self._stopping:
+                return
+            if self._spawn(wait_ready=True) is None:
+                logger.error('Rolling restart aborted, keeping the remaining workers')
+                return
+            self._terminate(old_pid)
+
+    def _stop_all(self):
+        """Stop every worker gracefully."""
+        logger.info('Stopping %d workers', len(self._pids))
+        for pid in list(self._pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in list(self._pids):
+            self._terminate(pid)
+
+
+def bind_socket(host: str, port: int, backlog: int) -> socket.socket:
+    """
+    Create the listening socket shared by the workers.
+
+    Attributes:
+        host (str): The address to listen on.
+        port (int): The port to listen on.
+        backlog (int): The length of the queue of connections not yet accepted.
+
+    Returns:
+        socket.socket: The listening socket.
+    """
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    # Inherited by the accepted connections, small responses are sent without waiting
+    # for the acknowledgement of the previous ones
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def main():
+    """Parse the options, preload the application and run the master."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=WEB_CONCURRENCY)
+    parser.add_argument('--backlog', type=int, default=SERVER_BACKLOG)
+    parser.add_argument('--keep-alive', type=int, default=SERVER_KEEP_ALIVE_SECONDS)
+    parser.add_argument('--graceful-timeout', type=int, default=SERVER_GRACEFUL_TIMEOUT_SECONDS)
+    args = parser.parse_args()
+    if not 0 < args.workers < MAX_WORKERS:
+        parser.error(f'--workers must be between 1 and {MAX_WORKERS - 1}')
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s:     %(message)s')
+
+    # Read by the application modules at import time, e.g. to share the CPUs between
+    # the server workers and the sweep workers
+    os.environ['WEB_CONCURRENCY'] = str(args.workers)
+    sock = bind_socket(args.host, args.port, args.backlog)
+    from .main import app
+
+    Master(
+        app, sock, args.workers, args.keep_alive, args.graceful_timeout, admission_controller
+    ).run()
+
+
+if __name__ == '__main__':
+    main()
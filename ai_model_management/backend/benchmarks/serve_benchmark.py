@@ -0,0 +1,140 @@
+"""
+Compare request throughput of a single uvicorn process against the pre-forking server.
+
+Run from the backend directory:
+    python -m benchmarks.serve_benchmark --clients 64 --seconds 10
+"""
+
+import argparse
+import http.client
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port() -> int:
+    """Return a TCP port nobody listens on."""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(command: list, port: int, workdir: str) -> subprocess.Popen:
+    """
+    Start a server in its own working directory, so it gets fresh databases.
+
+    Attributes:
+        command (list): The command starting the server.
+        port (int): The port the server listens on.
+        workdir (str): The working directory of the server.
+
+    Returns:
+        subprocess.Popen: The server process, once it answers requests.
+    """
+    env = dict(
+        os.environ,
+        PYTHONPATH=BACKEND_DIR,
+        SECRET_KEY=os.environ.get('SECRET_KEY', 'benchmark'),
+        ADMIN_EMAIL='admin@example.com',
+        ADMIN_PASSWORD='admin_password',
+        # Measure the server, not the admission control
+        RATE_LIMIT_READS='1000000/1000000',
+        MAX_IN_FLIGHT_REQUESTS='100000',
+    )
+    process = subprocess.Popen(
+        command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/home')
+            connection.getresponse().read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f'{command} did not start')
+
+
+def run_clients(port: int, clients: int, seconds: float, path: str) -> float:
+    """
+    Send requests from concurrent keep-alive clients.
+
+    Attributes:
+        port (int): The port the server listens on.
+        clients (int): Number of concurrent clients.
+        seconds (float): Duration of the load.
+        path (str): The requested path.
+
+    Returns:
+        float: Successful requests per second.
+    """
+    counts = [0] * clients
+    deadline = time.monotonic() + seconds
+
+    def client(number):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.monotonic() < deadline:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            if response.status == 200:
+                counts[number] += 1
+        connection.close()
+
+    pool = [threading.Thread(target=client, args=(n,)) for n in range(clients)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return sum(counts) / (time.perf_counter() - start)
+
+
+def measure(command: list, port: int, args) -> float:
+    """Start a server, load it and stop it, returning its throughput."""
+    with tempfile.TemporaryDirectory() as workdir:
+        process = start_server(command, port, workdir)
+        try:
+            return run_clients(port, args.clients, args.seconds, args.path)
+        finally:
+            process.terminate()
+            process.wait()
+
+
+def main():
+    """Run both servers one after the other and print their throughput."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=len(os.sched_getaffinity(0)))
+    parser.add_argument('--path', default='/home')
+    args = parser.parse_args()
+
+    port = free_port()
+    single = measure(
+        [sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(port)], port, args
+    )
+    port = free_port()
+    preforked = measure(
+        [sys.executable, '-m', 'app.serve', '--port', str(port), '--workers', str(args.workers)],
+        port,
+        args,
+    )
+
+    print(f'single process:        {single:10.0f} requests/s')
+    print(
+        f'{args.workers:3d} pre-forked workers: {preforked:10.0f} requests/s '
+        f'({preforked / single:.1f}x)'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Compare insert throughput of one commit per insert against the group-commit write batcher.
+
+Run from the backend directory:
+    python -m benchmarks.write_batcher_benchmark --threads 32 --inserts 200
+"""
+
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.database.config import Base
+from app.database.db_models import Dataset
+from app.database.write_batcher import WriteBatcher
+
+
+def make_session_factory(path: str) -> sessionmaker:
+    """
+    Create a fresh SQLite database file with the application tables.
+
+    Attributes:
+        path (str): Location of the database file.
+
+    Returns:
+        sessionmaker: A session factory bound to the new database.
+    """
+    engine = create_engine(f'sqlite:///{path}', connect_args={'check_same_thread': False})
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+
+def run_threads(threads: int, inserts: int, insert_one) -> float:
+    """
+    Run the inserts from concurrent threads.
+
+    Attributes:
+        threads (int): Number of concurrent writer threads.
+        inserts (int): Number of inserts per thread.
+        insert_one (callable): Function inserting a single row.
+
+    Returns:
+        float: Inserts committed per second.
+    """
+
+    def worker(worker_id):
+        for i in range(inserts):
+            insert_one(Dataset(name=f'dataset-{worker_id}-{i}', user_id=1))
+
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return threads * inserts / (time.perf_counter() - start)
+
+
+def main():
+    """Run both strategies on separate databases and print their throughput."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--inserts', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        session_factory = make_session_factory(os.path.join(tmp, 'commit_per_insert.db'))
+        lock = threading.Lock()
+
+        def commit_per_insert(obj):
+            # SQLite allows one writer, serialize like the routes do on the database lock
+            with lock:
+                db = session_factory()
+                db.add(obj)
+                db.commit()
+                db.close()
+
+        baseline = run_threads(args.threads, args.inserts, commit_per_insert)
+
+        batcher = WriteBatcher(make_session_factory(os.path.join(tmp, 'batched.db')))
+        batched = run_threads(args.threads, args.inserts, batcher.insert)
+        batcher.close()
+
+    print(f'commit per insert: {baseline:10.0f} inserts/s')
+    print(f'write batcher:     {batched:10.0f} inserts/s ({batched / baseline:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,290 @@
+"""
+Hammer every write route from concurrent processes and threads, then check the rows.
+
+Run from the backend directory:
+    python -m benchmarks.write_stress --workers 4 --processes 4 --threads 8 --rounds 10
+
+The server runs with several workers and a short SQLite busy timeout, so that the
+writers contend for the database lock and the transactions have to retry. Each
+client thread signs up its own user, then creates datasets, models, trainings and
+sweeps, and deletes some of them and a throwaway user through the admin routes. Once
+the server stopped, the database must hold exactly the rows whose creation succeeded
+and that were not deleted, each once, and no request may have failed with a 500.
+Exits with status 1 otherwise. Requests answered with 503 because the database stayed
+busy wrote nothing and are sent again, like a client honouring Retry-After would.
+
+With ``--shards``, the server stores each user's records in their own shard, and the
+rows are checked across the main database and every shard.
+"""
+
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from benchmarks.serve_benchmark import BACKEND_DIR, free_port
+
+ADMIN_EMAIL = 'admin@example.com'
+ADMIN_PASSWORD = 'admin_password'
+SWEEP_GRID = {'learning_rate': [0.1, 0.01]}
+# Times a request answered with 503 is sent before giving up
+BUSY_ATTEMPTS = 50
+
+
+class Client:
+    """
+    Keep-alive JSON client recording the status of every request.
+
+    Attributes:
+        port (int): The port the server listens on.
+        statuses (Counter): Number of responses by status code.
+    """
+
+    def __init__(self, port: int, statuses: Counter):
+        self.port = port
+        self.statuses = statuses
+        self.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=120)
+        self.headers = {'Content-Type': 'application/json'}
+
+    def request(self, method: str, path: str, body: dict | None = None) -> dict | None:
+        """
+        Send a request and return its JSON body, or None if it did not succeed.
+
+        A 503 means the database stayed locked and nothing was written, so the request
+        is sent again, after a short random delay rather than the Retry-After header
+        to keep the load up.
+        """
+        for _ in range(BUSY_ATTEMPTS):
+            self.connection.request(
+                method, path, body=json.dumps(body) if body else None, headers=self.headers
+            )
+            response = self.connection.getresponse()
+            data = response.read()
+            self.statuses[response.status] += 1
+            if response.status != 503:
+                break
+            time.sleep(random.uniform(0, 0.1))
+        return json.loads(data) if response.status == 200 else None
+
+    def sign_in(self, email: str, password: str, path: str = '/token') -> bool:
+        """Sign up or log in, and authenticate the following requests."""
+        token = self.request('POST', path, {'email': email, 'password': password})
+        if token is None:
+            return False
+        self.headers['Authorization'] = f"Bearer {token['access_token']}"
+        return True
+
+
+def hammer(port: int, name: str, rounds: int, admin: Client, expected: dict):
+    """
+    Run the writes of one client thread and record the rows that must exist.
+
+    Attributes:
+        port (int): The port the server listens on.
+        name (str): A name unique to the thread, prefixing the names of its rows.
+        rounds (int): Number of rounds of creations and deletions.
+        admin (Client): A client authenticated as the admin, used for the deletions.
+        expected (dict): Names of the rows expected in each table, filled in.
+    """
+    # Responses are counted with the ones of the admin client of the thread
+    client = Client(port, admin.statuses)
+    email = f'{name}@example.com'
+    if client.sign_in(email, 'password', path='/signin'):
+        expected['users'].append(email)
+    for number in range(rounds):
+        dataset = client.request('POST', '/datasets', {'name': f'{name}-dataset-{number}'})
+        if dataset is not None:
+            expected['datasets'].append(dataset['name'])
+        model = client.request('POST', '/models', {'name': f'{name}-model-{number}'})
+        if model is not None:
+            expected['models'].append(model['name'])
+        if dataset is None or model is None:
+            continue
+        training = client.request(
+            'POST',
+            '/trainings',
+            {
+                'training_name': f'{name}-training-{number}',
+                'model_id': model['id'],
+                'dataset_id': dataset['id'],
+                'params': {'learning_rate': number},
+            },
+        )
+        if training is not None:
+            expected['trainings'].append(training['training_name'])
+        sweep = client.request(
+            'POST',
+            '/sweeps',
+            {
+                'sweep_name': f'{name}-sweep-{number}',
+                'model_id': model['id'],
+                'dataset_id': dataset['id'],
+                'grid': SWEEP_GRID,
+            },
+        )
+        if sweep is not None:
+            expected['trainings'].extend(
+                f"{sweep['sweep_name']}-{index}" for index in range(1, sweep['total'] + 1)
+            )
+        # Every other round deletes the dataset, the others delete the model
+        if number % 2:
+            if admin.request('DELETE', f"/admin/datasets/{dataset['id']}") is not None:
+                expected['datasets'].remove(dataset['name'])
+        elif admin.request('DELETE', f"/admin/models/{model['id']}") is not None:
+            expected['models'].remove(model['name'])
+
+    throwaway = Client(port, admin.statuses)
+    email = f'{name}-throwaway@example.com'
+    if throwaway.sign_in(email, 'password', path='/signin'):
+        if admin.request('POST', f'/admin/users/delete/{email}') is None:
+            expected['users'].append(email)
+
+
+def run_process(port: int, process: int, threads: int, rounds: int) -> tuple:
+    """
+    Run the client threads of one client process.
+
+    Returns:
+        tuple: The expected rows by table and the number of responses by status code.
+    """
+    expected = {'users': [], 'datasets': [], 'models': [], 'trainings': []}
+    pool, counters = [], []
+    for thread in range(threads):
+        # Each thread counts its own responses, Counter updates are not atomic
+        admin = Client(port, Counter())
+        admin.sign_in(ADMIN_EMAIL, ADMIN_PASSWORD)
+        counters.append(admin.statuses)
+        pool.append(
+            threading.Thread(
+                target=hammer, args=(port, f'client-{process}-{thread}', rounds, admin, expected)
+            )
+        )
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    statuses = sum(counters, Counter())
+    return expected, statuses
+
+
+def check_rows(paths: list, expected: dict) -> list:
+    """
+    Compare the rows of each table, across the databases holding it, with the expected ones.
+
+    Returns:
+        list: A description of each lost, duplicated or unexpected row.
+    """
+    columns = {'users': 'email', 'datasets': 'name', 'models': 'name', 'trainings': 'training_name'}
+    found = {table: Counter() for table in columns}
+    for path in paths:
+        with sqlite3.connect(path) as conn:
+            tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master")}
+            for table, column in columns.items():
+                if table in tables:
+                    found[table].update(
+                        value
+                        for (value,) in conn.execute(f'SELECT {column} FROM {table}')
+                        if value != ADMIN_EMAIL
+                    )
+    problems = []
+    for table in columns:
+        wanted = Counter(expected[table])
+        for value in wanted - found[table]:
+            problems.append(f'{table}: lost {value}')
+        for value, count in (found[table] - wanted).items():
+            kind = 'duplicated' if value in wanted else 'unexpected'
+            problems.append(f'{table}: {kind} {value} ({count} extra)')
+    return problems
+
+
+def main():
+    """Start the server, run the clients, stop the server and check the database."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=10)
+    parser.add_argument('--busy-timeout', type=float, default=0.2)
+    parser.add_argument('--shards', action='store_true', help='Store each user in a shard')
+    args = parser.parse_args()
+
+    port = free_port()
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(
+            os.environ,
+            PYTHONPATH=BACKEND_DIR,
+            SECRET_KEY=os.environ.get('SECRET_KEY', 'stress'),
+            ADMIN_EMAIL=ADMIN_EMAIL,
+            ADMIN_PASSWORD=ADMIN_PASSWORD,
+            SQLITE_BUSY_TIMEOUT_SECONDS=str(args.busy_timeout),
+            # Stress the database, not the admission control
+            RATE_LIMIT_AUTH='1000000/1000000',
+            RATE_LIMIT_WRITES='1000000/1000000',
+            RATE_LIMIT_READS='1000000/1000000',
+            MAX_IN_FLIGHT_REQUESTS='100000',
+            DATABASE_SHARDS_DIR='shards' if args.shards else '',
+        )
+        command = [sys.executable, '-m', 'app.serve', '--port', str(port)]
+        server = subprocess.Popen([*command, '--workers', str(args.workers)], cwd=workdir, env=env)
+        try:
+            deadline = time.monotonic() + 60
+            while True:
+                admin = Client(port, Counter())
+                try:
+                    if admin.sign_in(ADMIN_EMAIL, ADMIN_PASSWORD):
+                        break
+                except OSError:
+                    pass
+                if time.monotonic() > deadline:
+                    raise RuntimeError('The server did not start')
+                time.sleep(0.2)
+
+            start = time.perf_counter()
+            with multiprocessing.Pool(args.processes) as pool:
+                results = pool.starmap(
+                    run_process,
+                    [
+                        (port, process, args.threads, args.rounds)
+                        for process in range(args.processes)
+                    ],
+                )
+            elapsed = time.perf_counter() - start
+            stats = admin.request('GET', '/admin/transactions')
+        finally:
+            server.terminate()
+            server.wait()
+
+        expected = {'users': [], 'datasets': [], 'models': [], 'trainings': []}
+        statuses = Counter()
+        for process_expected, process_statuses in results:
+            for table, values in process_expected.items():
+                expected[table].extend(values)
+            statuses.update(process_statuses)
+        shards_dir = os.path.join(workdir, 'shards')
+        shards = sorted(os.listdir(shards_dir)) if os.path.isdir(shards_dir) else []
+        paths = [os.path.join(workdir, 'app.db')]
+        paths += [os.path.join(shards_dir, name) for name in shards if name.endswith('.db')]
+        problems = check_rows(paths, expected)
+
+    print(f'{sum(statuses.values())} requests in {elapsed:.1f}s, responses: {dict(statuses)}')
+    print(f'transactions: {stats}')
+    for problem in problems:
+        print(problem)
+    errors = sum(count for code, count in statuses.items() if code >= 500 and code != 503)
+    if problems or errors:
+        print(f'FAILED: {len(problems)} row problems, {errors} server errors')
+        sys.exit(1)
+    print('OK: no lost or duplicated rows')
+
+
+if __name__ == '__main__':
+    main()